@@ -0,0 +1,125 @@
+# analytics.py
+# Partner impact reports (meals rescued, claim-to-pickup latency, expiry waste)
+# per area and period. Reports read only the impact_rollups table that db.py
+# keeps up to date, never listings or claims.
+#
+#   python analytics.py --granularity week --start 2026-01-01 > report.csv
+#   python analytics.py --backfill     # one-off: rebuild rollups from history
+import argparse
+import csv
+import sys
+from db import get_read_conn, create_analytics_tables_if_not_exists, ROLLUP_METRICS
+import shards
+from maps_utils import geocell
+
+PERIODS = {
+    "hour": "bucket_hour",
+    "day": "substr(bucket_hour, 1, 10)",
+    # Monday of the bucket's week
+    "week": "date(bucket_hour, '-6 days', 'weekday 1')",
+}
+
+REPORT_COLUMNS = [
+    "period", "geocell", "listings_created", "claims_reserved", "meals_rescued",
+    "pickups_completed", "listings_expired", "expiry_waste_rate", "avg_pickup_minutes",
+]
+
+def export_rollups(start=None, end=None, granularity="day", area=None):
+    """
+    Returns report rows (dicts with REPORT_COLUMNS) per period and geocell.
+    start/end are 'YYYY-MM-DD' strings, end exclusive; area filters to one geocell.
+    """
+    if granularity not in PERIODS:
+        raise ValueError(f"granularity must be one of {sorted(PERIODS)}")
+    clauses, params = [], []
+    if start:
+        clauses.append("bucket_hour >= ?")
+        params.append(start)
+    if end:
+        clauses.append("bucket_hour < ?")
+        params.append(end)
+    if area:
+        clauses.append("geocell = ?")
+        params.append(area)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+
+    conn = get_read_conn()
+    cur = conn.cursor()
+    cur.execute(f"""
+        SELECT {PERIODS[granularity]} AS period, geocell, metric, SUM(value) AS total
+        FROM impact_rollups
+        {where}
+        GROUP BY period, geocell, metric
+        ORDER BY period, geocell
+    """, params)
+    report = {}
+    for row in cur:
+        key = (row["period"], row["geocell"])
+        entry = report.setdefault(key, {"period": key[0], "geocell": key[1], **{m: 0 for m in ROLLUP_METRICS}})
+        total = row["total"]
+        entry[row["metric"]] = total if row["metric"] == "pickup_latency_seconds" else int(total)
+    conn.close()
+
+    rows = []
+    for entry in report.values():
+        created = entry["listings_created"]
+        pickups = entry["pickups_completed"]
+        entry["expiry_waste_rate"] = round(entry["listings_expired"] / created, 3) if created else None
+        entry["avg_pickup_minutes"] = round(entry["pickup_latency_seconds"] / pickups / 60, 1) if pickups else None
+        rows.append({col: entry[col] for col in REPORT_COLUMNS})
+    return rows
+
+def write_csv(rows, out):
+    writer = csv.DictWriter(out, fieldnames=REPORT_COLUMNS)
+    writer.writeheader()
+    writer.writerows(rows)
+
+def backfill_rollups():
+    """Rebuilds impact_rollups from the full listings/claims history. Offline use only."""
+    create_analytics_tables_if_not_exists()
+    conn = shards.connect_all()
+    conn.create_function("geocell", 2, geocell, deterministic=True)
+    cur = conn.cursor()
+    hour = "strftime('%Y-%m-%d %H:00:00', {}, 'unixepoch')"
+    sources = [
+        ("listings_created", "1", hour.format("l.created_ts"), "all_listings l", "l.created_ts IS NOT NULL"),
+        ("listings_expired", "1", hour.format("l.expiry_ts"), "all_listings l", "l.status = 'EXPIRED'"),
+        ("claims_reserved", "1", hour.format("c.reserved_ts"),
+         "all_claims c JOIN all_listings l ON l.id = c.listing_id", "c.reserved_ts IS NOT NULL"),
+        ("meals_rescued", "COALESCE(c.quantity, 1)", hour.format("c.completed_ts"),
+         "all_claims c JOIN all_listings l ON l.id = c.listing_id", "c.status = 'COMPLETED' AND c.completed_ts IS NOT NULL"),
+        ("pickups_completed", "1", hour.format("c.completed_ts"),
+         "all_claims c JOIN all_listings l ON l.id = c.listing_id", "c.status = 'COMPLETED' AND c.completed_ts IS NOT NULL"),
+        ("pickup_latency_seconds", "c.completed_ts - c.reserved_ts",
+         hour.format("c.completed_ts"),
+         "all_claims c JOIN all_listings l ON l.id = c.listing_id", "c.status = 'COMPLETED' AND c.completed_ts IS NOT NULL"),
+    ]
+    try:
+        cur.execute("BEGIN IMMEDIATE;")
+        cur.execute("DELETE FROM impact_rollups")
+        for metric, value, bucket, source, condition in sources:
+            cur.execute(f"""
+                INSERT INTO impact_rollups (bucket_hour, geocell, metric, value)
+                SELECT {bucket} AS b, geocell(l.lat, l.lng) AS g, ?, SUM({value})
+                FROM {source}
+                WHERE {condition} AND {bucket} IS NOT NULL
+                GROUP BY b, g
+            """, (metric,))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export impact rollups as CSV")
+    parser.add_argument("--start", help="first day, YYYY-MM-DD")
+    parser.add_argument("--end", help="day after the last day, YYYY-MM-DD")
+    parser.add_argument("--granularity", choices=sorted(PERIODS), default="day")
+    parser.add_argument("--area", help="restrict to one geocell, e.g. 12.90,77.60")
+    parser.add_argument("--backfill", action="store_true", help="rebuild rollups from history first")
+    args = parser.parse_args()
+    if args.backfill:
+        backfill_rollups()
+    write_csv(export_rollups(args.start, args.end, args.granularity, args.area), sys.stdout)
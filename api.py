@@ -0,0 +1,510 @@
+# api.py
+# JSON API next to the Streamlit UI, for mobile apps and partner integrations.
+# The handlers are async (Starlette, any ASGI server); every db.py / auth.py
+# call is blocking SQLite work and runs on a small dedicated thread pool, so
+# the event loop only ever waits on sockets.
+#
+#   uvicorn api:app --port 8000          (or: python api.py --port 8000)
+#
+# POST /api/token with {"email", "password"} returns a bearer token; send it as
+# "Authorization: Bearer <token>" on every other call. Errors are
+# {"error": "<message>"} with a 4xx status; 429 (throttled logins, claims,
+# new listings and exports, see ratelimit.py) comes with a Retry-After header.
+#
+#   GET    /api/listings                  ?sort=recommended|newest &lat &lng &limit &offset
+#   GET    /api/listings/nearby           ?lat &lng &radius_km &limit
+#   GET    /api/listings/expiring         ?hours &limit (soonest deadline first, see urgency.py)
+#   GET    /api/listings/{id}
+#   POST   /api/listings                  {"title", "quantity_total", "quantity_unit", "lat", "lng", ...}
+#   POST   /api/listings/{id}/claim       {"portions"} (optional; default everything left)
+#   POST   /api/claims/batch              {"listing_ids", "mode"}
+#   GET    /api/claims
+#   POST   /api/claims/{id}/complete      (donor confirms pickup)
+#   GET    /api/notifications             ?limit
+#   POST   /api/notifications/{id}/read
+#   GET    /api/stats
+#   GET    /api/exports/{table}           claims|listings|reviews ?format=csv|parquet &start &end (streamed, see exports.py)
+#   GET    /api/listings/stream           server-sent events: listing.created / .updated / .removed
+import argparse
+import asyncio
+import contextlib
+import functools
+import itertools
+import json
+import logging
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from starlette.applications import Starlette
+from starlette.background import BackgroundTask
+from starlette.exceptions import HTTPException
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+# db.py imports streamlit, which re-levels the uvicorn loggers and adds its own
+# console handler to them; put back whatever the ASGI server configured
+_SERVER_LOGGERS = {
+    name: (logging.getLogger(name).level, list(logging.getLogger(name).handlers))
+    for name in ("uvicorn", "uvicorn.access", "uvicorn.asgi", "uvicorn.error")
+}
+import db
+import events
+import exports
+import ratelimit
+import shards
+import urgency
+for _name, (_level, _handlers) in _SERVER_LOGGERS.items():
+    logging.getLogger(_name).setLevel(_level)
+    logging.getLogger(_name).handlers = _handlers
+from auth import get_user_by_email, verify_password, issue_api_token, get_user_by_api_token, revoke_api_token
+from db import get_setting, CLAIM_MODES, QUANTITY_UNITS
+from log_utils import get_logger, setup_logging
+
+log = get_logger("api")
+
+API_DB_THREADS = int(get_setting("api_db_threads", 8))
+API_TOKEN_DAYS = int(get_setting("api_token_days", 30))
+MAX_PAGE = 200
+MAX_RADIUS_KM = 50.0
+MAX_BATCH = 20
+STREAM_HEARTBEAT_SECONDS = 15
+STREAM_QUEUE_SIZE = 500
+PUBLIC_USER_FIELDS = ("id", "name", "email", "phone", "user_type", "ngo_verified", "created_at")
+
+_pool = ThreadPoolExecutor(max_workers=API_DB_THREADS, thread_name_prefix="api-db")
+
+async def run_db(fn, *args, **kwargs):
+    """Runs a blocking db/auth call on the API's thread pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_pool, functools.partial(fn, *args, **kwargs))
+
+class ApiError(Exception):
+    def __init__(self, status, message, headers=None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.headers = headers
+
+async def _api_error(request, exc):
+    return JSONResponse({"error": exc.message}, status_code=exc.status, headers=exc.headers)
+
+async def _http_error(request, exc):
+    return JSONResponse({"error": exc.detail}, status_code=exc.status_code)
+
+# --- Request helpers ---
+
+def _public_user(user):
+    return {k: user[k] for k in PUBLIC_USER_FIELDS if k in user.keys()}
+
+async def _current_user(request, allow_query_token=False):
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if allow_query_token and not token:
+        # Browsers' EventSource cannot set headers
+        scheme, token = "bearer", request.query_params.get("access_token", "")
+    if scheme.lower() != "bearer" or not token.strip():
+        raise ApiError(401, "missing bearer token")
+    user = await run_db(get_user_by_api_token, token.strip())
+    if user is None:
+        raise ApiError(401, "invalid or expired token")
+    return dict(user)
+
+async def _body(request):
+    try:
+        body = await request.json()
+    except ValueError:
+        raise ApiError(400, "body must be JSON")
+    if not isinstance(body, dict):
+        raise ApiError(400, "body must be a JSON object")
+    return body
+
+def _number(value, name, cast=float, required=False, minimum=None, maximum=None, default=None):
+    if value is None or value == "":
+        if required:
+            raise ApiError(400, f"{name} is required")
+        return default
+    try:
+        value = cast(value)
+    except (TypeError, ValueError):
+        raise ApiError(400, f"{name} must be a number")
+    if minimum is not None and value < minimum:
+        raise ApiError(400, f"{name} must be at least {minimum}")
+    if maximum is not None and value > maximum:
+        raise ApiError(400, f"{name} must be at most {maximum}")
+    return value
+
+def _query(request, name, cast=float, **kwargs):
+    return _number(request.query_params.get(name), name, cast, **kwargs)
+
+def _visible(listing, user):
+    return listing is not None and (listing["visibility"] != "ngo_only" or user["user_type"] == "NGO")
+
+async def _visible_listing(listing_id, user):
+    listing = await run_db(db.get_listing_by_id, listing_id)
+    if not _visible(listing, user):
+        raise ApiError(404, "listing not found")
+    return dict(listing)
+
+async def _throttle(request, action, cost=1, **keys):
+    # The sqlite store writes, so it goes through the pool like any other db call
+    ip = request.client.host if request.client else None
+    retry_after = await run_db(ratelimit.check, action, cost, ip=ip, **keys)
+    if retry_after:
+        raise ApiError(429, f"too many requests; try again in {ratelimit.describe(retry_after)}",
+                       headers={"Retry-After": str(math.ceil(retry_after))})
+
+# --- Auth ---
+
+async def create_token(request):
+    body = await _body(request)
+    email = str(body.get("email", "")).strip()
+    # Throttled before the bcrypt check, so guessing costs the server nothing
+    await _throttle(request, "login", email=email)
+    user = await run_db(get_user_by_email, email)
+    # bcrypt is deliberately slow; keep it off the event loop as well
+    if user is None or not await run_db(verify_password, str(body.get("password", "")), user["password_hash"]):
+        raise ApiError(401, "wrong email or password")
+    token, expires_at = await run_db(issue_api_token, user["id"], API_TOKEN_DAYS)
+    return JSONResponse({"token": token, "expires_at": expires_at, "user": _public_user(user)}, status_code=201)
+
+async def delete_token(request):
+    await _current_user(request)
+    await run_db(revoke_api_token, request.headers["authorization"].partition(" ")[2].strip())
+    return JSONResponse({"revoked": True})
+
+# --- Listings ---
+
+# Recommended order: each user's ranking is kept for RANKING_TTL_SECONDS, but
+# the rows on a page are always re-read, so claimed listings drop out and
+# remaining quantities are current. New listings join the ranking when it expires.
+RANKING_TTL_SECONDS = 60
+MAX_RANKINGS = 1000
+_rankings = {}  # (user_id, origin) -> (expires_at, [(listing_id, score, distance_km, hours_left)])
+
+def _ranking(user_id, origin):
+    key = (user_id, origin)
+    cached = _rankings.get(key)
+    if cached and cached[0] > time.monotonic():
+        return cached[1]
+    from recommend import rank_listings
+    ranked = rank_listings(db.get_available_listings(user_id), db.get_receiver_claim_history(user_id), origin)
+    ranking = [(l["id"], l["score"], l["distance_km"], l["hours_left"]) for l in ranked]
+    if len(_rankings) >= MAX_RANKINGS:
+        _rankings.pop(next(iter(_rankings)), None)  # oldest insertion first
+    _rankings[key] = (time.monotonic() + RANKING_TTL_SECONDS, ranking)
+    return ranking
+
+def _recommended_page(user_id, origin, limit, offset):
+    page = _ranking(user_id, origin)[offset:offset + limit]
+    rows = db.get_available_listings_by_ids([listing_id for listing_id, *_ in page])
+    listings = []
+    for listing_id, score, distance_km, hours_left in page:
+        if listing_id in rows:
+            listings.append(dict(rows[listing_id], score=score, distance_km=distance_km, hours_left=hours_left))
+    return listings
+
+def _newest_page(user_id, limit, offset):
+    return [dict(r) for r in db.get_available_listings(user_id, limit, offset)]
+
+async def list_listings(request):
+    user = await _current_user(request)
+    sort = request.query_params.get("sort", "recommended")
+    if sort not in ("recommended", "newest"):
+        raise ApiError(400, "sort must be recommended or newest")
+    lat = _query(request, "lat", minimum=-90, maximum=90)
+    lng = _query(request, "lng", minimum=-180, maximum=180)
+    limit = _query(request, "limit", int, minimum=1, maximum=MAX_PAGE, default=50)
+    offset = _query(request, "offset", int, minimum=0, default=0)
+    if sort == "newest":
+        listings = await run_db(_newest_page, user["id"], limit, offset)
+    else:
+        # Rounded like cached_recommended_listings, so GPS jitter reuses the ranking
+        origin = (round(lat, 3), round(lng, 3)) if lat is not None and lng is not None else None
+        listings = await run_db(_recommended_page, user["id"], origin, limit, offset)
+    return JSONResponse({"listings": listings})
+
+async def nearby_listings(request):
+    user = await _current_user(request)
+    lat = _query(request, "lat", required=True, minimum=-90, maximum=90)
+    lng = _query(request, "lng", required=True, minimum=-180, maximum=180)
+    radius_km = _query(request, "radius_km", minimum=0.1, maximum=MAX_RADIUS_KM, default=5.0)
+    limit = _query(request, "limit", int, minimum=1, maximum=MAX_PAGE, default=50)
+    listings = await run_db(db.get_nearby_listings, user["id"], lat, lng, radius_km, limit)
+    return JSONResponse({"listings": [dict(l) for l in listings]})
+
+async def expiring_listings(request):
+    user = await _current_user(request)
+    hours = _query(request, "hours", minimum=1, maximum=urgency.HORIZON_HOURS, default=urgency.EXPIRING_SOON_HOURS)
+    limit = _query(request, "limit", int, minimum=1, maximum=MAX_PAGE, default=20)
+    listings = await run_db(urgency.expiring_soon, user["user_type"], hours, limit)
+    return JSONResponse({"listings": [dict(l) for l in listings]})
+
+async def get_listing(request):
+    user = await _current_user(request)
+    return JSONResponse(await _visible_listing(request.path_params["listing_id"], user))
+
+async def create_listing(request):
+    user = await _current_user(request)
+    body = await _body(request)
+    await _throttle(request, "create_listing", user=user["id"])
+    if not str(body.get("title") or "").strip():
+        raise ApiError(400, "title is required")
+    unit = body.get("quantity_unit", QUANTITY_UNITS[0])
+    if unit not in QUANTITY_UNITS:
+        raise ApiError(400, f"quantity_unit must be one of {', '.join(QUANTITY_UNITS)}")
+    visibility = body.get("visibility", "everyone")
+    if visibility not in ("everyone", "ngo_only"):
+        raise ApiError(400, "visibility must be everyone or ngo_only")
+    data = {
+        "donor_id": user["id"],
+        "title": str(body["title"]).strip(),
+        "notes": body.get("notes"),
+        "food_type": body.get("food_type"),
+        "veg": bool(body.get("veg", True)),
+        "cuisine": body.get("cuisine"),
+        "prepared_at": body.get("prepared_at"),
+        "expiry_at": body.get("expiry_at"),
+        "quantity_total": _number(body.get("quantity_total"), "quantity_total", int, required=True, minimum=1),
+        "quantity_unit": unit,
+        "visibility": visibility,
+        "lat": _number(body.get("lat"), "lat", required=True, minimum=-90, maximum=90),
+        "lng": _number(body.get("lng"), "lng", required=True, minimum=-180, maximum=180),
+        "address_text": body.get("address_text"),
+    }
+    listing_id = await run_db(db.create_listing, data)
+    return JSONResponse({"id": listing_id}, status_code=201)
+
+# --- Claims ---
+
+def _notify(outcomes, receiver):
+    from notify_utils import notify_donors_of_claims
+    try:
+        notify_donors_of_claims(outcomes, receiver)
+    except Exception:
+        log.exception("Error notifying donors", extra={"receiver_id": receiver["id"]})
+
+async def claim_listing(request):
+    user = await _current_user(request)
+    listing = await _visible_listing(request.path_params["listing_id"], user)
+    body = await _body(request) if await request.body() else {}
+    portions = _number(body.get("portions"), "portions", int, minimum=1)
+    await _throttle(request, "claim", user=user["id"])
+    claim_id = await run_db(db.atomic_claim_listing, listing["id"], user["id"], ttl_minutes=60, portions=portions)
+    if claim_id is None:
+        raise ApiError(409, "listing is no longer available" if portions is None else "not enough left")
+    taken = (await run_db(db.get_claim, claim_id))["quantity"]
+    outcome = {"listing_id": listing["id"], "status": "reserved", "claim_id": claim_id, "quantity": taken,
+               "donor_id": listing["donor_id"], "title": listing["title"], "unit": listing["quantity_unit"]}
+    # The donor is told after the response goes out
+    return JSONResponse({"claim_id": claim_id, "portions": taken}, status_code=201,
+                        background=BackgroundTask(run_db, _notify, [outcome], user))
+
+async def batch_claim(request):
+    user = await _current_user(request)
+    body = await _body(request)
+    listing_ids = body.get("listing_ids")
+    if not isinstance(listing_ids, list) or not 0 < len(listing_ids) <= MAX_BATCH:
+        raise ApiError(400, f"listing_ids must be a list of 1 to {MAX_BATCH} ids")
+    listing_ids = [_number(lid, "listing_ids", int) for lid in listing_ids]
+    mode = body.get("mode", "all_or_nothing")
+    if mode not in CLAIM_MODES:
+        raise ApiError(400, f"mode must be one of {', '.join(CLAIM_MODES)}")
+    listings = await run_db(lambda: [db.get_listing_by_id(lid) for lid in listing_ids])
+    # Missing ids come back as "not_found" outcomes; NGO-only ones must not be claimable by others
+    if any(l is not None and not _visible(l, user) for l in listings):
+        raise ApiError(404, "listing not found")
+    await _throttle(request, "claim", cost=len(listing_ids), user=user["id"])
+    outcomes = await run_db(db.batch_claim_listings, listing_ids, user["id"], mode=mode, ttl_minutes=60)
+    if outcomes is None:
+        raise ApiError(503, "could not reserve the listings, please retry")
+    return JSONResponse({"outcomes": outcomes}, background=BackgroundTask(run_db, _notify, outcomes, user))
+
+async def my_claims(request):
+    user = await _current_user(request)
+    rows = await run_db(db.get_receiver_claims, user["id"])
+    return JSONResponse({"claims": [dict(r) for r in rows]})
+
+async def complete_claim(request):
+    user = await _current_user(request)
+    claim = await run_db(db.get_claim, request.path_params["claim_id"])
+    if claim is None or claim["donor_id"] != user["id"]:
+        raise ApiError(404, "claim not found")
+    if not await run_db(db.complete_claim_and_award_points, claim["id"], user["id"], claim["receiver_id"]):
+        raise ApiError(409, "claim is not awaiting pickup")
+    return JSONResponse({"claim_id": claim["id"], "status": "COMPLETED"})
+
+# --- Notifications and stats ---
+
+async def notifications(request):
+    user = await _current_user(request)
+    limit = _query(request, "limit", int, minimum=1, maximum=MAX_PAGE, default=20)
+    inbox = await run_db(db.get_notification_inbox, user["id"], limit)
+    return JSONResponse({"notifications": [dict(n) for n in inbox["notifications"]],
+                         "unread_count": inbox["unread_count"]})
+
+async def read_notification(request):
+    user = await _current_user(request)
+    if not await run_db(db.mark_notification_as_read, request.path_params["notification_id"], user["id"]):
+        raise ApiError(404, "notification not found")
+    return JSONResponse({"read": True})
+
+async def stats(request):
+    user = await _current_user(request)
+    user_stats = await run_db(db.get_user_stats, user["id"], allow_snapshot=False)
+    badges = await run_db(db.get_user_badges, user["id"])
+    return JSONResponse({"stats": user_stats, "badges": badges})
+
+# --- Exports ---
+
+async def export_history(request):
+    user = await _current_user(request)
+    table = request.path_params["table"]
+    fmt = request.query_params.get("format", "csv")
+    if table not in exports.EXPORTS:
+        raise ApiError(404, "unknown export")
+    if fmt not in exports.FORMATS:
+        raise ApiError(400, f"format must be one of {', '.join(exports.FORMATS)}")
+    await _throttle(request, "export", user=user["id"])
+    chunks = exports.stream_export(table, fmt, user["id"],
+                                   request.query_params.get("start"), request.query_params.get("end"))
+    # The first chunk takes an export slot and checks the dates, so errors still get a status code;
+    # the rest is read batch by batch as the client downloads it
+    try:
+        first = await run_db(next, chunks, b"")
+    except ValueError as e:
+        raise ApiError(400, str(e))
+    except exports.ExportBusy:
+        raise ApiError(429, "too many exports running; try again shortly", headers={"Retry-After": "30"})
+    except ImportError:
+        raise ApiError(501, "parquet export is not available on this server")
+    return StreamingResponse(itertools.chain([first], chunks), media_type=exports.FORMATS[fmt],
+                             headers={"Content-Disposition": f'attachment; filename="{table}.{fmt}"'})
+
+# --- Live availability (server-sent events) ---
+# Each connected client subscribes to events.py, which hands on every
+# availability change any process commits (listing_events table), so the
+# client's queue fills without a query per client. A client that reconnects
+# with Last-Event-ID, even to a restarted server, gets what it missed
+# replayed, or a "reset" event telling it to reload the list if the table no
+# longer covers the gap (also sent when its queue overflows because it reads
+# too slowly).
+
+def _sse(event):
+    return f"id: {event['seq']}\nevent: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+def _reset_event():
+    return {"seq": events.last_seq(), "type": "reset"}
+
+async def listing_stream(request):
+    user = await _current_user(request, allow_query_token=True)
+    last_id = _number(request.headers.get("last-event-id"), "Last-Event-ID", int, minimum=0)
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize=STREAM_QUEUE_SIZE)
+
+    def offer(event):
+        # On the event loop: a full queue is replaced by a single reset
+        if queue.full():
+            while not queue.empty():
+                queue.get_nowait()
+            event = _reset_event()
+        queue.put_nowait(event)
+
+    def can_see(event):
+        return event.get("visibility") != "ngo_only" or user["user_type"] == "NGO"
+
+    def deliver(event):
+        # On the publishing thread
+        if can_see(event):
+            try:
+                loop.call_soon_threadsafe(offer, event)
+            except RuntimeError:
+                pass  # loop already closed (shutdown)
+
+    # Subscribe before replaying so nothing falls between the two
+    unsubscribe = events.subscribe(deliver)
+    replay = []
+    if last_id is not None:
+        missed_events, missed = events.since(last_id)
+        replay = [_reset_event()] if missed else [e for e in missed_events if can_see(e)]
+
+    async def stream():
+        try:
+            yield "retry: 1000\n\n"
+            sent = last_id or 0
+            for event in replay:
+                sent = event["seq"]
+                yield _sse(event)
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), STREAM_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                if event["type"] == "reset" or event["seq"] > sent:  # replayed ones may arrive again
+                    sent = event["seq"]
+                    yield _sse(event)
+        finally:
+            unsubscribe()
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+async def health(request):
+    return JSONResponse({"ok": True})
+
+def _ensure_schema():
+    # Same startup migrations as the Streamlit app, plus the API's own table
+    db.migrate_notifications_table()
+    db.create_reviews_table_if_not_exists()
+    db.alter_claims_table_if_needed()
+    db.create_gamification_tables_if_not_exists()
+    db.alter_listings_table_for_visibility()
+    db.alter_listings_table_for_quantity()
+    db.migrate_time_columns_to_epoch()
+    db.create_analytics_tables_if_not_exists()
+    db.create_matching_tables_if_not_exists()
+    db.create_api_tables_if_not_exists()
+    db.create_rate_limit_table_if_not_exists()
+    db.create_urgency_tables_if_not_exists()
+    shards.ensure_shards()
+    db.repair_home_effects()
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    setup_logging()
+    await run_db(_ensure_schema)
+    await run_db(urgency.start)
+    log.info("API started", extra={"db_threads": API_DB_THREADS})
+    yield
+
+routes = [
+    Route("/api/health", health),
+    Route("/api/token", create_token, methods=["POST"]),
+    Route("/api/token", delete_token, methods=["DELETE"]),
+    Route("/api/listings", list_listings),
+    Route("/api/listings", create_listing, methods=["POST"]),
+    Route("/api/listings/nearby", nearby_listings),
+    Route("/api/listings/expiring", expiring_listings),
+    Route("/api/listings/stream", listing_stream),
+    Route("/api/listings/{listing_id:int}", get_listing),
+    Route("/api/listings/{listing_id:int}/claim", claim_listing, methods=["POST"]),
+    Route("/api/claims", my_claims),
+    Route("/api/claims/batch", batch_claim, methods=["POST"]),
+    Route("/api/claims/{claim_id:int}/complete", complete_claim, methods=["POST"]),
+    Route("/api/notifications", notifications),
+    Route("/api/notifications/{notification_id:int}/read", read_notification, methods=["POST"]),
+    Route("/api/stats", stats),
+    Route("/api/exports/{table}", export_history),
+]
+
+app = Starlette(routes=routes, lifespan=lifespan,
+                exception_handlers={ApiError: _api_error, HTTPException: _http_error})
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the Food Circle JSON API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+    import uvicorn
+    # One process: claims rely on in-process locks (db._claim_lock) for fairness
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
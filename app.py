@@ -1,73 +1,128 @@
 import streamlit as st
+import profiling
+
+# Root span for this script run; closed by finish_rerun() after dispatch
+profiling.start_rerun(st.session_state.get("page", "home"))
+
 from auth import register_user, get_user_by_email, verify_password, get_user_by_id
 from db import (
     create_listing,
-    get_available_listings,
     atomic_claim_listing,
-    get_listing_by_id,
+    batch_claim_listings,
+    get_donor_listings,
+    get_receiver_claims,
     expire_old_listings,
     get_conn,
+    get_db_path,
     create_notification,
-    get_user_notifications,
+    migrate_notifications_table,
     mark_notification_as_read,
-    get_unread_notification_count,
     clear_all_notifications,
     clear_read_notifications,
     # --- START: Added for Feature 2 (Ratings) ---
     create_reviews_table_if_not_exists,
     create_review,
-    get_reviews_for_user,
     check_review_exists,
     # --- END: Added for Feature 2 (Ratings) ---
     
     # --- START: Added for Feature 1 (Gamification) ---
     alter_claims_table_if_needed,
     create_gamification_tables_if_not_exists,
-    get_user_stats,
-    get_user_badges,
     complete_claim_and_award_points,
     # --- END: Added for Feature 1 (Gamification) ---
+    create_analytics_tables_if_not_exists,
+    create_matching_tables_if_not_exists,
+    alter_listings_table_for_quantity,
+    migrate_time_columns_to_epoch,
+    create_rate_limit_table_if_not_exists,
+    create_urgency_tables_if_not_exists,
+    repair_home_effects,
+    QUANTITY_UNITS,
     
     # --- START: Added for Feature 3 (NGO Mode) ---
-    alter_listings_table_for_visibility
+    alter_listings_table_for_visibility,
     # --- END: Added for Feature 3 (NGO Mode) ---
+    bump_generation,
+)
+from cache_utils import (
+    cached_available_listings,
+    cached_recommended_listings,
+    cached_user_stats,
+    cached_user_badges,
+    cached_review_summary,
+    cached_unread_count,
+    cached_notification_inbox,
 )
-from maps_utils import reverse_geocode, static_map_url, directions_url
+from leaderboard import get_leaderboard, get_user_rank
+from instrumentation import REGISTRY
+from maps_utils import reverse_geocode, static_map_url, directions_url, route_directions_urls
+from routing import claim_deadline
+import routing
 from email_utils import send_email
+from notify_utils import notify_donors_of_claims
+import events
+import ratelimit
+import session_store
+import shards
+import urgency
+from log_utils import get_logger
 from pathlib import Path
 import datetime
 from auth import get_user_by_id
-from streamlit_geolocation import streamlit_geolocation
+import json
+import logging
 import re
-import sqlite3
+import secrets
+import threading
+import time
+
+log = get_logger("app")
+
+def client_ip():
+    """The browser's address as Streamlit sees it; None where it is unknown (older Streamlit, tests)."""
+    try:
+        return st.context.ip_address
+    except Exception:
+        return None
+
+def session_id():
+    """This browser session's key in session_store, the only user state kept in st.session_state."""
+    if "session_id" not in st.session_state:
+        st.session_state.session_id = secrets.token_urlsafe(16)
+    return st.session_state.session_id
+
+def current_user():
+    """The signed-in session_store.SessionUser, or None."""
+    return session_store.get(session_id())
 
 def is_valid_email(email):
     return re.match(r"[^@]+@[^@]+\.[^@]+", email)
 
-def fix_database_schema():
-    """Add missing columns to existing database"""
+def detect_location():
+    """Browser geolocation widget; the component is only imported on pages that ask for a location."""
+    from streamlit_geolocation import streamlit_geolocation
+    return streamlit_geolocation()
+
+def _admin_emails():
+    # A list or a comma-separated string; compared without case
     try:
-        db_path = Path("data/community.db")
-        if db_path.exists():
-            conn = sqlite3.connect(db_path)
-            c = conn.cursor()
-            
-            # Check if is_read column exists in notifications table
-            c.execute("PRAGMA table_info(notifications)")
-            columns = [col[1] for col in c.fetchall()]
-            
-            if 'is_read' not in columns:
-                c.execute("ALTER TABLE notifications ADD COLUMN is_read INTEGER DEFAULT 0")
-                print("Added is_read column to notifications table")
-            
-            conn.commit()
-            conn.close()
-    except Exception as e:
-        print(f"Error fixing database schema: {e}")
+        emails = st.secrets["admin_emails"]
+    except Exception:
+        return set()
+    if isinstance(emails, str):
+        emails = emails.split(",")
+    return {str(email).strip().lower() for email in emails if str(email).strip()}
+
+def is_admin(user):
+    """Admins are listed by email under `admin_emails` in secrets."""
+    email = (user.get("email") or "").strip().lower()
+    return bool(email) and email in _admin_emails()
 
 # Add this function to your app.py after the imports
 def debug_database_structure():
-    """Debug function to check the current database structure"""
+    """Debug function to check the current database structure (only runs with DEBUG logging)"""
+    if not log.isEnabledFor(logging.DEBUG):
+        return True
     try:
         conn = get_conn()
         cur = conn.cursor()
@@ -77,60 +132,93 @@ def debug_database_structure():
         table_exists = cur.fetchone()
         
         if not table_exists:
-            print("⚠ NOTIFICATIONS TABLE DOES NOT EXIST!")
+            log.warning("Notifications table does not exist")
             return False
             
         # Check notifications table columns
         cur.execute("PRAGMA table_info(notifications)")
         columns = cur.fetchall()
-        print("📋 Notifications table columns:")
-        for col in columns:
-            print(f"  {col[1]} ({col[2]})")
         
         # Check if is_read column exists
         has_is_read = any(col[1] == 'is_read' for col in columns)
-        print(f"✅ is_read column exists: {has_is_read}")
-        
-        # Check all notifications
-        cur.execute("SELECT * FROM notifications")
-        all_notifications = cur.fetchall()
-        print(f"📊 Total notifications in database: {len(all_notifications)}")
         
-        for notif in all_notifications:
-            notif_dict = dict(notif)
-            print(f"  📝 ID: {notif_dict.get('id')}, User: {notif_dict.get('user_id')}, "
-                  f"Title: {notif_dict.get('title')}, Read: {notif_dict.get('is_read', 'N/A')}")
+        # Count notifications; individual rows are not dumped on every rerun
+        cur.execute("SELECT COUNT(*) FROM notifications")
+        total = cur.fetchone()[0]
+        log.debug("Notifications table state", extra={
+            "columns": [f"{col[1]} ({col[2]})" for col in columns],
+            "has_is_read": has_is_read,
+            "total": total,
+        })
         
         conn.close()
         return True
         
-    except Exception as e:
-        print(f"⚠ Debug error: {e}")
+    except Exception:
+        log.exception("Debug error")
         return False
 
-# Call this function at the start of your app, after fix_database_schema()
-debug_database_structure()
+# -------------------------------
+# One-time process initialization
+# -------------------------------
+# Streamlit re-executes this file on every interaction; schema checks only need
+# to run once per process (and database file), so they sit behind cache_resource.
+@st.cache_resource(show_spinner=False)
+def init_app_once(db_path):
+    with profiling.span("startup.schema"):
+        # Call this function at the start of your app, after migrate_notifications_table()
+        debug_database_structure()
+
+        # Notifications schema (is_read, copied names, inbox indexes) before anything else
+        migrate_notifications_table()
+
+        # --- START: Added for Feature 2 (Ratings) ---
+        # Create the reviews table on app startup
+        create_reviews_table_if_not_exists()
+        # --- END: Added for Feature 2 (Ratings) ---
+
+        # --- START: Added for Feature 1 (Gamification) ---
+        # Alter claims table to add 'status' column if needed
+        alter_claims_table_if_needed()
+        # Create the gamification tables on app startup
+        create_gamification_tables_if_not_exists()
+        # --- END: Added for Feature 1 (Gamification) ---
 
-# Fix database schema before anything else
-fix_database_schema()
+        # --- START: Added for Feature 3 (NGO Mode) ---
+        # Alter listings table to add 'visibility' column if needed
+        alter_listings_table_for_visibility()
+        # --- END: Added for Feature 3 (NGO Mode) ---
 
-# --- START: Added for Feature 2 (Ratings) ---
-# Create the reviews table on app startup
-create_reviews_table_if_not_exists()
-# --- END: Added for Feature 2 (Ratings) ---
+        # Numeric quantities so a listing can be claimed in parts (after the claims columns)
+        alter_listings_table_for_quantity()
 
-# --- START: Added for Feature 1 (Gamification) ---
-# Alter claims table to add 'status' column if needed
-alter_claims_table_if_needed()
-# Create the gamification tables on app startup
-create_gamification_tables_if_not_exists()
-# --- END: Added for Feature 1 (Gamification) ---
+        # Integer epoch time columns and their indexes on listings and claims
+        migrate_time_columns_to_epoch()
 
-# --- START: Added for Feature 3 (NGO Mode) ---
-# Alter listings table to add 'visibility' column if needed
-alter_listings_table_for_visibility()
-# --- END: Added for Feature 3 (NGO Mode) ---
+        # Hourly rollups behind the partner impact reports (analytics.py)
+        create_analytics_tables_if_not_exists()
 
+        # Receiver locations used to push new listings to nearby receivers (matching.py)
+        create_matching_tables_if_not_exists()
+
+        # Shared throttle buckets, used when rate_limit_store = "sqlite" (ratelimit.py)
+        create_rate_limit_table_if_not_exists()
+
+        # Sent expiry escalations and the expiry index the urgency heap is seeded from (urgency.py)
+        create_urgency_tables_if_not_exists()
+
+        # Regional shard files copy the listings/claims schema above, so this goes last (shards.py)
+        shards.ensure_shards()
+
+        # Ledger and shard_users rows a shard write committed without (db.py)
+        repair_home_effects()
+
+    # Near-expiry heap and the escalation thread
+    urgency.start()
+
+    return time.time()
+
+init_app_once(get_db_path())
 
 st.set_page_config(page_title="Community Surplus Food", layout="wide")
 
@@ -379,14 +467,31 @@ st.markdown("""
 # Helpers
 # -------------------------------
 def init_session_state():
-    for k, v in {"user": None, "page": "home", "detected_lat": None, "detected_lng": None, "detected_address": None, "confirming_claim_id": None, "listing_success_message": None}.items():
+    for k, v in {"page": "home", "detected_lat": None, "detected_lng": None, "detected_address": None, "confirming_claim_id": None, "listing_success_message": None}.items():
         if k not in st.session_state:
             st.session_state[k] = v
 
-# Run expiry cleanup (best-effort)
-now_iso = datetime.datetime.utcnow().isoformat()
+# Run expiry cleanup (best-effort). Expiry dates are whole days, so one sweep per
+# EXPIRY_SWEEP_SECONDS per process is enough rather than one per rerun.
+EXPIRY_SWEEP_SECONDS = 60
+
+@st.cache_resource(show_spinner=False)
+def _expiry_sweep_state():
+    return {"last": 0.0, "lock": threading.Lock()}
+
+def maybe_expire_old_listings():
+    state = _expiry_sweep_state()
+    if time.time() - state["last"] < EXPIRY_SWEEP_SECONDS or not state["lock"].acquire(blocking=False):
+        return
+    try:
+        with profiling.span("startup.expire_old_listings"):
+            expire_old_listings(datetime.datetime.utcnow().isoformat())
+        state["last"] = time.time()
+    finally:
+        state["lock"].release()
+
 try:
-    expire_old_listings(now_iso)
+    maybe_expire_old_listings()
 except Exception:
     pass
 
@@ -403,16 +508,16 @@ st.markdown("""
 </div>
 """, unsafe_allow_html=True)
 
-if st.session_state.user:
-    user = dict(st.session_state.user)
+user = current_user()
+if user:
     
     # Get unread notification count
     try:
-        unread_count = get_unread_notification_count(user["id"])
+        unread_count = cached_unread_count(user["id"])
         badge = f'<span class="notification-badge">{unread_count}</span>' if unread_count > 0 else ""
-    except Exception as e:
+    except Exception:
         badge = ""
-        print(f"Error getting notification count: {e}")
+        log.exception("Error getting notification count")
     
     # Enhanced sidebar user info
     st.sidebar.markdown(f"""
@@ -448,7 +553,7 @@ if st.session_state.user:
     # Enhanced logout button
     st.sidebar.markdown("---")
     if st.sidebar.button("🚪 Logout", use_container_width=True):
-        st.session_state.user = None
+        session_store.logout(session_id())
         st.session_state.page = "home"
         st.rerun()
 else:
@@ -479,14 +584,17 @@ def login_ui():
             submitted = st.form_submit_button("🚀 Sign In", use_container_width=True)
         
         if submitted:
-            if not is_valid_email(email):
+            wait = ratelimit.check("login", email=email.strip(), ip=client_ip())
+            if wait:
+                st.error(f"⏳ Too many sign-in attempts. Please try again in {ratelimit.describe(wait)}.")
+            elif not is_valid_email(email):
                 st.error("📧 Please enter a valid email address.")
             else:
                 user_row = get_user_by_email(email)
                 if user_row and verify_password(password, user_row["password_hash"]):
-                    st.session_state.user = dict(user_row)
+                    session_store.login(session_id(), user_row)
                     st.success("🎉 Welcome back! Logging you in...")
-                    needs_profile = (not st.session_state.user.get("name")) or (not st.session_state.user.get("user_type"))
+                    needs_profile = (not user_row["name"]) or (not user_row["user_type"])
                     if needs_profile:
                         st.session_state.page = "profile_setup"
                     else:
@@ -534,7 +642,10 @@ def register_ui():
             submitted = st.form_submit_button("🎉 Create Account", use_container_width=True)
         
         if submitted:
-            if not email or not password:
+            wait = ratelimit.check("register", ip=client_ip())
+            if wait:
+                st.error(f"⏳ Too many new accounts from your network. Please try again in {ratelimit.describe(wait)}.")
+            elif not email or not password:
                 st.error("📝 Please fill in both email and password fields.")
             elif not is_valid_email(email):
                 st.error("📧 Please enter a valid email address.")
@@ -561,7 +672,7 @@ def register_ui():
 # -------------------------------
 # Home/Auth display (NEW LOGIC)
 # -------------------------------
-if not st.session_state.user:
+if not current_user():
     if "show_register" not in st.session_state:
         st.session_state.show_register = False
 
@@ -571,20 +682,12 @@ if not st.session_state.user:
         login_ui()
     st.stop()
 
-# Refresh session user from DB
-try:
-    user = get_user_by_id(st.session_state.user["id"])
-    st.session_state.user = dict(user)
-except Exception:
-    st.warning("Session refresh failed – please login again.")
-    st.session_state.user = None
-    st.rerun()
-
 # -------------------------------
 # Home Page (NEW)
 # -------------------------------
 # In app.py, replace your existing home_page function with this one
 
+@profiling.profiled()
 def home_page():
     st.header("Welcome to Community Surplus Food Sharing!")
     st.markdown("Choose your action below:")
@@ -605,8 +708,10 @@ def home_page():
     
     # Get notifications
     try:
-        notifications = get_user_notifications(st.session_state.user["id"])
-        unread_count = get_unread_notification_count(st.session_state.user["id"])
+        # Page of notifications and the unread count come from one cached inbox query
+        inbox = cached_notification_inbox(current_user()["id"])
+        notifications = inbox["notifications"]
+        unread_count = inbox["unread_count"]
         
         if unread_count > 0:
             st.info(f"You have {unread_count} unread notification(s)")
@@ -617,14 +722,14 @@ def home_page():
                 st.rerun()
         with col2:
             if st.button("✅ Clear Read", help="Remove all read notifications"):
-                if clear_read_notifications(st.session_state.user["id"]):
+                if clear_read_notifications(current_user()["id"]):
                     st.success("Read notifications cleared!")
                     st.rerun()
                 else:
                     st.error("Failed to clear notifications")
         with col3:
             if st.button("🗑️ Clear All", help="Remove all notifications"):
-                if clear_all_notifications(st.session_state.user["id"]):
+                if clear_all_notifications(current_user()["id"]):
                     st.success("All notifications cleared!")
                     st.rerun()
                 else:
@@ -634,7 +739,7 @@ def home_page():
             st.write("No notifications yet.")
         else:
             for notification in notifications:
-                notif = dict(notification)
+                notif = notification
                 is_read = notif.get("is_read", 0)
                 
                 # --- MODIFIED FOR FEATURE 1 ---
@@ -670,6 +775,7 @@ def home_page():
 # Donor Page
 # -------------------------------
 # --- REPLACED for Feature 3 (NGO Mode) ---
+@profiling.profiled()
 def donor_page():
     if st.button("⬅️ Back to Home"):
         st.session_state.page = "home"
@@ -682,7 +788,7 @@ def donor_page():
 
     st.info("📍 Please use the button below to detect your current location before publishing your listing.")
 
-    loc = streamlit_geolocation()
+    loc = detect_location()
     if loc and loc.get("latitude") and loc.get("longitude"):
         st.session_state.detected_lat = loc["latitude"]
         st.session_state.detected_lng = loc["longitude"]
@@ -710,11 +816,14 @@ def donor_page():
             prepared_at = st.date_input("Prepared on", value=datetime.date.today())
         if food_type == "packaged":
             expiry_at = st.date_input("Expiry date", value=datetime.date.today())
-        quantity = st.text_input("Quantity (eg: 5 portions, 20 kgs)")
+        qcol1, qcol2 = st.columns([2, 1])
+        quantity_total = qcol1.number_input("Quantity", min_value=1, value=1, step=1,
+                                            help="Receivers can claim part of it; the listing stays up until all of it is taken.")
+        quantity_unit = qcol2.selectbox("Unit", QUANTITY_UNITS)
         photo = st.file_uploader("Photo", type=["jpg", "jpeg", "png"])
         
         # --- START: Added for Feature 3 (NGO Mode) ---
-        user_type = st.session_state.user.get("user_type")
+        user_type = current_user().get("user_type")
         visibility_options = ["Everyone"]
         
         # Only show the "NGOs Only" option if the user is a bulk donor
@@ -737,7 +846,10 @@ def donor_page():
 
         submitted = st.form_submit_button("Publish listing", disabled=submit_disabled)
 
-        if submitted:
+        wait = ratelimit.check("create_listing", user=current_user()["id"], ip=client_ip()) if submitted else None
+        if wait:
+            st.error(f"⏳ You have published a lot of listings recently. Please try again in {ratelimit.describe(wait)}.")
+        elif submitted:
             photo_path = None
             if photo:
                 UP = Path("uploads")
@@ -753,10 +865,11 @@ def donor_page():
             # --- END: Added for Feature 3 (NGO Mode) ---
 
             data = {
-                "donor_id": st.session_state.user["id"],
+                "donor_id": current_user()["id"],
                 "title": title, "notes": notes, "food_type": food_type, "veg": veg,
                 "cuisine": cuisine, "prepared_at": prepared_at.isoformat() if prepared_at else None,
-                "expiry_at": expiry_at.isoformat() if expiry_at else None, "quantity": quantity,
+                "expiry_at": expiry_at.isoformat() if expiry_at else None,
+                "quantity_total": int(quantity_total), "quantity_unit": quantity_unit,
                 "photo_path": photo_path, "lat": lat, "lng": lng, "address_text": address_input,
                 "visibility": visibility # <-- ADDED THIS
             }
@@ -773,26 +886,112 @@ def donor_page():
 # Receiver Page
 # -------------------------------
 # --- REPLACED for Feature 3 (NGO Mode) ---
+BATCH_OUTCOME_LABELS = {
+    "reserved": "✅ Reserved",
+    "unavailable": "❌ Already claimed",
+    "not_found": "❌ No longer listed",
+    "rolled_back": "↩️ Not reserved (batch cancelled)",
+}
+
+def batch_claim_bar(listings):
+    """Reserve every listing ticked "Add to batch" in one transaction."""
+    result = st.session_state.pop("batch_claim_result", None)
+    if result:
+        reserved = sum(o["status"] == "reserved" for o in result)
+        (st.success if reserved == len(result) else st.warning)(
+            f"Reserved {reserved} of {len(result)} listings. Donors notified." if reserved
+            else "Nothing was reserved.")
+        st.dataframe([
+            {"Listing": o["title"] or f"#{o['listing_id']}", "Outcome": BATCH_OUTCOME_LABELS[o["status"]]}
+            for o in result
+        ], use_container_width=True, hide_index=True)
+
+    selected = [item["id"] for item in listings if st.session_state.get(f"batch_{item['id']}")]
+    if not selected:
+        return
+    col1, col2 = st.columns([2, 1])
+    mode = col1.radio("If some are already taken", ["all_or_nothing", "best_effort"], horizontal=True,
+                      format_func={"all_or_nothing": "Reserve none", "best_effort": "Reserve the rest"}.get,
+                      key="batch_mode")
+    if col2.button(f"🛒 Reserve {len(selected)} selected", key="batch_claim"):
+        receiver = dict(current_user())
+        # A batch counts as one claim per listing
+        wait = ratelimit.check("claim", cost=len(selected), user=receiver["id"], ip=client_ip())
+        if wait:
+            st.error(f"⏳ You are claiming very quickly. Please try again in {ratelimit.describe(wait)}.")
+            return
+        outcomes = batch_claim_listings(selected, receiver["id"], mode=mode, ttl_minutes=60)
+        if outcomes is None:
+            st.error("Could not reserve the selected listings, please try again.")
+            return
+        try:
+            notify_donors_of_claims(outcomes, receiver)
+        except Exception:
+            log.exception("Error notifying donors of batch claim")
+        # Widgets for these keys are created further down this run, so they can still be cleared
+        for lid in selected:
+            st.session_state.pop(f"batch_{lid}", None)
+        st.session_state.batch_claim_result = outcomes
+        st.rerun()
+
+LIVE_REFRESH_SECONDS = 1
+EXPIRING_SOON_SHOWN = 5
+
+@st.fragment(run_every=LIVE_REFRESH_SECONDS)
+def live_availability(listing_ids):
+    """
+    Reruns the page as soon as a listing shown on it is claimed, runs low or
+    expires, in this or any other process. Only reads events.py's buffer of
+    recent events, never the database.
+    """
+    new, missed = events.since(st.session_state.listing_events_seq)
+    if not new:
+        return
+    st.session_state.listing_events_seq = new[-1]["seq"]
+    if missed or any(e["type"] != "listing.created" and e["listing_id"] in listing_ids for e in new):
+        st.rerun(scope="app")
+
+@profiling.profiled()
 def receiver_page():
     if st.button("⬅️ Back to Home"):
         st.session_state.page = "home"
         st.rerun()
     st.header("Receiver – Browse available food")
 
-    # --- MODIFIED ---
-    # Pass the current user's ID to the "smart" function
-    listings = get_available_listings(st.session_state.user["id"])
-    # --- END MODIFICATION ---
+    # Recommended order ranks by distance, time to expiry, veg preference and past claims
+    sort_by = st.radio("Sort by", ["Recommended for you", "Newest"], horizontal=True, key="receiver_sort")
+    # Events up to here are reflected in the list loaded below
+    st.session_state.listing_events_seq = events.last_seq()
+    if sort_by == "Recommended for you":
+        origin = None
+        if st.session_state.detected_lat and st.session_state.detected_lng:
+            origin = (st.session_state.detected_lat, st.session_state.detected_lng)
+        L = cached_recommended_listings(current_user()["id"], origin)
+    else:
+        # --- MODIFIED ---
+        # Pass the current user's ID to the "smart" function
+        L = cached_available_listings(current_user()["id"])
+        # --- END MODIFICATION ---
+
+    # Soonest deadlines, read from the in-memory urgency heap rather than the listings table
+    expiring = urgency.expiring_soon(current_user()["user_type"], limit=EXPIRING_SOON_SHOWN)
+    if expiring:
+        st.subheader("⏳ Expiring soon")
+        for item in expiring:
+            left = f"{item['hours_left']:.0f} h" if item["hours_left"] >= 1 else f"{item['hours_left'] * 60:.0f} min"
+            st.markdown(f"- **{item.get('title') or 'Food available'}**: collect within {left}")
 
-    L = [dict(r) for r in listings]
     st.subheader(f"{len(L)} available listings")
+    live_availability(frozenset(item["id"] for item in [*L, *expiring]))
     
     # --- ADDED for Feature 3 ---
     # Show a special message if the user is an NGO
-    if st.session_state.user.get("user_type") == "NGO":
+    if current_user().get("user_type") == "NGO":
         st.info("ℹ️ As an NGO, you can see both public listings and special 'NGO-only' bulk donations.")
     # --- END ADDITION ---
 
+    batch_claim_bar(L)
+
     for item in L:
         with st.expander(item.get("title") or "Food Available"):
             
@@ -802,8 +1001,16 @@ def receiver_page():
             # --- END ADDITION ---
 
             st.write(item.get("notes"))
-            st.write(f"**Quantity:** {item.get('quantity', 'N/A')}")
+            remaining = item.get("quantity_remaining")
+            if remaining is not None:
+                st.write(f"**Quantity:** {remaining} of {item['quantity_total']} {item['quantity_unit']} left")
+            else:
+                st.write(f"**Quantity:** {item.get('quantity', 'N/A')}")
             st.write("Veg" if item.get("veg") else "Non-Veg")
+            if item.get("distance_km") is not None:
+                st.caption(f"📍 {item['distance_km']:.1f} km away")
+            if item.get("hours_left") is not None and 0 < item["hours_left"] < 24:
+                st.caption(f"⏳ Best collected within {item['hours_left']:.0f} h")
             st.write(item.get("address_text") or "Address hidden")
             if item.get("photo_path"):
                 try:
@@ -816,13 +1023,23 @@ def receiver_page():
                 if sm:
                     st.image(sm, caption="Listing Location")
 
+            st.checkbox("Add to batch", key=f"batch_{item['id']}")
+            portions = None
+            if remaining is not None and remaining > 1:
+                portions = st.number_input(f"How many {item['quantity_unit']}?", min_value=1, max_value=remaining,
+                                           value=1, step=1, key=f"portions_{item['id']}")
             if st.button("TAKEAWAY", key=f"claim_{item['id']}"):
-                claim_id = atomic_claim_listing(item["id"], st.session_state.user["id"], ttl_minutes=60)
+                wait = ratelimit.check("claim", user=current_user()["id"], ip=client_ip())
+                claim_id = None if wait else atomic_claim_listing(
+                    item["id"], current_user()["id"], ttl_minutes=60,
+                    portions=int(portions) if portions else None)
                 if claim_id:
+                    # Our own claim should not trigger a live refresh that clears the details below
+                    st.session_state.listing_events_seq = events.last_seq()
                     st.success("Reserved! Donor notified.")
                     try:
                         donor = dict(get_user_by_id(item["donor_id"]))
-                        receiver = dict(get_user_by_id(st.session_state.user["id"]))
+                        receiver = dict(get_user_by_id(current_user()["id"]))
 
                         donor_phone = donor.get("phone")
                         if donor_phone:
@@ -834,11 +1051,13 @@ def receiver_page():
                         else:
                             st.warning("The donor has not provided a phone number.")
                         
-                        print(f"🎯 Creating notification for donor {item['donor_id']} ({donor.get('email')})")
+                        log.debug("Creating claim notification", extra={"donor_id": item["donor_id"], "listing_id": item["id"]})
                         
                         receiver_name = receiver.get('name', 'Someone')
                         receiver_phone = receiver.get('phone', 'Not provided')
                         listing_title = item.get('title', '')
+                        if portions:
+                            listing_title = f"{int(portions)} {item['quantity_unit']} of {listing_title}"
                         
                         phone_link_html = f'<a href="tel:{receiver_phone}">{receiver_phone}</a>' if receiver.get('phone') else 'Not provided'
                         
@@ -851,7 +1070,7 @@ def receiver_page():
                             title=notification_title,
                             message=notification_message,
                             related_listing_id=item["id"],
-                            related_user_id=st.session_state.user["id"]
+                            related_user_id=current_user()["id"]
                         )
                         
                         if notification_id:
@@ -860,7 +1079,7 @@ def receiver_page():
                             st.warning("⚠️ Could not create notification (but claim was successful)")
                         
                         receiver_location = ""
-                        loc = streamlit_geolocation()
+                        loc = detect_location()
                         if loc and loc.get("latitude") and loc.get("longitude"):
                             receiver_location = f"{loc['latitude']},{loc['longitude']}"
                         message = (
@@ -875,7 +1094,7 @@ def receiver_page():
                             
                     except Exception as e:
                         st.warning(f"Could not send email to donor: {e}")
-                        print(f"📧 Email error: {e}")
+                        log.exception("Error notifying donor", extra={"listing_id": item["id"]})
 
                     dir_html = f"""
                     <button onclick="getLocation_{item['id']}()" style="padding:10px 14px;">Get Directions</button>
@@ -891,6 +1110,10 @@ def receiver_page():
                     </script>
                     """
                     st.components.v1.html(dir_html, height=100)
+                elif wait:
+                    st.warning(f"⏳ You are claiming very quickly. Please try again in {ratelimit.describe(wait)}.")
+                elif remaining is not None:
+                    st.warning("Not enough left, someone else claimed it first. Please refresh.")
                 else:
                     st.warning("Already claimed.")
 
@@ -899,40 +1122,27 @@ def receiver_page():
 # -------------------------------
 
 # --- REPLACED for Feature 1 (Gamification) ---
+@profiling.profiled()
 def my_listings_page():
     st.header("My Listings")
-    conn = get_conn()
-    cur = conn.cursor()
-    
-    # MODIFIED QUERY: Added c.status as claim_status
-    cur.execute("""
-        SELECT 
-            l.*, 
-            c.id as claim_id,
-            c.receiver_id,
-            c.status as claim_status,  -- <-- ADDED
-            u.name as receiver_name
-        FROM listings l
-        LEFT JOIN claims c ON l.id = c.listing_id
-        LEFT JOIN users u ON c.receiver_id = u.id
-        WHERE l.donor_id = ? 
-        ORDER BY l.created_at DESC
-    """, (st.session_state.user["id"],))
-    
-    rows = cur.fetchall()
-    conn.close()
+    rows = get_donor_listings(current_user()["id"])
 
     if not rows:
         st.info("You have not created any listings yet.")
         return
 
-    for r in rows:
-        row = dict(r)
-        
+    for row in rows:
         # Use an expander for each listing
-        with st.expander(f"{row.get('title', '')} - Status: {row.get('status', '')}"):
+        # One entry per claim: a listing claimed in parts appears once for each receiver
+        label = f"{row.get('title', '')} - Status: {row.get('status', '')}"
+        if row.get('claim_quantity'):
+            label += f" ({row['claim_quantity']} {row['quantity_unit']} for {row.get('receiver_name', 'a receiver')})"
+        with st.expander(label):
             st.markdown(f"**Notes:** {row.get('notes', '')}")
-            st.markdown(f"**Quantity:** {row.get('quantity', '')}")
+            if row.get('quantity_remaining') is not None:
+                st.markdown(f"**Quantity:** {row['quantity_remaining']} of {row['quantity_total']} {row['quantity_unit']} left")
+            else:
+                st.markdown(f"**Quantity:** {row.get('quantity', '')}")
             st.markdown(f"**Address:** {row.get('address_text', '')}")
             
             # --- ADDED for Feature 3 ---
@@ -941,10 +1151,10 @@ def my_listings_page():
             # --- END ADDITION ---
             
             # --- START: Gamification & Review Logic ---
-            if row.get('status') == 'RESERVED' and row.get('receiver_id'):
+            if row.get('receiver_id'):
                 
                 claim_id = row['claim_id']
-                reviewer_id = st.session_state.user['id'] # Donor is reviewing
+                reviewer_id = current_user()['id'] # Donor is reviewing
                 reviewee_id = row['receiver_id'] # Donor reviews the Receiver
                 receiver_name = row.get('receiver_name', 'the receiver')
                 claim_status = row.get('claim_status')
@@ -981,47 +1191,80 @@ def my_listings_page():
                                 else:
                                     st.error("There was an error submitting your review.")
                 
-            elif row.get('status') == 'AVAILABLE':
+            if row.get('status') == 'AVAILABLE':
                 st.info("This listing is still available.")
             # --- END: Gamification & Review Logic ---
             st.markdown("---")
 
 
+def pickup_route_planner(claims):
+    """Orders all pending pickups into one trip (routing.py); shown when there are two or more."""
+    stops = []
+    for claim in claims:
+        if claim.get("claim_status") == "RESERVED" and claim.get("lat") and claim.get("lng"):
+            stops.append({
+                "claim_id": claim["id"],
+                "title": claim.get("title") or "Pickup",
+                "address": claim.get("address_text") or "",
+                "lat": float(claim["lat"]),
+                "lng": float(claim["lng"]),
+                "deadline": claim_deadline(claim),
+            })
+    if len(stops) < 2:
+        return
+
+    with st.expander(f"🚚 Plan a pickup route ({len(stops)} pending pickups)",
+                     expanded=current_user().get("user_type") == "NGO"):
+        default_lat = st.session_state.detected_lat or sum(s["lat"] for s in stops) / len(stops)
+        default_lng = st.session_state.detected_lng or sum(s["lng"] for s in stops) / len(stops)
+        col1, col2 = st.columns(2)
+        depot_lat = col1.number_input("Start latitude (depot)", value=float(default_lat), format="%.5f", key="route_depot_lat")
+        depot_lng = col2.number_input("Start longitude (depot)", value=float(default_lng), format="%.5f", key="route_depot_lng")
+        col1, col2 = st.columns(2)
+        speed = col1.slider("Average speed (km/h)", 10, 60, int(routing.AVG_SPEED_KMH), key="route_speed")
+        return_to_depot = col2.checkbox("Return to depot", value=True, key="route_return")
+
+        if st.button("Plan route", key="plan_route"):
+            st.session_state.route_plan = routing.plan_route(
+                (depot_lat, depot_lng), stops, return_to_depot=return_to_depot, speed_kmh=speed)
+
+        plan = st.session_state.get("route_plan")
+        if not plan:
+            return
+        col1, col2, col3 = st.columns(3)
+        col1.metric("Distance", f"{plan['total_km']:.1f} km")
+        col2.metric("Trip time", f"{plan['total_minutes']:.0f} min")
+        col3.metric("Late pickups", plan["late_stops"])
+        st.dataframe([
+            {
+                "#": i,
+                "Pickup": stop["title"],
+                "Address": stop["address"],
+                "ETA (UTC)": stop["eta"].strftime("%H:%M"),
+                "Deadline (UTC)": stop["deadline"].strftime("%d %b %H:%M") if stop["deadline"] else "",
+                "On time": "⚠️ late" if stop["late"] else "✅",
+            }
+            for i, stop in enumerate(plan["stops"], 1)
+        ], use_container_width=True, hide_index=True)
+        points = [(depot_lat, depot_lng)] + [(s["lat"], s["lng"]) for s in plan["stops"]]
+        if return_to_depot:
+            points.append((depot_lat, depot_lng))
+        links = route_directions_urls(points)
+        st.markdown("**Open in Google Maps:** " + " · ".join(f"[leg {i}]({url})" for i, url in enumerate(links, 1)))
+
 # --- REPLACED for Feature 2 (Ratings) ---
+@profiling.profiled()
 def my_claims_page():
     st.header("My Claims")
-    conn = get_conn()
-    cur = conn.cursor()
-    
-    # MODIFIED QUERY: Added listings.donor_id, donor's name, and claim_status
-    cur.execute(
-        """
-        SELECT 
-            claims.*, 
-            claims.status as claim_status, -- <-- ADDED
-            listings.title, 
-            listings.address_text, 
-            listings.lat, 
-            listings.lng,
-            listings.donor_id,
-            users.name as donor_name
-        FROM claims 
-        JOIN listings ON claims.listing_id = listings.id
-        JOIN users ON listings.donor_id = users.id
-        WHERE claims.receiver_id=? ORDER BY reserved_at DESC
-        """,
-        (st.session_state.user["id"],),
-    )
-    rows = cur.fetchall()
-    conn.close()
+    rows = get_receiver_claims(current_user()["id"])
     
     if not rows:
         st.info("You have not claimed any items yet.")
         return
 
-    for r in rows:
-        row = dict(r)
-        
+    pickup_route_planner(rows)
+
+    for row in rows:
         # --- MODIFIED FOR FEATURE 1 ---
         claim_status = row.get('claim_status')
         status_message = "Pending Pickup"
@@ -1029,10 +1272,11 @@ def my_claims_page():
             status_message = "Pickup Completed"
         elif claim_status == 'EXPIRED': # (If you add expiry logic to claims)
             status_message = "Expired"
+        portions_line = f"\n**Portions:** {row['quantity']} {row['quantity_unit']}  " if row.get('quantity') else ""
             
         st.markdown(f"""
 **Title:** {row.get('title', '')}  
-**Status:** {status_message}  
+**Status:** {status_message}  {portions_line}
 **Reserved At:** {row.get('reserved_at', '')}  
 **Expires At:** {row.get('expires_at', '')}  
 **Address:** {row.get('address_text', '')}  
@@ -1051,7 +1295,7 @@ def my_claims_page():
         # --- Review Form Logic (Only show if claim is COMPLETED) ---
         
         claim_id = row['id']
-        reviewer_id = st.session_state.user['id']
+        reviewer_id = current_user()['id']
         reviewee_id = row['donor_id'] # Receiver reviews the Donor
         donor_name = row.get('donor_name', 'the donor')
         
@@ -1085,30 +1329,28 @@ def my_claims_page():
 
 # --- REPLACED for Feature 2 (Ratings) ---
 # --- REPLACED for Feature 2 (Ratings) ---
+@profiling.profiled()
 def admin_page():
     st.header("Profile Settings")
-    user = st.session_state.user
+    user = current_user()
     
     # --- START: Add Rating Display ---
     st.subheader("Your Community Rating")
     
     # Get all reviews ABOUT this user
-    my_reviews = get_reviews_for_user(user["id"])
+    summary = cached_review_summary(user["id"])
     
-    if not my_reviews:
+    if not summary["count"]:
         st.info("You have not received any reviews yet.")
     else:
-        # Calculate average
-        total_rating = sum(dict(rev)['rating'] for rev in my_reviews)
-        avg_rating = total_rating / len(my_reviews)
+        avg_rating = summary["average"]
         
         # Display stars
         star_rating = "⭐" * int(round(avg_rating))
-        st.metric(label=f"Average Rating ({len(my_reviews)} reviews)", value=f"{avg_rating:.1f} / 5.0", delta=star_rating)
+        st.metric(label=f"Average Rating ({summary['count']} reviews)", value=f"{avg_rating:.1f} / 5.0", delta=star_rating)
         
         with st.expander("See all comments"):
-            for rev in my_reviews:
-                review = dict(rev)
+            for review in summary["reviews"]:
                 # Only show comments that were actually left
                 if review.get('comment'):
                     st.markdown(f"**From {review.get('reviewer_name', 'A user')}:**")
@@ -1144,8 +1386,8 @@ def admin_page():
             )
             conn.commit()
             conn.close()
-            fresh = get_user_by_id(user["id"])
-            st.session_state.user = dict(fresh)
+            # Every session re-reads its user on the next rerun
+            bump_generation("users")
             st.success("Profile updated!")
 
     st.subheader("Change Password")
@@ -1155,7 +1397,12 @@ def admin_page():
         confirm_pw = st.text_input("Confirm New Password", type="password")
         pw_submit = st.form_submit_button("Change Password")
         if pw_submit:
-            if not verify_password(old_pw, user["password_hash"]):
+            # Same buckets as sign-in: this form can test passwords too
+            wait = ratelimit.check("login", email=user["email"], ip=client_ip())
+            if wait:
+                st.error(f"Too many attempts. Please try again in {ratelimit.describe(wait)}.")
+            # The hash is never kept in the session; read it just for this check
+            elif not verify_password(old_pw, get_user_by_id(user["id"])["password_hash"]):
                 st.error("Current password is incorrect.")
             elif not new_pw or len(new_pw) < 6:
                 st.error("New password must be at least 6 characters.")
@@ -1174,12 +1421,74 @@ def admin_page():
                 conn.close()
                 st.success("Password changed successfully!")
 
+    if is_admin(user):
+        st.markdown("---")
+        diagnostics_panel()
+
+def diagnostics_panel():
+    st.subheader("🔧 Database Diagnostics")
+    metrics = REGISTRY.snapshot()
+    acquire = metrics["connection_acquire"]
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Connections opened", acquire["count"])
+    col2.metric("Mean acquire time", f"{acquire['mean_ms']:.2f} ms")
+    col3.metric("Slow queries logged", len(metrics["slow_queries"]))
+
+    by_total = sorted(metrics["queries"].items(), key=lambda item: item[1]["total_ms"], reverse=True)
+    st.dataframe(
+        [{"statement": fp, **stats} for fp, stats in by_total[:25]],
+        use_container_width=True,
+    )
+    if metrics["slow_queries"]:
+        with st.expander("Slow query log"):
+            for entry in reversed(metrics["slow_queries"]):
+                st.markdown(f"**{entry['duration_ms']} ms** · {entry['rows']} rows · {entry['at']}")
+                st.code(entry["statement"], language="sql")
+                if entry["plan"]:
+                    st.code("\n".join(entry["plan"]))
+
+    col1, col2 = st.columns(2)
+    col1.download_button("Download Prometheus metrics", REGISTRY.to_prometheus(), "metrics.prom", "text/plain")
+    col2.download_button("Download JSON metrics", REGISTRY.to_json(), "metrics.json", "application/json")
+
+    st.subheader("⏱️ Rerun Profiles")
+    profiling.enabled = st.toggle(
+        "Profile every rerun (all sessions)", value=profiling.enabled,
+        help="Records a span tree per script run with DB/HTTP call counts.",
+    )
+    profiles = list(reversed(profiling.recent_profiles()))
+    if not profiles:
+        st.info("No profiled reruns yet.")
+        return
+    st.dataframe(
+        [
+            {
+                "rerun": p.name,
+                "total_ms": round(p.duration_ms, 1),
+                "db_calls": p.total_calls("db"),
+                "http_calls": p.total_calls("http"),
+                "pages": ", ".join(child.name for child in p.children if not child.name.startswith("startup")),
+            }
+            for p in profiles
+        ],
+        use_container_width=True,
+    )
+    chosen = st.selectbox("Span tree", range(len(profiles)), format_func=lambda i: f"{profiles[i].name} · {profiles[i].duration_ms:.0f} ms")
+    st.code(profiling.render_tree(profiles[chosen]))
+    col1, col2 = st.columns(2)
+    col1.download_button("Download flamegraph (folded)", profiling.to_folded(profiles), "reruns.folded", "text/plain")
+    col2.download_button(
+        "Download profiles (JSON)", json.dumps([p.as_dict() for p in profiles], indent=2),
+        "reruns.json", "application/json",
+    )
+
+@profiling.profiled()
 def profile_setup_ui():
     st.header("Complete your profile")
     st.markdown("Provide details so others can contact you.")
     with st.form("profile_setup"):
-        name = st.text_input("Full Name", value=st.session_state.user.get("name") or "")
-        phone = st.text_input("Phone (optional)", value=st.session_state.user.get("phone") or "")
+        name = st.text_input("Full Name", value=current_user().get("name") or "")
+        phone = st.text_input("Phone (optional)", value=current_user().get("phone") or "")
         user_type = st.selectbox("Account type", ["Household", "Restaurant", "Event Organizer", "NGO", "Individual"])
         submitted = st.form_submit_button("Save profile")
         if submitted:
@@ -1187,23 +1496,23 @@ def profile_setup_ui():
             cur = conn.cursor()
             cur.execute(
                 "UPDATE users SET name=?, phone=?, user_type=? WHERE id=?",
-                (name, phone, user_type, st.session_state.user["id"])
+                (name, phone, user_type, current_user()["id"])
             )
             conn.commit()
             conn.close()
-            fresh = get_user_by_id(st.session_state.user["id"])
-            st.session_state.user = dict(fresh)
+            bump_generation("users")
             st.success("Profile saved. Redirecting...")
             st.session_state.page = "home"
             st.rerun()
 
 # --- START: Added for Feature 1 (Gamification) ---
+@profiling.profiled()
 def my_impact_page():
     st.header("🏆 My Impact Dashboard")
     st.markdown("See the positive impact you're making in the community!")
     
-    user_id = st.session_state.user["id"]
-    stats = get_user_stats(user_id)
+    user_id = current_user()["id"]
+    stats = cached_user_stats(user_id)
     
     st.subheader("Your Stats")
     col1, col2, col3 = st.columns(3)
@@ -1214,7 +1523,7 @@ def my_impact_page():
     st.markdown("---")
     
     st.subheader("My Badges")
-    badges = get_user_badges(user_id)
+    badges = cached_user_badges(user_id)
     
     if not badges:
         st.info("You haven't earned any badges yet. Keep participating to unlock them!")
@@ -1229,33 +1538,59 @@ def my_impact_page():
             </div>
             """, unsafe_allow_html=True)
         st.markdown('</div>', unsafe_allow_html=True)
+
+    st.markdown("---")
+    st.subheader("🥇 Leaderboards")
+    col1, col2 = st.columns(2)
+    with col1:
+        metric_label = st.radio("Rank by", ["Impact Points", "Donations Made"], horizontal=True, key="lb_metric")
+    with col2:
+        user_type = current_user().get("user_type")
+        scope_label = st.radio("Compare with", ["Everyone", f"{user_type}s"], horizontal=True, key="lb_scope")
+    metric = "impact_points" if metric_label == "Impact Points" else "donations_made"
+    scope = None if scope_label == "Everyone" else user_type
+
+    my_rank, board_size = get_user_rank(user_id, metric, scope)
+    if my_rank:
+        st.info(f"Your rank: **#{my_rank}** of {board_size}")
+    else:
+        st.info("Complete a pickup to appear on the leaderboard.")
+
+    entries = get_leaderboard(metric, scope, n=10)
+    for entry in entries:
+        you = " (you)" if entry["user_id"] == user_id else ""
+        st.write(f"**#{entry['rank']}** {entry['name']}{you} — {entry['score']}")
 # --- END: Added for Feature 1 (Gamification) ---
 
 # -------------------------------
 # Dispatch
 # -------------------------------
 pg = st.session_state.page
-needs_profile = (not st.session_state.user.get("name")) or (not st.session_state.user.get("user_type"))
+needs_profile = (not current_user().get("name")) or (not current_user().get("user_type"))
 
 if needs_profile and pg != "profile_setup":
     st.session_state.page = "profile_setup"
     pg = "profile_setup"
 
-if "donor" in pg:
-    donor_page()
-elif "receiver" in pg:
-    receiver_page()
-elif "my listings" in pg:
-    my_listings_page()
-elif "my claims" in pg:
-    my_claims_page()
-# --- START: Added for Feature 1 (Gamification) ---
-elif "my impact" in pg:
-    my_impact_page()
-# --- END: Added for Feature 1 (Gamification) ---
-elif "admin" in pg:
-    admin_page()
-elif "profile_setup" in pg:
-    profile_setup_ui()
-else:
-    home_page()
+try:
+    if "donor" in pg:
+        donor_page()
+    elif "receiver" in pg:
+        receiver_page()
+    elif "my listings" in pg:
+        my_listings_page()
+    elif "my claims" in pg:
+        my_claims_page()
+    # --- START: Added for Feature 1 (Gamification) ---
+    elif "my impact" in pg:
+        my_impact_page()
+    # --- END: Added for Feature 1 (Gamification) ---
+    elif "admin" in pg:
+        admin_page()
+    elif "profile_setup" in pg:
+        profile_setup_ui()
+    else:
+        home_page()
+finally:
+    # Also runs when a page calls st.rerun(), so those runs are recorded too
+    profiling.finish_rerun()
@@ -1,13 +1,18 @@
 # auth.py
-import bcrypt
+# bcrypt is imported inside the hashing helpers so pages that never log in don't load it
 from db import get_conn
+import datetime
+import hashlib
+import secrets
 import sqlite3
 
 def hash_password(password: str) -> str:
+    import bcrypt
     hashed = bcrypt.hashpw(password.encode(), bcrypt.gensalt())
     return hashed.decode()
 
 def verify_password(password: str, hashed: str) -> bool:
+    import bcrypt
     return bcrypt.checkpw(password.encode(), hashed.encode())
 
 def register_user(name, email, password, phone=None, user_type=None):
@@ -41,3 +46,39 @@ def get_user_by_id(uid):
     row = cur.fetchone()
     conn.close()
     return row
+
+# Bearer tokens for the JSON API (api.py). The token itself is only returned
+# to the client; the api_tokens table keeps its SHA-256.
+
+def _token_hash(token):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+def issue_api_token(user_id, ttl_days=30):
+    token = secrets.token_urlsafe(32)
+    expires_at = (datetime.datetime.utcnow() + datetime.timedelta(days=ttl_days)).strftime("%Y-%m-%d %H:%M:%S")
+    conn = get_conn()
+    conn.execute("INSERT INTO api_tokens (token_hash, user_id, expires_at) VALUES (?, ?, ?)",
+                 (_token_hash(token), user_id, expires_at))
+    conn.commit()
+    conn.close()
+    return token, expires_at
+
+def get_user_by_api_token(token):
+    """The user row for an unexpired token, else None."""
+    conn = get_conn()
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT users.* FROM api_tokens JOIN users ON users.id = api_tokens.user_id
+        WHERE api_tokens.token_hash = ? AND api_tokens.expires_at > ?
+    """, (_token_hash(token), datetime.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")))
+    row = cur.fetchone()
+    conn.close()
+    return row
+
+def revoke_api_token(token):
+    conn = get_conn()
+    cur = conn.cursor()
+    cur.execute("DELETE FROM api_tokens WHERE token_hash = ?", (_token_hash(token),))
+    conn.commit()
+    conn.close()
+    return cur.rowcount > 0
@@ -0,0 +1,7 @@
+# benchmarks/
+# Performance measurements for Food Circle, run against a synthetic database:
+#
+#   python -m benchmarks.synthetic --rows 100000 --db bench/community.db
+#   python -m benchmarks.db_bench --db bench/community.db
+#
+# Never point these at data/community.db: they claim, complete and review listings.
@@ -0,0 +1,156 @@
+# benchmarks/api_load.py
+# Load test for the JSON API (api.py). Starts the API under uvicorn in its own
+# process against a synthetic database, then keeps `--concurrency` keep-alive
+# clients busy for `--duration` seconds with a read-heavy mix of endpoints
+# (plus a few single-portion claims). Reports requests/sec and per-endpoint
+# latency percentiles.
+#
+#   python -m benchmarks.api_load --db bench/community.db --concurrency 32 --duration 20
+import argparse
+import http.client
+import json
+import os
+import random
+import socket
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+from benchmarks.harness import use_database, summarize, load_baseline, save_baseline, print_report
+from benchmarks.synthetic import CITY_CENTERS
+
+SUITE = "api"
+ROOT = Path(__file__).resolve().parent.parent
+# (name, weight); paths are filled in per request
+MIX = [
+    ("GET /api/listings", 30),
+    ("GET /api/listings/nearby", 25),
+    ("GET /api/listings/{id}", 15),
+    ("GET /api/notifications", 15),
+    ("GET /api/stats", 10),
+    ("POST /api/listings/{id}/claim", 5),
+]
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_server(db_path, port):
+    # Rate limits off: a few tokens claiming for 20 seconds would otherwise measure 429s
+    env = dict(os.environ, FOOD_CIRCLE_DB=str(Path(db_path).resolve()), FOOD_CIRCLE_LOG_LEVEL="WARNING",
+               FOOD_CIRCLE_RATE_LIMITS="off")
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "api:app", "--port", str(port), "--log-level", "warning", "--no-access-log"],
+        cwd=ROOT, env=env,
+    )
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            conn.request("GET", "/api/health")
+            if conn.getresponse().status == 200:
+                return proc
+        except OSError:
+            time.sleep(0.2)
+    proc.kill()
+    raise SystemExit("API server did not start")
+
+def _tokens(db_path, users):
+    # Issued directly: logging in through the API would spend the run on bcrypt
+    from auth import issue_api_token
+    conn = sqlite3.connect(db_path)
+    ids = [row[0] for row in conn.execute(
+        "SELECT id FROM users WHERE user_type IN ('Individual', 'NGO') ORDER BY RANDOM() LIMIT ?", (users,))]
+    conn.close()
+    return [issue_api_token(uid, ttl_days=1)[0] for uid in ids]
+
+def _request(rng, name, listing_ids):
+    lat0, lng0 = rng.choice(CITY_CENTERS)
+    if name == "GET /api/listings":
+        return "GET", f"/api/listings?limit=20&sort={rng.choice(['recommended', 'newest'])}", None
+    if name == "GET /api/listings/nearby":
+        return "GET", f"/api/listings/nearby?lat={rng.gauss(lat0, 0.05):.5f}&lng={rng.gauss(lng0, 0.05):.5f}&radius_km=3", None
+    if name == "GET /api/listings/{id}":
+        return "GET", f"/api/listings/{rng.choice(listing_ids)}", None
+    if name == "GET /api/notifications":
+        return "GET", "/api/notifications?limit=20", None
+    if name == "GET /api/stats":
+        return "GET", "/api/stats", None
+    return "POST", f"/api/listings/{rng.choice(listing_ids)}/claim", json.dumps({"portions": 1})
+
+def _client(port, token, listing_ids, stop_at, seed, latencies, errors):
+    rng = random.Random(seed)
+    names, weights = zip(*MIX)
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
+    while time.perf_counter() < stop_at:
+        name = rng.choices(names, weights=weights)[0]
+        method, path, body = _request(rng, name, listing_ids)
+        started = time.perf_counter()
+        conn.request(method, path, body=body, headers=headers)
+        response = conn.getresponse()
+        response.read()
+        latencies.setdefault(name, []).append((time.perf_counter() - started) * 1000)
+        # 404/409 are normal answers here (ngo-only listings, claims that lost the race)
+        if response.status >= 500 or response.status == 401:
+            errors.append((name, response.status))
+    conn.close()
+
+def run(db_path, concurrency=32, duration=20.0, seed=7):
+    db_path = Path(db_path).resolve()
+    use_database(db_path)
+    conn = sqlite3.connect(db_path)
+    listing_ids = [row[0] for row in conn.execute("SELECT id FROM listings WHERE status = 'AVAILABLE' LIMIT 5000")]
+    conn.close()
+    tokens = _tokens(db_path, concurrency)
+    port = _free_port()
+    server = start_server(db_path, port)
+    try:
+        per_client = [{} for _ in range(concurrency)]
+        errors = []
+        stop_at = time.perf_counter() + duration
+        threads = [
+            threading.Thread(target=_client, args=(port, tokens[i % len(tokens)], listing_ids, stop_at,
+                                                   seed + i, per_client[i], errors))
+            for i in range(concurrency)
+        ]
+        started = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - started
+    finally:
+        server.terminate()
+        server.wait()
+
+    results = {}
+    for name, _ in MIX:
+        samples = [ms for client in per_client for ms in client.get(name, [])]
+        if samples:
+            results[name] = summarize(samples)
+    total = sum(s["n"] for s in results.values())
+    return results, total / elapsed, errors
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load-test the JSON API")
+    parser.add_argument("--db", default="bench/community.db")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds")
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as the new baseline")
+    args = parser.parse_args()
+
+    if not Path(args.db).exists():
+        parser.error(f"{args.db} not found; create it with python -m benchmarks.synthetic --db {args.db}")
+    results, rps, errors = run(args.db, args.concurrency, args.duration)
+    print_report(results, load_baseline(SUITE))
+    print(f"\n{rps:.0f} requests/sec with {args.concurrency} clients, {len(errors)} errors")
+    if errors:
+        print("first errors:", errors[:5])
+    if args.save_baseline:
+        save_baseline(SUITE, results)
+        print("Baseline saved.")
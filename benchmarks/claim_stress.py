@@ -0,0 +1,138 @@
+# benchmarks/claim_stress.py
+# Concurrency check for portion-based claims: many receivers claim parts of
+# the same listing at once from --processes worker processes, released
+# together by a barrier. Separate processes matter: within one process
+# db._claim_lock queues claims before they reach SQLite, so only claims from
+# different processes race the conditional UPDATE. Each worker makes its
+# share of the round's claims one after another. After every round it checks
+# that the claims add up to no more than the listing held, that
+# quantity_remaining matches what was taken, and that the listing is RESERVED
+# exactly when nothing is left. Exits non-zero on the first violation.
+#
+#   python -m benchmarks.claim_stress --claimers 100 --processes 8 --portions 50 --rounds 20
+import argparse
+import multiprocessing
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks.harness import use_database, summarize, print_report
+
+def _seed_users(db_path, claimers):
+    conn = sqlite3.connect(db_path)
+    conn.executemany("""
+        INSERT OR IGNORE INTO users (id, name, email, password_hash, user_type) VALUES (?, ?, ?, 'x', ?)
+    """, [(uid, f"Stress {uid}", f"stress{uid}@example.com", "Restaurant" if uid == 1 else "Individual")
+          for uid in range(1, claimers + 2)])
+    conn.commit()
+    conn.close()
+
+def _claimer(db_path, tasks, results, barrier):
+    # Worker process: for each (listing_id, [(claimer index, portions)]) wait for
+    # the others, then claim; reports (index, claim_id, latency ms)
+    os.environ["FOOD_CIRCLE_DB"] = str(db_path)
+    import db
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        listing_id, wants = task
+        barrier.wait()
+        for i, portions in wants:
+            started = time.perf_counter()
+            claim_id = db.atomic_claim_listing(listing_id, i + 2, portions=portions)
+            results.put((i, claim_id, (time.perf_counter() - started) * 1000))
+
+def run_round(db, workers, listing_portions, claimers, max_take, rng):
+    """One listing, `claimers` claims of 1..max_take portions spread over the workers. Returns (violations, latencies)."""
+    listing_id = db.create_listing({
+        "donor_id": 1, "title": "Stress test meals", "quantity_total": listing_portions, "quantity_unit": "meals",
+        "lat": 12.97, "lng": 77.59,
+    })
+    wants = [rng.randint(1, max_take) for _ in range(claimers)]
+    tasks, results_queue, processes = workers
+    for w in range(len(processes)):
+        tasks.put((listing_id, [(i, wants[i]) for i in range(w, claimers, len(processes))]))
+    results = [None] * claimers
+    latencies = [None] * claimers
+    for _ in range(claimers):
+        i, claim_id, latency = results_queue.get()
+        results[i], latencies[i] = claim_id, latency
+
+    conn = sqlite3.connect(db.get_db_path())
+    remaining, status = conn.execute(
+        "SELECT quantity_remaining, status FROM listings WHERE id = ?", (listing_id,)).fetchone()
+    claimed, claim_rows = conn.execute(
+        "SELECT COALESCE(SUM(quantity), 0), COUNT(*) FROM claims WHERE listing_id = ?", (listing_id,)).fetchone()
+    conn.close()
+
+    granted = sum(wants[i] for i, claim_id in enumerate(results) if claim_id)
+    violations = []
+    if claimed > listing_portions:
+        violations.append(f"over-allocated: {claimed} claimed of {listing_portions}")
+    if remaining != listing_portions - claimed:
+        violations.append(f"remaining {remaining} != {listing_portions} - {claimed}")
+    if granted != claimed or claim_rows != sum(1 for r in results if r):
+        violations.append(f"successful calls granted {granted} in {sum(1 for r in results if r)} claims, "
+                          f"table has {claimed} in {claim_rows}")
+    if (status == "RESERVED") != (remaining == 0):
+        violations.append(f"status {status} with {remaining} left")
+    # Anyone refused must have asked for more than was left at the end
+    if any(not claim_id and wants[i] <= remaining for i, claim_id in enumerate(results)):
+        violations.append(f"a claim was refused although {remaining} portions are still left")
+    return violations, latencies
+
+def run(db_path, claimers=100, listing_portions=50, max_take=3, rounds=20, seed=5, processes=8):
+    db = use_database(db_path)
+    _seed_users(db_path, claimers)
+    rng = random.Random(seed)
+    # spawn: workers open their own connections instead of inheriting this process's
+    ctx = multiprocessing.get_context("spawn")
+    processes = max(1, min(processes, claimers))
+    tasks, results = ctx.Queue(), ctx.Queue()
+    barrier = ctx.Barrier(processes)
+    workers = [ctx.Process(target=_claimer, args=(db_path, tasks, results, barrier), daemon=True)
+               for _ in range(processes)]
+    for w in workers:
+        w.start()
+    latencies = []
+    try:
+        for n in range(rounds):
+            violations, round_latencies = run_round(db, (tasks, results, workers), listing_portions, claimers,
+                                                    max_take, rng)
+            latencies.extend(round_latencies)
+            if violations:
+                for v in violations:
+                    print(f"round {n + 1}: {v}", file=sys.stderr)
+                return False, latencies
+        return True, latencies
+    finally:
+        for _ in workers:
+            tasks.put(None)
+        for w in workers:
+            w.join()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stress portion-based claims with parallel claimers")
+    parser.add_argument("--db", help="database to use (default: a fresh temporary one)")
+    parser.add_argument("--claimers", type=int, default=100)
+    parser.add_argument("--processes", type=int, default=8, help="worker processes the claimers are spread over")
+    parser.add_argument("--portions", type=int, default=50, help="portions on each listing")
+    parser.add_argument("--max-take", type=int, default=3, help="each claimer asks for 1..max-take portions")
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = Path(args.db) if args.db else Path(tmp) / "stress.db"
+        ok, latencies = run(db_path, args.claimers, args.portions, args.max_take, args.rounds,
+                            processes=args.processes)
+        # The matching worker may still hold the file open
+        import matching
+        matching.drain()
+    print_report({"atomic_claim_listing[contended]": summarize(latencies)})
+    print("OK: no over-allocation" if ok else "FAILED")
+    sys.exit(0 if ok else 1)
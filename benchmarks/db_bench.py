@@ -0,0 +1,79 @@
+# benchmarks/db_bench.py
+# Times db.py's hot paths against a synthetic database and compares the
+# percentiles with benchmarks/baseline.json.
+#
+#   python -m benchmarks.db_bench --db bench/community.db [--save-baseline]
+import argparse
+import random
+import sqlite3
+from pathlib import Path
+
+from benchmarks.harness import use_database, time_calls, summarize, load_baseline, save_baseline, print_report
+
+SUITE = "db"
+
+def _ids(db_path, sql):
+    conn = sqlite3.connect(db_path)
+    ids = [row[0] for row in conn.execute(sql)]
+    conn.close()
+    return ids
+
+def run(db_path, iterations=200, seed=7):
+    """Returns {benchmark name: percentile summary} for each hot path."""
+    db = use_database(db_path)
+    rng = random.Random(seed)
+
+    users = _ids(db_path, "SELECT id FROM users")
+    ngos = _ids(db_path, "SELECT id FROM users WHERE user_type = 'NGO'") or users
+    individuals = _ids(db_path, "SELECT id FROM users WHERE user_type != 'NGO'") or users
+    reviewed = _ids(db_path, "SELECT DISTINCT reviewee_id FROM reviews") or users
+    available = _ids(db_path, "SELECT id FROM listings WHERE status = 'AVAILABLE'")
+    reserved = [
+        tuple(row) for row in sqlite3.connect(db_path).execute("""
+            SELECT c.id, l.donor_id, c.receiver_id FROM claims c
+            JOIN listings l ON l.id = c.listing_id WHERE c.status = 'RESERVED'
+        """)
+    ]
+    rng.shuffle(available)
+    rng.shuffle(reserved)
+
+    def sample(pool, n):
+        return [(rng.choice(pool),) for _ in range(n)]
+
+    results = {}
+    results["get_available_listings[ngo]"] = summarize(
+        time_calls(db.get_available_listings, sample(ngos, iterations)))
+    results["get_available_listings[individual]"] = summarize(
+        time_calls(db.get_available_listings, sample(individuals, iterations)))
+    from recommend import rank_listings
+    results["recommended_listings[individual]"] = summarize(time_calls(
+        lambda uid: rank_listings(db.get_available_listings(uid), db.get_receiver_claim_history(uid)),
+        sample(individuals, iterations // 4)))
+    results["get_user_notifications"] = summarize(
+        time_calls(db.get_user_notifications, sample(users, iterations)))
+    results["get_reviews_for_user"] = summarize(
+        time_calls(db.get_reviews_for_user, sample(reviewed, iterations)))
+    results["check_and_award_badges"] = summarize(
+        time_calls(db.check_and_award_badges, sample(users, iterations)))
+
+    # Mutating paths consume distinct listings/claims so every call does real work
+    claims = [(lid, rng.choice(users)) for lid in available[:iterations]]
+    results["atomic_claim_listing"] = summarize(time_calls(db.atomic_claim_listing, claims))
+    results["complete_claim_and_award_points"] = summarize(
+        time_calls(db.complete_claim_and_award_points, reserved[:iterations]))
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark db.py hot paths")
+    parser.add_argument("--db", default="bench/community.db")
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as the new baseline")
+    args = parser.parse_args()
+
+    if not Path(args.db).exists():
+        parser.error(f"{args.db} not found; create it with python -m benchmarks.synthetic --db {args.db}")
+    results = run(args.db, args.iterations)
+    print_report(results, load_baseline(SUITE))
+    if args.save_baseline:
+        save_baseline(SUITE, results)
+        print("Baseline saved.")
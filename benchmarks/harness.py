@@ -0,0 +1,95 @@
+# benchmarks/harness.py
+# Shared helpers: pointing db.py at a benchmark database, timing calls,
+# percentile summaries and comparison against a stored baseline.
+import contextlib
+import io
+import json
+import logging
+import os
+import statistics
+import time
+from pathlib import Path
+
+BASELINE_PATH = Path(__file__).with_name("baseline.json")
+
+def use_database(db_path):
+    """
+    Points db.py at db_path (via FOOD_CIRCLE_DB) and applies the app's startup
+    migrations. Logging drops to WARNING unless FOOD_CIRCLE_LOG_LEVEL is set, so
+    per-call INFO records neither flood stderr nor load the timed calls.
+    """
+    os.environ["FOOD_CIRCLE_DB"] = str(db_path)
+    os.environ.setdefault("FOOD_CIRCLE_LOG_LEVEL", "WARNING")
+    import log_utils
+    log_utils.setup_logging()
+    # The loggers may already be set up by an earlier import
+    logging.getLogger(log_utils.ROOT_LOGGER).setLevel(os.environ["FOOD_CIRCLE_LOG_LEVEL"].upper())
+    from init_db import init_db
+    import db
+    init_db(db_path)
+    with contextlib.redirect_stdout(io.StringIO()):
+        db.create_reviews_table_if_not_exists()
+        db.alter_claims_table_if_needed()
+        db.create_gamification_tables_if_not_exists()
+        db.alter_listings_table_for_visibility()
+        db.alter_listings_table_for_quantity()
+        db.migrate_time_columns_to_epoch()
+        db.create_analytics_tables_if_not_exists()
+        db.migrate_notifications_table()
+        db.create_matching_tables_if_not_exists()
+        db.create_api_tables_if_not_exists()
+        db.create_rate_limit_table_if_not_exists()
+        db.create_urgency_tables_if_not_exists()
+        import shards
+        shards.ensure_shards()
+    return db
+
+def time_calls(fn, args_iter, quiet=True):
+    """Calls fn(*args) for each args tuple and returns the latencies in milliseconds."""
+    latencies = []
+    sink = io.StringIO()
+    for args in args_iter:
+        # Whatever a call prints stays off the terminal but inside the timing (db.py logs instead)
+        with contextlib.redirect_stdout(sink) if quiet else contextlib.nullcontext():
+            started = time.perf_counter()
+            fn(*args)
+            latencies.append((time.perf_counter() - started) * 1000)
+        sink.seek(0)
+        sink.truncate()
+    return latencies
+
+def summarize(latencies):
+    """p50/p95/p99/mean in milliseconds for a list of latencies."""
+    if len(latencies) < 2:
+        value = latencies[0] if latencies else 0.0
+        return {"n": len(latencies), "p50": value, "p95": value, "p99": value, "mean": value}
+    cuts = statistics.quantiles(latencies, n=100, method="inclusive")
+    return {
+        "n": len(latencies),
+        "p50": round(cuts[49], 3),
+        "p95": round(cuts[94], 3),
+        "p99": round(cuts[98], 3),
+        "mean": round(statistics.fmean(latencies), 3),
+    }
+
+def load_baseline(suite, path=BASELINE_PATH):
+    if not Path(path).exists():
+        return {}
+    return json.loads(Path(path).read_text()).get(suite, {})
+
+def save_baseline(suite, results, path=BASELINE_PATH):
+    data = json.loads(Path(path).read_text()) if Path(path).exists() else {}
+    data[suite] = results
+    Path(path).write_text(json.dumps(data, indent=2, sort_keys=True) + "\n")
+
+def print_report(results, baseline=None):
+    """Prints one line per benchmark, with the p95 change against the baseline if there is one."""
+    baseline = baseline or {}
+    print(f"{'benchmark':<34}{'n':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}  vs baseline p95")
+    for name, s in results.items():
+        line = f"{name:<34}{s['n']:>6}{s['p50']:>10.3f}{s['p95']:>10.3f}{s['p99']:>10.3f}"
+        base = baseline.get(name)
+        if base and base.get("p95"):
+            change = (s["p95"] - base["p95"]) / base["p95"] * 100
+            line += f"  {change:+.1f}%"
+        print(line)
@@ -0,0 +1,83 @@
+# benchmarks/matching_bench.py
+# Times donor-side matching (matching.py) against a receiver_activity table
+# padded with extra synthetic receivers, 100k by default, around the same
+# city centres as the generator. Reports latency percentiles for the spatial
+# lookup + scoring step and for the full notify path (lookup + batched insert).
+#
+#   python -m benchmarks.matching_bench --db bench/community.db --receivers 100000
+import argparse
+import datetime
+import random
+import sqlite3
+from pathlib import Path
+
+from benchmarks.harness import use_database, time_calls, summarize, load_baseline, save_baseline, print_report
+from benchmarks.synthetic import CITY_CENTERS, CITY_SPREAD_DEG
+from maps_utils import geocell
+
+SUITE = "matching"
+FIRST_SYNTHETIC_ID = 10_000_000  # well clear of real user ids
+
+def pad_receivers(db_path, receivers, seed=11):
+    """Tops receiver_activity up to `receivers` rows with synthetic receivers."""
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA foreign_keys = OFF;")
+    missing = receivers - conn.execute("SELECT COUNT(*) FROM receiver_activity").fetchone()[0]
+    rng = random.Random(seed)
+    now = datetime.datetime.utcnow()
+    rows = []
+    for i in range(max(missing, 0)):
+        lat0, lng0 = rng.choice(CITY_CENTERS)
+        lat, lng = rng.gauss(lat0, CITY_SPREAD_DEG), rng.gauss(lng0, CITY_SPREAD_DEG)
+        active = now - datetime.timedelta(seconds=rng.uniform(0, 60 * 86400))
+        rows.append((FIRST_SYNTHETIC_ID + i, "NGO" if rng.random() < 0.08 else "Individual", lat, lng,
+                     geocell(lat, lng), active.strftime("%Y-%m-%d %H:%M:%S"), rng.randint(1, 40)))
+    # Matching notifications reference users(id), so the padding receivers get user rows too
+    conn.executemany("""
+        INSERT OR IGNORE INTO users (id, name, email, password_hash, user_type) VALUES (?, ?, ?, 'x', ?)
+    """, [(row[0], f"Receiver {row[0]}", f"receiver{row[0]}@example.com", row[1]) for row in rows])
+    conn.executemany("""
+        INSERT OR IGNORE INTO receiver_activity (user_id, user_type, lat, lng, geocell, last_active_at, claims)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, rows)
+    conn.commit()
+    conn.close()
+
+def run(db_path, receivers=100_000, iterations=200, seed=7):
+    db = use_database(db_path)
+    import matching
+    pad_receivers(db_path, receivers)
+    rng = random.Random(seed)
+
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    listings = [dict(r) for r in conn.execute("""
+        SELECT * FROM listings WHERE status = 'AVAILABLE' AND lat IS NOT NULL ORDER BY RANDOM() LIMIT ?
+    """, (iterations,))]
+    conn.close()
+    rng.shuffle(listings)
+
+    results = {}
+    results["match_receivers[everyone]"] = summarize(time_calls(
+        matching.match_receivers, [(l,) for l in listings if l["visibility"] != "ngo_only"]))
+    results["match_receivers[ngo_only]"] = summarize(time_calls(
+        matching.match_receivers, [(dict(l, visibility="ngo_only"),) for l in listings]))
+    results["notify_matches"] = summarize(time_calls(
+        matching.notify_matches, [(l["id"],) for l in listings[:iterations // 4]]))
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark donor-side matching")
+    parser.add_argument("--db", default="bench/community.db")
+    parser.add_argument("--receivers", type=int, default=100_000)
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as the new baseline")
+    args = parser.parse_args()
+
+    if not Path(args.db).exists():
+        parser.error(f"{args.db} not found; create it with python -m benchmarks.synthetic --db {args.db}")
+    results = run(args.db, args.receivers, args.iterations)
+    print_report(results, load_baseline(SUITE))
+    if args.save_baseline:
+        save_baseline(SUITE, results)
+        print("Baseline saved.")
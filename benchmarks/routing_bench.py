@@ -0,0 +1,72 @@
+# benchmarks/routing_bench.py
+# Times the pickup route planner (routing.py) on random multi-stop trips around
+# one city and reports route quality next to the timings: distance and late
+# stops for the planner, for nearest-neighbour construction alone, and for the
+# order the claims were made in.
+#
+#   python -m benchmarks.routing_bench --stops 200 [--save-baseline]
+import argparse
+import datetime
+import random
+
+import numpy as np
+
+from benchmarks.harness import time_calls, summarize, load_baseline, save_baseline, print_report
+from benchmarks.synthetic import CITY_CENTERS, CITY_SPREAD_DEG
+import routing
+
+SUITE = "routing"
+DEADLINE_SHARE = 0.5     # share of stops with a deadline
+TRIP_HOURS = 24          # deadlines fall within this window after departure
+
+def make_trip(rng, n_stops, start):
+    lat0, lng0 = rng.choice(CITY_CENTERS)
+    stops = []
+    for i in range(n_stops):
+        deadline = None
+        if rng.random() < DEADLINE_SHARE:
+            deadline = start + datetime.timedelta(minutes=rng.uniform(30, TRIP_HOURS * 60))
+        stops.append({"claim_id": i, "lat": rng.gauss(lat0, CITY_SPREAD_DEG),
+                      "lng": rng.gauss(lng0, CITY_SPREAD_DEG), "deadline": deadline})
+    return (lat0, lng0), stops
+
+def run(n_stops=200, trips=20, seed=3):
+    rng = random.Random(seed)
+    start = datetime.datetime(2026, 1, 1, 8, 0)
+    cases = [make_trip(rng, n_stops, start) for _ in range(trips)]
+
+    results = {
+        f"plan_route[{n_stops} stops]": summarize(time_calls(
+            lambda depot, stops: routing.plan_route(depot, stops, start), cases)),
+        f"nearest_neighbour_only[{n_stops} stops]": summarize(time_calls(
+            lambda depot, stops: routing.plan_route(depot, stops, start, improve=False), cases)),
+    }
+
+    quality = {"planned": [], "nearest_neighbour": [], "claim_order": []}
+    for depot, stops in cases:
+        for name, plan in (("planned", routing.plan_route(depot, stops, start)),
+                           ("nearest_neighbour", routing.plan_route(depot, stops, start, improve=False))):
+            quality[name].append((plan["total_km"], plan["late_stops"]))
+        p = routing._Problem(depot, stops, start, True, routing.AVG_SPEED_KMH, routing.SERVICE_MINUTES)
+        order = np.arange(1, len(stops) + 1)
+        late = int((p.arrivals(order)[:len(stops)] > p.deadline[order]).sum())
+        quality["claim_order"].append((p.length(order), late))
+    return results, {name: (float(np.mean([q[0] for q in rows])), float(np.mean([q[1] for q in rows])))
+                     for name, rows in quality.items()}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the pickup route planner")
+    parser.add_argument("--stops", type=int, default=200)
+    parser.add_argument("--trips", type=int, default=20)
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as the new baseline")
+    args = parser.parse_args()
+
+    results, quality = run(args.stops, args.trips)
+    print_report(results, load_baseline(SUITE))
+    print()
+    print(f"{'route':<20}{'mean km':>10}{'mean late stops':>18}")
+    for name, (km, late) in quality.items():
+        print(f"{name:<20}{km:>10.1f}{late:>18.1f}")
+    if args.save_baseline:
+        save_baseline(SUITE, results)
+        print("Baseline saved.")
@@ -0,0 +1,93 @@
+# benchmarks/row_memory_bench.py
+# Per-row footprint of a listing feed: dict(sqlite3.Row) over SELECT * (how
+# pages held rows before models.py) against models.Listing over its column
+# projection. Listings are repeated to reach --rows, each one a separate set of
+# Python objects as a real feed of that size would be. Reports the bytes each
+# row keeps alive (tracemalloc), its pickled size (what st.cache_data stores)
+# and how long building the feed takes.
+#
+#   python -m benchmarks.row_memory_bench --db bench/community.db --rows 100000
+import argparse
+import pickle
+import sqlite3
+import tracemalloc
+from pathlib import Path
+
+from benchmarks.harness import use_database, time_calls, summarize, load_baseline, save_baseline, print_report
+from models import Listing
+
+SUITE = "row_memory"
+
+FEED_SQL = """
+    WITH copies(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM copies WHERE n < :copies)
+    SELECT {columns} FROM copies, listings LIMIT :rows
+"""
+
+VARIANTS = {
+    # Before: every column, one dict per row
+    "dict_select_star": ("listings.*", lambda cur: [dict(r) for r in cur.fetchall()]),
+    # The projection alone, still as dicts
+    "dict_projected": (Listing.columns("listings"), lambda cur: [dict(r) for r in cur.fetchall()]),
+    # After: the projection as slotted records
+    "listing_model": (Listing.columns("listings"), Listing.fetchall),
+}
+
+def build_feed(conn, variant, rows):
+    columns, convert = VARIANTS[variant]
+    total = conn.execute("SELECT COUNT(*) FROM listings").fetchone()[0]
+    cur = conn.execute(FEED_SQL.format(columns=columns), {"copies": -(-rows // max(total, 1)), "rows": rows})
+    return convert(cur)
+
+def measure(conn, variant, rows):
+    """Bytes per row kept alive by the feed, and pickled bytes per row."""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    feed = build_feed(conn, variant, rows)
+    held = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    n = max(len(feed), 1)
+    return {"rows": len(feed), "bytes_per_row": round(held / n, 1),
+            "pickled_bytes_per_row": round(len(pickle.dumps(feed)) / n, 1)}
+
+def run(db_path, rows=100_000, iterations=5):
+    """Returns ({variant: memory}, {build[variant]: percentile summary})."""
+    use_database(db_path)
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    memory, timings = {}, {}
+    for variant in VARIANTS:
+        memory[variant] = measure(conn, variant, rows)
+        timings[f"build[{variant}]"] = summarize(time_calls(
+            lambda v=variant: build_feed(conn, v, rows), [()] * iterations))
+    conn.close()
+    return memory, timings
+
+def print_memory(memory, baseline=None):
+    baseline = baseline or {}
+    print(f"{'variant':<34}{'rows':>8}{'bytes/row':>12}{'pickled/row':>13}  vs baseline bytes/row")
+    for name, m in memory.items():
+        line = f"{name:<34}{m['rows']:>8}{m['bytes_per_row']:>12.1f}{m['pickled_bytes_per_row']:>13.1f}"
+        base = baseline.get(name)
+        if base and base.get("bytes_per_row"):
+            change = (m["bytes_per_row"] - base["bytes_per_row"]) / base["bytes_per_row"] * 100
+            line += f"  {change:+.1f}%"
+        print(line)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark per-row memory of the listing feed")
+    parser.add_argument("--db", default="bench/community.db")
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as the new baseline")
+    args = parser.parse_args()
+
+    if not Path(args.db).exists():
+        parser.error(f"{args.db} not found; create it with python -m benchmarks.synthetic --db {args.db}")
+    memory, timings = run(args.db, args.rows, args.iterations)
+    print_memory(memory, load_baseline(SUITE + "_memory"))
+    print()
+    print_report(timings, load_baseline(SUITE))
+    if args.save_baseline:
+        save_baseline(SUITE + "_memory", memory)
+        save_baseline(SUITE, timings)
+        print("Baseline saved.")
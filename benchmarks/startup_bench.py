@@ -0,0 +1,95 @@
+# benchmarks/startup_bench.py
+# Cold and warm script-run times for app.py under Streamlit's AppTest runner.
+# Cold: a fresh interpreter imports everything and performs the first run
+# (one-time init included). Warm: further runs in the same process, which is
+# what every click in a live session costs.
+#
+#   python -m benchmarks.startup_bench --db bench/community.db [--save-baseline]
+import argparse
+import json
+import sqlite3
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+from benchmarks.harness import use_database, summarize, load_baseline, save_baseline, print_report
+
+SUITE = "startup"
+ROOT = Path(__file__).resolve().parent.parent
+APP_PATH = ROOT / "app.py"
+PAGES = ["home", "receiver", "my impact"]
+
+def _run_app(page, user):
+    """One AppTest script run of app.py; returns its wall time in milliseconds."""
+    from streamlit.testing.v1 import AppTest
+    import session_store
+    at = AppTest.from_file(str(APP_PATH), default_timeout=120)
+    session_store.login("bench", user)
+    at.session_state["session_id"] = "bench"
+    at.session_state["page"] = page
+    started = time.perf_counter()
+    at.run()
+    elapsed = (time.perf_counter() - started) * 1000
+    if at.exception:
+        raise RuntimeError(f"app.py raised on page {page!r}: {at.exception[0].message}")
+    return elapsed
+
+def _cold_child(page, user_json):
+    # Runs in a fresh interpreter: time the imports and the first script run together
+    started = time.perf_counter()
+    sys.path.insert(0, str(ROOT))
+    _run_app(page, json.loads(user_json))
+    print(json.dumps({"ms": (time.perf_counter() - started) * 1000}))
+
+def _user(db_path):
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    row = conn.execute("SELECT * FROM users WHERE user_type = 'NGO' LIMIT 1").fetchone() \
+        or conn.execute("SELECT * FROM users LIMIT 1").fetchone()
+    conn.close()
+    if row is None:
+        raise SystemExit(f"{db_path} has no users; generate it with python -m benchmarks.synthetic")
+    return dict(row)
+
+def run(db_path, cold_runs=5, warm_runs=20):
+    """Returns {benchmark name: percentile summary} for cold and warm reruns."""
+    db_path = Path(db_path).resolve()  # the cold-start children run from the repo root
+    use_database(db_path)
+    user = _user(db_path)
+    results = {}
+
+    cold = []
+    for _ in range(cold_runs):
+        out = subprocess.run(
+            [sys.executable, "-m", "benchmarks.startup_bench", "--cold-child", "home", json.dumps(user)],
+            cwd=ROOT, capture_output=True, text=True, check=True,
+        )
+        cold.append(json.loads(out.stdout.strip().splitlines()[-1])["ms"])
+    results["cold_start[home]"] = summarize(cold)
+
+    sys.path.insert(0, str(ROOT))
+    for page in PAGES:
+        _run_app(page, user)  # first run in this process pays for imports and init
+        results[f"warm_rerun[{page}]"] = summarize([_run_app(page, user) for _ in range(warm_runs)])
+    return results
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4 and sys.argv[1] == "--cold-child":
+        _cold_child(sys.argv[2], sys.argv[3])
+        sys.exit(0)
+
+    parser = argparse.ArgumentParser(description="Benchmark app.py cold start and warm reruns")
+    parser.add_argument("--db", default="bench/community.db")
+    parser.add_argument("--cold-runs", type=int, default=5)
+    parser.add_argument("--warm-runs", type=int, default=20)
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as the new baseline")
+    args = parser.parse_args()
+
+    if not Path(args.db).exists():
+        parser.error(f"{args.db} not found; create it with python -m benchmarks.synthetic --db {args.db}")
+    results = run(args.db, args.cold_runs, args.warm_runs)
+    print_report(results, load_baseline(SUITE))
+    if args.save_baseline:
+        save_baseline(SUITE, results)
+        print("Baseline saved.")
@@ -0,0 +1,211 @@
+# benchmarks/synthetic.py
+# Synthetic community generator: users, geo-distributed listings, claims,
+# reviews and notifications at a configurable total row count.
+#
+#   python -m benchmarks.synthetic --rows 1000000 --db bench/community.db
+import argparse
+import contextlib
+import datetime
+import io
+import random
+import sqlite3
+import time
+from pathlib import Path
+
+from benchmarks.harness import use_database
+
+# (lat, lng) of the cities listings are scattered around
+CITY_CENTERS = [
+    (12.9716, 77.5946),
+    (19.0760, 72.8777),
+    (28.6139, 77.2090),
+    (13.0827, 80.2707),
+    (17.3850, 78.4867),
+]
+CITY_SPREAD_DEG = 0.08
+
+USER_TYPES = ["Household", "Individual", "Restaurant", "Event Organizer", "NGO"]
+USER_TYPE_WEIGHTS = [45, 30, 12, 5, 8]
+DISHES = ["Veg Biryani", "Dal Rice", "Chapati", "Paneer Curry", "Bread Loaves", "Fruit Box",
+          "Sandwiches", "Idli Sambar", "Chicken Curry", "Pasta", "Cookies", "Milk Packets"]
+CUISINES = ["Indian", "South Indian", "Continental", "Chinese", "Bakery"]
+
+# Share of the requested total row count that goes to each table
+SHARES = {"users": 0.04, "listings": 0.36, "notifications": 0.30}
+LISTING_STATUS_WEIGHTS = {"AVAILABLE": 40, "RESERVED": 45, "EXPIRED": 15}
+COMPLETED_SHARE = 0.7
+REVIEWED_SHARE = 0.6
+BATCH = 50_000
+
+def _timestamp(rng, now, max_days):
+    moment = now - datetime.timedelta(seconds=rng.uniform(0, max_days * 86400))
+    return moment.strftime("%Y-%m-%d %H:%M:%S")
+
+def _batched(conn, sql, rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= BATCH:
+            conn.executemany(sql, batch)
+            batch.clear()
+    if batch:
+        conn.executemany(sql, batch)
+
+def generate(db_path, rows=10_000, seed=42):
+    """Fills db_path with roughly `rows` rows across all tables. Returns per-table counts."""
+    db = use_database(db_path)
+    rng = random.Random(seed)
+    now = datetime.datetime.utcnow()
+
+    n_users = max(50, int(rows * SHARES["users"]))
+    n_listings = max(100, int(rows * SHARES["listings"]))
+    n_notifications = int(rows * SHARES["notifications"])
+
+    from auth import hash_password
+    password_hash = hash_password("password")  # one bcrypt hash shared by every synthetic user
+
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA foreign_keys = OFF;")
+    conn.execute("PRAGMA synchronous = OFF;")
+    counts = {}
+
+    user_types = rng.choices(USER_TYPES, weights=USER_TYPE_WEIGHTS, k=n_users)
+    _batched(conn, """
+        INSERT INTO users (id, name, email, password_hash, phone, user_type, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, (
+        (uid, f"User {uid}", f"user{uid}@example.com", password_hash,
+         f"+91{9000000000 + uid}", user_types[uid - 1], _timestamp(rng, now, 365))
+        for uid in range(1, n_users + 1)
+    ))
+    counts["users"] = n_users
+
+    donors = [uid for uid, t in enumerate(user_types, 1) if t in ("Restaurant", "Event Organizer", "Household")]
+    receivers = [uid for uid, t in enumerate(user_types, 1) if t in ("Individual", "NGO", "Household")]
+    ngos = [uid for uid, t in enumerate(user_types, 1) if t == "NGO"] or receivers
+    bulk_donors = {uid for uid, t in enumerate(user_types, 1) if t in ("Restaurant", "Event Organizer")}
+
+    statuses = list(LISTING_STATUS_WEIGHTS)
+    status_weights = list(LISTING_STATUS_WEIGHTS.values())
+    listing_meta = []  # (listing_id, donor_id, status, visibility)
+
+    def listings():
+        for lid in range(1, n_listings + 1):
+            donor = rng.choice(donors)
+            status = rng.choices(statuses, weights=status_weights)[0]
+            visibility = "ngo_only" if donor in bulk_donors and rng.random() < 0.3 else "everyone"
+            listing_meta.append((lid, donor, status, visibility))
+            lat0, lng0 = rng.choice(CITY_CENTERS)
+            cooked = rng.random() < 0.6
+            created = _timestamp(rng, now, 90)
+            day = created[:10]
+            expiry = None if cooked else (now + datetime.timedelta(days=rng.randint(-30, 30))).date().isoformat()
+            if status == "AVAILABLE" and expiry and expiry < now.date().isoformat():
+                expiry = (now + datetime.timedelta(days=rng.randint(1, 30))).date().isoformat()
+            yield (
+                lid, donor, rng.choice(DISHES), "Freshly made, please bring a container. " * rng.randint(0, 3),
+                "cooked" if cooked else "packaged", 1 if rng.random() < 0.7 else 0, rng.choice(CUISINES),
+                day if cooked else None, expiry, f"{rng.randint(1, 50)} portions", visibility,
+                rng.gauss(lat0, CITY_SPREAD_DEG), rng.gauss(lng0, CITY_SPREAD_DEG),
+                f"{rng.randint(1, 999)} Example Road", status, created, created,
+            )
+
+    _batched(conn, """
+        INSERT INTO listings (id, donor_id, title, notes, food_type, veg, cuisine, prepared_at,
+                              expiry_at, quantity, visibility, lat, lng, address_text, status,
+                              created_at, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, listings())
+    counts["listings"] = n_listings
+
+    completed = []  # (claim_id, donor_id, receiver_id, completed_at)
+
+    def claims():
+        claim_id = 0
+        for lid, donor, status, visibility in listing_meta:
+            if status != "RESERVED":
+                continue
+            claim_id += 1
+            receiver = rng.choice(ngos if visibility == "ngo_only" else receivers)
+            reserved = _timestamp(rng, now, 90)
+            reserved_dt = datetime.datetime.strptime(reserved, "%Y-%m-%d %H:%M:%S")
+            expires = (reserved_dt + datetime.timedelta(minutes=60)).isoformat()
+            done = None
+            claim_status = "RESERVED"
+            if rng.random() < COMPLETED_SHARE:
+                claim_status = "COMPLETED"
+                done = (reserved_dt + datetime.timedelta(minutes=rng.randint(5, 240))).strftime("%Y-%m-%d %H:%M:%S")
+                completed.append((claim_id, donor, receiver, done))
+            yield (claim_id, lid, receiver, claim_status, reserved, expires, done)
+
+    _batched(conn, """
+        INSERT INTO claims (id, listing_id, receiver_id, status, reserved_at, expires_at, completed_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, claims())
+    counts["claims"] = sum(1 for m in listing_meta if m[2] == "RESERVED")
+
+    def reviews():
+        for claim_id, donor, receiver, done in completed:
+            if rng.random() < REVIEWED_SHARE:
+                yield (claim_id, receiver, donor, rng.randint(2, 5), rng.choice(["Thanks!", "Great food", "", None]), done)
+            if rng.random() < REVIEWED_SHARE / 2:
+                yield (claim_id, donor, receiver, rng.randint(3, 5), "On time pickup", done)
+
+    _batched(conn, """
+        INSERT INTO reviews (claim_id, reviewer_id, reviewee_id, rating, comment, created_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, reviews())
+    counts["reviews"] = conn.execute("SELECT COUNT(*) FROM reviews").fetchone()[0]
+
+    def notifications():
+        for _ in range(n_notifications):
+            user_id = rng.randint(1, n_users)
+            lid = rng.randint(1, n_listings)
+            yield (user_id, "claim", "Your food has been claimed!",
+                   f"User {rng.randint(1, n_users)} wants to take your food.",
+                   lid, rng.randint(1, n_users), 1 if rng.random() < 0.5 else 0, _timestamp(rng, now, 60))
+
+    _batched(conn, """
+        INSERT INTO notifications (user_id, type, title, message, related_listing_id,
+                                   related_user_id, is_read, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    """, notifications())
+    counts["notifications"] = n_notifications
+
+    _batched(conn, """
+        INSERT INTO impact_events (user_id, claim_id, event_type, points, reason, created_at)
+        VALUES (?, ?, ?, ?, 'synthetic', ?)
+    """, (
+        event
+        for claim_id, donor, receiver, done in completed
+        for event in ((donor, claim_id, "donation_completed", 10, done), (receiver, claim_id, "claim_completed", 5, done))
+    ))
+    counts["impact_events"] = 2 * len(completed)
+
+    conn.commit()
+    conn.close()
+
+    # Derived tables go through the same code paths the app uses
+    with contextlib.redirect_stdout(io.StringIO()):
+        db.backfill_notification_titles()
+        db.backfill_listing_quantities()
+        db.backfill_epoch_columns()
+        db.rebuild_stats_from_ledger()
+        from analytics import backfill_rollups
+        backfill_rollups()
+        from matching import backfill_receiver_activity
+        backfill_receiver_activity()
+    return counts
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic Food Circle database")
+    parser.add_argument("--rows", type=int, default=10_000, help="approximate total rows (10k to 10M)")
+    parser.add_argument("--db", default="bench/community.db")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    if Path(args.db).exists():
+        parser.error(f"{args.db} already exists; remove it or pick another --db")
+    started = time.perf_counter()
+    counts = generate(args.db, args.rows, args.seed)
+    print(f"Generated {sum(counts.values())} rows in {time.perf_counter() - started:.1f}s: {counts}")
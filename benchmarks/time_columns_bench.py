@@ -0,0 +1,106 @@
+# benchmarks/time_columns_bench.py
+# Text timestamps vs the integer epoch columns (db.migrate_time_columns_to_epoch)
+# on the queries that filter or order by time: the expiry sweep, newest-first
+# feed pages, report windows and a receiver's claim history. Both variants run
+# against the same scratch copy of the database, each with its own index, so
+# only the column type differs.
+#
+#   python -m benchmarks.time_columns_bench --db bench/community.db
+import argparse
+import datetime
+import random
+import shutil
+import sqlite3
+import tempfile
+from pathlib import Path
+
+from benchmarks.harness import use_database, time_calls, summarize, load_baseline, save_baseline, print_report
+
+SUITE = "time_columns"
+
+# The text-time indexes the epoch ones replaced
+TEXT_INDEXES = (
+    "CREATE INDEX IF NOT EXISTS idx_listings_status_created ON listings(status, created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_listings_status_expiry ON listings(status, expiry_at)",
+    "CREATE INDEX IF NOT EXISTS idx_claims_receiver ON claims(receiver_id, reserved_at)",
+)
+
+QUERIES = {
+    # Due listings at `now`; bare expiry dates last until the end of the day
+    "expiry_sweep": (
+        """SELECT id FROM listings WHERE status = 'AVAILABLE' AND expiry_at IS NOT NULL AND expiry_at < :iso
+           AND (length(expiry_at) > 10 OR expiry_at < substr(:iso, 1, 10))""",
+        "SELECT id FROM listings WHERE status = 'AVAILABLE' AND expiry_ts <= :ts",
+    ),
+    "feed_page": (
+        "SELECT * FROM listings WHERE status = 'AVAILABLE' ORDER BY created_at DESC LIMIT 50 OFFSET :offset",
+        "SELECT * FROM listings WHERE status = 'AVAILABLE' ORDER BY created_ts DESC LIMIT 50 OFFSET :offset",
+    ),
+    # Listings posted in a one-day window (rollups, reports)
+    "created_window": (
+        "SELECT COUNT(*) FROM listings WHERE status = 'AVAILABLE' AND created_at >= :start AND created_at < :end",
+        "SELECT COUNT(*) FROM listings WHERE status = 'AVAILABLE' AND created_ts >= :start_ts AND created_ts < :end_ts",
+    ),
+    "claim_history": (
+        "SELECT * FROM claims WHERE receiver_id = :user ORDER BY reserved_at DESC LIMIT 200",
+        "SELECT * FROM claims WHERE receiver_id = :user ORDER BY reserved_ts DESC LIMIT 200",
+    ),
+}
+
+def run(db_path, iterations=200, seed=7):
+    """Returns {benchmark[text|epoch]: percentile summary}, timed on a scratch copy of db_path."""
+    scratch = Path(tempfile.mkdtemp()) / "time_columns.db"
+    shutil.copyfile(db_path, scratch)
+    try:
+        use_database(scratch)
+        conn = sqlite3.connect(scratch)
+        conn.row_factory = sqlite3.Row
+        for ddl in TEXT_INDEXES:
+            conn.execute(ddl)
+        conn.commit()
+        conn.execute("ANALYZE")
+
+        rng = random.Random(seed)
+        receivers = [row[0] for row in conn.execute("SELECT DISTINCT receiver_id FROM claims")]
+        available = conn.execute("SELECT COUNT(*) FROM listings WHERE status = 'AVAILABLE'").fetchone()[0]
+        today = datetime.datetime.utcnow().replace(microsecond=0)
+
+        def moment(days_from, days_to):
+            t = today + datetime.timedelta(days=rng.uniform(days_from, days_to))
+            return t, int(t.replace(tzinfo=datetime.timezone.utc).timestamp())
+
+        def params():
+            # Sweeps over the next month, one-day windows over the last three, any page, any receiver
+            now, now_ts = moment(0, 30)
+            start, start_ts = moment(-90, -1)
+            return {"iso": now.isoformat(), "ts": now_ts,
+                    "start": start.strftime("%Y-%m-%d %H:%M:%S"), "start_ts": start_ts,
+                    "end": (start + datetime.timedelta(days=1)).strftime("%Y-%m-%d %H:%M:%S"),
+                    "end_ts": start_ts + 86400,
+                    "offset": rng.randrange(max(1, available - 50)), "user": rng.choice(receivers)}
+
+        results = {}
+        for name, (text_sql, epoch_sql) in QUERIES.items():
+            samples = [(params(),) for _ in range(iterations)]
+            for variant, sql in (("text", text_sql), ("epoch", epoch_sql)):
+                results[f"{name}[{variant}]"] = summarize(time_calls(
+                    lambda p, sql=sql: conn.execute(sql, p).fetchall(), samples))
+        conn.close()
+        return results
+    finally:
+        shutil.rmtree(scratch.parent, ignore_errors=True)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark text vs epoch time columns")
+    parser.add_argument("--db", default="bench/community.db")
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as the new baseline")
+    args = parser.parse_args()
+
+    if not Path(args.db).exists():
+        parser.error(f"{args.db} not found; create it with python -m benchmarks.synthetic --db {args.db}")
+    results = run(args.db, args.iterations)
+    print_report(results, load_baseline(SUITE))
+    if args.save_baseline:
+        save_baseline(SUITE, results)
+        print("Baseline saved.")
@@ -0,0 +1,77 @@
+# cache_utils.py
+import streamlit as st
+from db import (
+    get_generation,
+    get_available_listings,
+    get_user_stats,
+    get_user_badges,
+    get_reviews_for_user,
+    get_notification_inbox,
+    get_receiver_claim_history,
+)
+from recommend import rank_listings
+
+# Upper bound on how long a cached read may live. Writes made through db.py
+# invalidate sooner by bumping the generation that is part of every cache key.
+CACHE_TTL_SECONDS = 300
+# Recommendation scores depend on time-to-expiry, so they are recomputed more often
+RECOMMENDATION_TTL_SECONDS = 60
+
+# st.cache_data pickles what it stores: the db.py readers return models.py
+# records, which pickle, and other results are converted to plain dicts, as
+# sqlite3.Row objects cannot be pickled.
+
+@st.cache_data(ttl=CACHE_TTL_SECONDS, max_entries=1000, show_spinner=False)
+def _available_listings(user_id, generation):
+    return get_available_listings(user_id)
+
+def cached_available_listings(user_id):
+    """Available listings for a user; refreshed after any listing, claim or profile write."""
+    return _available_listings(user_id, get_generation("listings", "users", "snapshot"))
+
+@st.cache_data(ttl=RECOMMENDATION_TTL_SECONDS, max_entries=1000, show_spinner=False)
+def _recommended_listings(user_id, origin, generation):
+    return rank_listings(get_available_listings(user_id), get_receiver_claim_history(user_id), origin)
+
+def cached_recommended_listings(user_id, origin=None):
+    """Available listings ranked for this receiver (see recommend.py); origin is (lat, lng) or None."""
+    if origin is not None:
+        origin = (round(float(origin[0]), 3), round(float(origin[1]), 3))  # ~100 m, so small GPS jitter reuses the entry
+    return _recommended_listings(user_id, origin, get_generation("listings", "claims", "users", "snapshot"))
+
+@st.cache_data(ttl=CACHE_TTL_SECONDS, max_entries=1000, show_spinner=False)
+def _user_stats(user_id, generation):
+    return get_user_stats(user_id)
+
+def cached_user_stats(user_id):
+    return _user_stats(user_id, get_generation("stats", "snapshot"))
+
+@st.cache_data(ttl=CACHE_TTL_SECONDS, max_entries=1000, show_spinner=False)
+def _user_badges(user_id, generation):
+    return get_user_badges(user_id)
+
+def cached_user_badges(user_id):
+    return _user_badges(user_id, get_generation("badges", "snapshot"))
+
+@st.cache_data(ttl=CACHE_TTL_SECONDS, max_entries=1000, show_spinner=False)
+def _review_summary(user_id, generation):
+    reviews = get_reviews_for_user(user_id)
+    count = len(reviews)
+    average = sum(r["rating"] for r in reviews) / count if count else None
+    return {"count": count, "average": average, "reviews": reviews}
+
+def cached_review_summary(user_id):
+    """Review count, average rating and the reviews themselves for one user."""
+    return _review_summary(user_id, get_generation("reviews", "snapshot"))
+
+@st.cache_data(ttl=CACHE_TTL_SECONDS, max_entries=1000, show_spinner=False)
+def _notification_inbox(user_id, generation):
+    return get_notification_inbox(user_id)
+
+def cached_notification_inbox(user_id):
+    """Latest notifications plus unread count, from one query per notifications write."""
+    return _notification_inbox(user_id, get_generation("notifications"))
+
+def cached_unread_count(user_id):
+    """Unread notification count shown in the sidebar on every rerun (shares the inbox entry)."""
+    return cached_notification_inbox(user_id)["unread_count"]
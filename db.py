@@ -1,34 +1,437 @@
 # db.py
+import datetime
+import heapq
+import logging
+import os
+import re
 import sqlite3
+import threading
+import time
 from sqlite3 import Connection, Row
 from pathlib import Path
 import streamlit as st
+from maps_utils import geocell
+from instrumentation import InstrumentedConnection, REGISTRY, settings as instrumentation_settings
+from log_utils import get_logger
+from models import Listing, Claim, Notification, Review
+
+log = get_logger("db")
 
 def get_db_path():
-    # prefer secrets
-    try:
-        p = st.secrets["db_path"]
-    except Exception:
-        p = "data/community.db"
+    # FOOD_CIRCLE_DB lets scripts and benchmarks point at another file; otherwise prefer secrets
+    p = os.environ.get("FOOD_CIRCLE_DB")
+    if not p:
+        try:
+            p = st.secrets["db_path"]
+        except Exception:
+            p = "data/community.db"
     Path(p).parent.mkdir(parents=True, exist_ok=True)
     return p
 
-def get_conn() -> Connection:
-    p = get_db_path()
-    conn = sqlite3.connect(p, check_same_thread=False)
+def get_setting(name, default):
+    """Reads a setting from the FOOD_CIRCLE_<NAME> environment variable, then secrets."""
+    value = os.environ.get(f"FOOD_CIRCLE_{name.upper()}")
+    if value is not None:
+        return value
+    try:
+        return st.secrets[name]
+    except Exception:
+        return default
+
+# Query instrumentation (instrumentation.py); on unless db_instrumentation is false
+INSTRUMENT_QUERIES = str(get_setting("db_instrumentation", True)).lower() not in ("0", "false", "no", "off")
+instrumentation_settings["slow_query_ms"] = float(get_setting("slow_query_ms", 200))
+_CONNECTION_FACTORY = InstrumentedConnection if INSTRUMENT_QUERIES else sqlite3.Connection
+
+# Listings and claims of configured regions live in shard files next to the
+# main database (shards.py); MAIN_SHARD is the main database itself.
+MAIN_SHARD = "main"
+
+def get_shard_path(shard):
+    p = Path(get_db_path())
+    return str(p.with_name(f"{p.stem}_{shard}{p.suffix}"))
+
+def get_conn(shard=None) -> Connection:
+    """
+    Opens the main database, or with a shard name (shards.py) that shard's file
+    with the main database attached as `home`. Unqualified names resolve to the
+    shard first, so listings/claims are the shard's while users, notifications,
+    rollups etc. are still found in home.
+    """
+    started = time.perf_counter()
+    sharded = shard not in (None, MAIN_SHARD)
+    p = get_shard_path(shard) if sharded else get_db_path()
+    conn = sqlite3.connect(p, check_same_thread=False, factory=_CONNECTION_FACTORY)
     conn.row_factory = sqlite3.Row
-    conn.execute("PRAGMA foreign_keys = ON;")
+    if sharded:
+        # Foreign keys cannot point into another file, so users(id) is not enforced here
+        conn.execute("ATTACH DATABASE ? AS home", (get_db_path(),))
+    else:
+        conn.execute("PRAGMA foreign_keys = ON;")
     conn.execute("PRAGMA journal_mode = WAL;")
+    if INSTRUMENT_QUERIES:
+        REGISTRY.observe_acquire((time.perf_counter() - started) * 1000)
     return conn
 
+# --- START: Main-database effects of shard writes ---
+# A listing or claim written to a regional shard also adds rows in the main
+# database (rollups, receiver_activity, shard_users, the impact ledger). SQLite
+# commits attached files atomically only in rollback-journal mode, not in WAL,
+# so those rows are not put in the shard's transaction: the shard commits
+# first, then they get a transaction of their own on the main database.
+# Without shards it is all one file and one transaction. If the second step
+# fails, or the process dies between the two, the shard write stands and
+# repair_home_effects() restores what can be derived from the shards again:
+# shard_users, and the ledger with its user_stats deltas. The rollup counters
+# that were lost come back with python analytics.py --backfill; a receiver's
+# receiver_activity row with their next claim.
+
+def _commit_with_home_effects(conn, shards_written, apply):
+    """
+    Commits conn's open transaction and apply(cur), which writes the main
+    database. shards_written is the set of shards the transaction wrote to.
+    """
+    if shards_written <= {MAIN_SHARD}:
+        apply(conn.cursor())
+        conn.commit()
+        return
+    conn.commit()
+    home = get_conn()
+    try:
+        home.execute("BEGIN IMMEDIATE;")
+        apply(home.cursor())
+        home.commit()
+    except Exception:
+        home.rollback()
+        log.exception("Main database rows of a shard write were not recorded; repair_home_effects() restores them",
+                      extra={"shards": sorted(shards_written)})
+    finally:
+        home.close()
+
+def repair_home_effects():
+    """
+    Restores main-database rows that shard writes committed without (see
+    above): shard_users for every shard's donors and receivers, and ledger
+    events, with their user_stats deltas, for completed claims that have none.
+    Idempotent. Returns the number of ledger events added.
+    """
+    import shards
+    added = 0
+    for shard in shards.names()[1:]:
+        if not os.path.exists(get_shard_path(shard)):
+            continue
+        conn = get_conn(shard)
+        cur = conn.cursor()
+        try:
+            cur.execute("BEGIN IMMEDIATE;")
+            cur.execute("""
+                INSERT OR IGNORE INTO home.shard_users (user_id, shard)
+                SELECT donor_id, :shard FROM listings WHERE donor_id IS NOT NULL
+                UNION SELECT receiver_id, :shard FROM claims WHERE receiver_id IS NOT NULL
+            """, {"shard": shard})
+            cur.execute("""
+                SELECT c.id, l.donor_id, c.receiver_id FROM claims c
+                JOIN listings l ON l.id = c.listing_id
+                WHERE c.status = 'COMPLETED' AND (
+                    NOT EXISTS (SELECT 1 FROM home.impact_events e
+                                WHERE e.claim_id = c.id AND e.event_type = 'donation_completed')
+                    OR NOT EXISTS (SELECT 1 FROM home.impact_events e
+                                   WHERE e.claim_id = c.id AND e.event_type = 'claim_completed'))
+            """)
+            for row in cur.fetchall():
+                added += record_impact_event(cur, row["donor_id"], "donation_completed", row["id"], reason="repair")
+                added += record_impact_event(cur, row["receiver_id"], "claim_completed", row["id"], reason="repair")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            log.exception("Repairing main database rows failed", extra={"shard": shard})
+        finally:
+            conn.close()
+    if added:
+        bump_generation("stats")
+        log.info("Restored ledger events for completed claims", extra={"events": added})
+    return added
+
+# --- END: Main-database effects of shard writes ---
+
+# --- START: Write generations (cache invalidation) ---
+# Every write bumps the counter for the data it touched. cache_utils.py passes
+# the current counters into its cached readers, so a write makes the next read
+# miss the cache instead of waiting for the TTL to run out.
+#
+# The counters live in the generations table, so writes made by another
+# process (api.py, a second app process, rebuild_stats.py) invalidate this
+# one's caches too. A bump is its own small transaction right after the write
+# commits; readers keep one connection open and re-read the table only when
+# PRAGMA data_version says the database changed, so most lookups cost no I/O.
+
+_generations = {}
+_generation_lock = threading.Lock()
+_generation_conn = None
+_generation_path = None
+_generation_version = None
+
+def _generation_connection():
+    # Caller holds _generation_lock
+    global _generation_conn, _generation_path, _generation_version
+    path = get_db_path()
+    if _generation_conn is None or path != _generation_path:
+        if _generation_conn is not None:
+            _generation_conn.close()
+        _generation_conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        _generation_conn.execute("PRAGMA journal_mode = WAL;")
+        _generation_conn.execute("""
+            CREATE TABLE IF NOT EXISTS generations (
+                domain TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            ) WITHOUT ROWID
+        """)
+        _generation_conn.commit()
+        _generation_path, _generation_version = path, None
+    return _generation_conn
+
+def bump_generation(*domains):
+    """Marks cached reads of the given domains (e.g. "listings", "claims") as stale, in every process."""
+    with _generation_lock:
+        conn = _generation_connection()
+        conn.executemany("""
+            INSERT INTO generations (domain, value) VALUES (?, 1)
+            ON CONFLICT(domain) DO UPDATE SET value = value + 1
+        """, [(domain,) for domain in domains])
+        conn.commit()
+        # data_version does not change for this connection's own commits
+        global _generation_version
+        _generation_version = None
+
+def get_generation(*domains):
+    """Returns the current counters for the given domains, usable as a cache key."""
+    global _generations, _generation_version
+    with _generation_lock:
+        conn = _generation_connection()
+        version = conn.execute("PRAGMA data_version").fetchone()[0]
+        if version != _generation_version:
+            _generations = dict(conn.execute("SELECT domain, value FROM generations"))
+            _generation_version = version
+        return tuple(_generations.get(domain, 0) for domain in domains)
+
+# --- END: Write generations (cache invalidation) ---
+
+# --- START: Analytics rollups ---
+# Hourly counters per geocell, written in the same transaction as the state
+# change they describe. analytics.py reports from this table only, so partner
+# reports never scan listings or claims.
+
+ROLLUP_METRICS = (
+    "listings_created",
+    "listings_expired",
+    "claims_reserved",
+    "meals_rescued",
+    "pickups_completed",
+    "pickup_latency_seconds",
+)
+
+def create_analytics_tables_if_not_exists():
+    """Creates the impact_rollups table."""
+    try:
+        conn = get_conn()
+        cur = conn.cursor()
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS impact_rollups (
+                bucket_hour TEXT NOT NULL,
+                geocell TEXT NOT NULL,
+                metric TEXT NOT NULL,
+                value REAL NOT NULL DEFAULT 0,
+                PRIMARY KEY (bucket_hour, geocell, metric)
+            ) WITHOUT ROWID
+        """)
+        conn.commit()
+        conn.close()
+        log.debug("Analytics tables checked")
+    except Exception:
+        log.exception("Error creating analytics tables")
+
+def record_rollup(cur, metric, lat, lng, value=1, bucket_hour=None):
+    """Adds value to the current hour's counter for metric in the listing's geocell."""
+    try:
+        cur.execute("""
+            INSERT INTO impact_rollups (bucket_hour, geocell, metric, value)
+            VALUES (COALESCE(?, strftime('%Y-%m-%d %H:00:00', 'now')), ?, ?, ?)
+            ON CONFLICT(bucket_hour, geocell, metric) DO UPDATE SET value = value + excluded.value
+        """, (bucket_hour, geocell(lat, lng), metric, value))
+    except sqlite3.OperationalError as e:
+        # Analytics must never block a claim or listing write (e.g. table not created yet)
+        log.warning("Could not record rollup %s: %s", metric, e, extra={"metric": metric})
+
+# --- END: Analytics rollups ---
+
+# --- START: Receiver activity (matching) ---
+# One row per receiver with the location of their latest pickup, kept current
+# by atomic_claim_listing(). matching.py looks receivers up by geocell here to
+# tell them about new listings nearby.
+
+def create_matching_tables_if_not_exists():
+    try:
+        conn = get_conn()
+        cur = conn.cursor()
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS receiver_activity (
+                user_id INTEGER PRIMARY KEY,
+                user_type TEXT,
+                lat REAL NOT NULL,
+                lng REAL NOT NULL,
+                geocell TEXT NOT NULL,
+                last_active_at TEXT NOT NULL,
+                claims INTEGER NOT NULL DEFAULT 0,
+                FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
+            )
+        """)
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_receiver_activity_cell
+            ON receiver_activity(geocell, last_active_at)
+        """)
+        conn.commit()
+        conn.close()
+        log.debug("Matching tables checked")
+    except Exception:
+        log.exception("Error creating matching tables")
+
+def record_receiver_activity(cur, receiver_id, lat, lng):
+    """Moves the receiver to the location of the listing they just claimed."""
+    if lat is None or lng is None:
+        return
+    try:
+        cur.execute("""
+            INSERT INTO receiver_activity (user_id, user_type, lat, lng, geocell, last_active_at, claims)
+            VALUES (?, (SELECT user_type FROM users WHERE id = ?), ?, ?, ?, CURRENT_TIMESTAMP, 1)
+            ON CONFLICT(user_id) DO UPDATE SET
+                user_type = excluded.user_type, lat = excluded.lat, lng = excluded.lng,
+                geocell = excluded.geocell, last_active_at = excluded.last_active_at,
+                claims = claims + 1
+        """, (receiver_id, receiver_id, lat, lng, geocell(lat, lng)))
+    except sqlite3.OperationalError as e:
+        # Like the rollups, matching data must never block a claim
+        log.warning("Could not record receiver activity: %s", e, extra={"receiver_id": receiver_id})
+
+# --- END: Receiver activity (matching) ---
+
+# --- START: Read-only browse path ---
+# Browse pages read through get_read_conn() so they never take the write lock.
+# With `read_snapshot_seconds` set in secrets, reads are served from a copy of
+# the database that a background thread refreshes with the SQLite backup API.
+
+_snapshot_lock = threading.Lock()
+_snapshot_thread = None
+
+def get_snapshot_seconds():
+    """Returns the snapshot refresh interval, or 0 to read the live file."""
+    try:
+        return float(get_setting("read_snapshot_seconds", 0))
+    except (TypeError, ValueError):
+        return 0
+
+def get_snapshot_path():
+    p = Path(get_db_path())
+    return str(p.with_name(f"{p.stem}_snapshot{p.suffix}"))
+
+def refresh_read_snapshot():
+    """Copies the live database into the snapshot file and swaps it in atomically."""
+    snapshot = get_snapshot_path()
+    tmp = snapshot + ".tmp"
+    with _snapshot_lock:
+        src = get_conn()
+        dst = sqlite3.connect(tmp)
+        try:
+            src.backup(dst)
+            # The copy inherits WAL mode; readers open it immutable, so drop back to a plain file
+            dst.execute("PRAGMA journal_mode = DELETE;")
+        finally:
+            dst.close()
+            src.close()
+        os.replace(tmp, snapshot)
+    bump_generation("snapshot")
+    return snapshot
+
+def _snapshot_refresher(interval):
+    while True:
+        time.sleep(interval)
+        try:
+            refresh_read_snapshot()
+        except Exception:
+            log.exception("Error refreshing read snapshot")
+
+def _ensure_snapshot(interval):
+    global _snapshot_thread
+    snapshot = get_snapshot_path()
+    if not Path(snapshot).exists():
+        refresh_read_snapshot()
+    if _snapshot_thread is None:
+        with _snapshot_lock:
+            if _snapshot_thread is None:
+                _snapshot_thread = threading.Thread(
+                    target=_snapshot_refresher, args=(interval,), name="read-snapshot", daemon=True
+                )
+                _snapshot_thread.start()
+    return snapshot
+
+def get_read_conn(allow_snapshot=True, shard=None) -> Connection:
+    """
+    Opens a read-only connection (`mode=ro` + `query_only`) for browse queries.
+    Pass allow_snapshot=False when the caller must see its own recent writes.
+    Shards (see get_conn) are always read live.
+    """
+    if shard not in (None, MAIN_SHARD):
+        return _read_shard_conn(shard)
+    interval = get_snapshot_seconds() if allow_snapshot else 0
+    started = time.perf_counter()
+    try:
+        if interval > 0:
+            uri = Path(_ensure_snapshot(interval)).resolve().as_uri() + "?mode=ro&immutable=1"
+        else:
+            uri = Path(get_db_path()).resolve().as_uri() + "?mode=ro"
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False, factory=_CONNECTION_FACTORY)
+    except sqlite3.OperationalError:
+        # Database file not created yet; fall back to a normal handle
+        conn = sqlite3.connect(get_db_path(), check_same_thread=False, factory=_CONNECTION_FACTORY)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA query_only = ON;")
+    if INSTRUMENT_QUERIES:
+        REGISTRY.observe_acquire((time.perf_counter() - started) * 1000)
+    return conn
+
+def _read_shard_conn(shard):
+    started = time.perf_counter()
+    uri = Path(get_shard_path(shard)).resolve().as_uri() + "?mode=ro"
+    conn = sqlite3.connect(uri, uri=True, check_same_thread=False, factory=_CONNECTION_FACTORY)
+    conn.row_factory = sqlite3.Row
+    conn.execute("ATTACH DATABASE ? AS home", (Path(get_db_path()).resolve().as_uri() + "?mode=ro",))
+    conn.execute("PRAGMA query_only = ON;")
+    if INSTRUMENT_QUERIES:
+        REGISTRY.observe_acquire((time.perf_counter() - started) * 1000)
+    return conn
+
+# --- END: Read-only browse path ---
+
 def create_listing(data: dict):
-    conn = get_conn()
+    # Numeric quantity (quantity_total + quantity_unit) makes the listing claimable in parts;
+    # callers that only pass the free-text quantity get it parsed when it starts with a number
+    total, unit = data.get("quantity_total"), data.get("quantity_unit")
+    if total is None:
+        total, unit = parse_quantity(data.get("quantity"))
+    quantity = data.get("quantity") or (f"{total} {unit}" if total is not None else None)
+    import shards
+    import events
+    shard = shards.shard_for(data.get("lat"), data.get("lng"))
+    now = now_epoch()
+    expiry_ts = to_epoch(data.get("expiry_at"), end_of_day=True)
+    conn = get_conn(shard)
     cur = conn.cursor()
     cur.execute("""
         INSERT INTO listings (
             donor_id, title, notes, food_type, veg, cuisine, prepared_at,
-            packaged_at, expiry_at, quantity, photo_path, visibility, lat, lng, address_text
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            packaged_at, expiry_at, quantity, photo_path, visibility, lat, lng, address_text,
+            quantity_total, quantity_remaining, quantity_unit,
+            created_at, created_ts, prepared_ts, expiry_ts
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
     """, (
         data.get("donor_id"),
         data.get("title"),
@@ -39,21 +442,53 @@ def create_listing(data: dict):
         data.get("prepared_at"),
         data.get("packaged_at"),
         data.get("expiry_at"),
-        data.get("quantity"),
+        quantity,
         data.get("photo_path"),
         data.get("visibility", "everyone"), # <-- Changed "anyone" to "everyone" for consistency
         data.get("lat"),
         data.get("lng"),
         data.get("address_text"),
+        total,
+        total,
+        unit,
+        from_epoch(now),
+        now,
+        to_epoch(data.get("prepared_at")),
+        expiry_ts,
     ))
-    conn.commit()
     lid = cur.lastrowid
+
+    def home_effects(home):
+        record_rollup(home, "listings_created", data.get("lat"), data.get("lng"))
+        shards.record_user(home, data.get("donor_id"), shard)
+    _commit_with_home_effects(conn, {shard}, home_effects)
     conn.close()
+    bump_generation("listings")
+    events.publish("listing.created", lid, status="AVAILABLE", quantity_remaining=total,
+                   visibility=data.get("visibility", "everyone"), expiry_ts=expiry_ts,
+                   food_type=data.get("food_type"), created_ts=now)
+    # Tell nearby receivers in the background; the donor does not wait for it
+    import matching
+    matching.enqueue_listing(lid)
     return lid
 
 # --- MODIFIED for Feature 3 (NGO Mode) ---
-def get_available_listings(user_id):
-    conn = get_conn()
+def get_available_listings(user_id, limit=None, offset=0):
+    """
+    Newest first; limit/offset return one page (the JSON API) instead of everything.
+    With regional shards each shard returns its newest offset + limit and the pages are merged.
+    """
+    import shards
+    shard_names = shards.names()
+    if len(shard_names) > 1:
+        pages = [_available_listings_in_shard(shard, user_id, None if limit is None else offset + limit)
+                 for shard in shard_names]
+        rows = list(heapq.merge(*pages, key=lambda row: row["created_ts"] or 0, reverse=True))
+        return rows[offset:] if limit is None else rows[offset:offset + limit]
+    return _available_listings_in_shard(MAIN_SHARD, user_id, limit, offset)
+
+def _available_listings_in_shard(shard, user_id, limit=None, offset=0):
+    conn = get_read_conn(shard=shard)
     cur = conn.cursor()
     
     # Get the current user's type
@@ -63,7 +498,7 @@ def get_available_listings(user_id):
     user_type = user_row['user_type'] if user_row else "Individual"
     
     # Build the dynamic query
-    query = "SELECT * FROM listings WHERE status = 'AVAILABLE'"
+    query = f"SELECT {Listing.columns()} FROM listings WHERE status = 'AVAILABLE'"
     
     if user_type == "NGO":
         # NGOs see both 'everyone' and 'ngo_only' listings
@@ -72,198 +507,557 @@ def get_available_listings(user_id):
         # All other users see only 'everyone' listings
         query += " AND visibility = 'everyone'"
         
-    query += " ORDER BY created_at DESC"
+    query += " ORDER BY created_ts DESC"
+    params = ()
+    if limit is not None:
+        query += " LIMIT ? OFFSET ?"
+        params = (limit, offset)
     
-    cur.execute(query)
-    rows = cur.fetchall()
+    cur.execute(query, params)
+    rows = Listing.fetchall(cur)
     conn.close()
     return rows
 # --- END MODIFICATION ---
 
 def expire_old_listings(now_iso, expiry_threshold_days=2):
+    import shards
+    import events
+    expiring = []
+    for shard in shards.names():
+        expiring.extend(_expire_shard_listings(shard, now_iso))
+    if expiring:
+        bump_generation("listings")
+        for row in expiring:
+            events.publish("listing.removed", row["id"], status="EXPIRED", quantity_remaining=None,
+                           visibility=row["visibility"])
+
+def _expire_shard_listings(shard, now_iso):
     # basic example: if expiry_at passed or created more than threshold
-    conn = get_conn()
+    conn = get_conn(shard)
     cur = conn.cursor()
-    cur.execute("UPDATE listings SET status='EXPIRED' WHERE status='AVAILABLE' AND expiry_at IS NOT NULL AND expiry_at < ?", (now_iso,))
+    # expiry_ts already holds the end of a bare expiry date
+    due = "status='AVAILABLE' AND expiry_ts <= :now"
+    params = {"now": to_epoch(now_iso)}
+    # Cheap read first: most reruns find nothing to expire and never take the write lock
+    cur.execute(f"SELECT 1 FROM listings WHERE {due} LIMIT 1", params)
+    if cur.fetchone() is None:
+        conn.close()
+        return []
+    cur.execute("BEGIN IMMEDIATE;")
+    # Read the locations under the lock so the waste rollup can be bucketed by area
+    cur.execute(f"SELECT id, lat, lng, visibility FROM listings WHERE {due}", params)
+    expiring = cur.fetchall()
+    cur.execute(f"UPDATE listings SET status='EXPIRED' WHERE {due}", params)
+
+    def home_effects(home):
+        for row in expiring:
+            record_rollup(home, "listings_expired", row["lat"], row["lng"])
     # optional: auto-expire old ones based on created_at age
-    conn.commit()
+    _commit_with_home_effects(conn, {shard}, home_effects)
     conn.close()
+    return expiring
 
-def atomic_claim_listing(listing_id: int, receiver_id: int, ttl_minutes=60):
+# --- START: Portion-based claims ---
+# Listings with a numeric quantity (quantity_total / quantity_remaining /
+# quantity_unit) can be claimed in parts by several receivers. Each claim takes
+# its portions with one conditional UPDATE that only matches while enough are
+# left, so concurrent claimers can never take more than the listing holds. The
+# listing turns RESERVED when the last portion goes. Listings whose quantity is
+# free text (quantity_remaining NULL) are still claimed whole.
+
+QUANTITY_UNITS = ("portions", "meals", "packs", "boxes", "kg", "litres")
+
+# Claim transactions from this process queue here instead of in SQLite's busy
+# handler, whose sleep-and-retry backoff lets a burst of claimers starve
+# until the busy timeout. Other processes are still kept out by SQLite's lock.
+_claim_lock = threading.Lock()
+_QUANTITY_RE = re.compile(r"^\s*(\d+)\s*([^\d\s].*)?$")
+
+def parse_quantity(text):
+    """(amount, unit) from free text like "20 portions"; (None, None) if it doesn't start with a whole number."""
+    match = _QUANTITY_RE.match(text or "")
+    if not match or int(match.group(1)) < 1:
+        return None, None
+    return int(match.group(1)), (match.group(2) or "portions").strip()
+
+def _take_portions(cur, listing_id, portions=None, schema="main"):
+    """
+    Takes `portions` from an AVAILABLE listing inside the caller's transaction,
+    or everything left when portions is None. Returns the amount taken (None for
+    a listing claimed whole) and whether the UPDATE matched. schema names the
+    attached database holding the listing (see shards.attach()).
+    """
+    if portions is None:
+        cur.execute(f"SELECT quantity_remaining FROM {schema}.listings WHERE id = ?", (listing_id,))
+        row = cur.fetchone()
+        portions = row["quantity_remaining"] if row else None
+        if portions is None:
+            cur.execute(f"""
+                UPDATE {schema}.listings SET status='RESERVED'
+                WHERE id=? AND status='AVAILABLE' AND quantity_remaining IS NULL
+            """, (listing_id,))
+            return None, cur.rowcount == 1
+    if portions < 1:
+        return portions, False
+    # SET expressions see the old row, so the CASE tests what was left before this claim
+    cur.execute(f"""
+        UPDATE {schema}.listings
+        SET quantity_remaining = quantity_remaining - :n,
+            status = CASE WHEN quantity_remaining = :n THEN 'RESERVED' ELSE status END
+        WHERE id = :id AND status = 'AVAILABLE' AND quantity_remaining >= :n
+    """, {"id": listing_id, "n": portions})
+    return portions, cur.rowcount == 1
+
+# --- END: Portion-based claims ---
+
+def atomic_claim_listing(listing_id: int, receiver_id: int, ttl_minutes=60, portions=None):
     """
     Attempt to reserve a listing atomically. Returns claim_id on success, None on failure.
+    For listings with a numeric quantity, `portions` is how many to take (default: all left).
     """
-    conn = get_conn()
+    import shards
+    import events
+    shard = shards.shard_of_id(listing_id)
+    conn = get_conn(shard)
     cur = conn.cursor()
+    _claim_lock.acquire()
     try:
-        cur.execute("BEGIN;")
-        cur.execute("UPDATE listings SET status='RESERVED' WHERE id=? AND status='AVAILABLE';", (listing_id,))
-        if cur.rowcount == 0:
+        cur.execute("BEGIN IMMEDIATE;")
+        taken, ok = _take_portions(cur, listing_id, portions)
+        if not ok:
             conn.rollback()
             return None
-        import datetime
-        now = datetime.datetime.utcnow()
-        expires_at = (now + datetime.timedelta(minutes=ttl_minutes)).isoformat()
+        now = now_epoch()
+        expires = now + ttl_minutes * 60
         
         # --- MODIFIED FOR FEATURE 1 ---
         # Added status column to the INSERT
         cur.execute("""
-            INSERT INTO claims (listing_id, receiver_id, expires_at, status) 
-            VALUES (?, ?, ?, 'RESERVED');
-        """, (listing_id, receiver_id, expires_at))
+            INSERT INTO claims (listing_id, receiver_id, reserved_at, reserved_ts, expires_at, expires_ts, status, quantity) 
+            VALUES (?, ?, ?, ?, ?, ?, 'RESERVED', ?);
+        """, (listing_id, receiver_id, from_epoch(now), now, from_epoch(expires), expires, taken))
         # --- END MODIFICATION ---
         
         claim_id = cur.lastrowid
-        conn.commit()
+        cur.execute("SELECT lat, lng, status, quantity_remaining, visibility FROM listings WHERE id = ?", (listing_id,))
+        loc = cur.fetchone()
+
+        def home_effects(home):
+            record_rollup(home, "claims_reserved", loc["lat"], loc["lng"])
+            record_receiver_activity(home, receiver_id, loc["lat"], loc["lng"])
+            shards.record_user(home, receiver_id, shard)
+        _commit_with_home_effects(conn, {shard}, home_effects)
+        bump_generation("listings", "claims")
+        events.publish("listing.updated" if loc["status"] == "AVAILABLE" else "listing.removed", listing_id,
+                       status=loc["status"], quantity_remaining=loc["quantity_remaining"], visibility=loc["visibility"])
+        log.debug("Claim reserved", extra={"listing_id": listing_id, "claim_id": claim_id, "portions": taken})
         return claim_id
-    except Exception as e:
+    except Exception:
+        conn.rollback()
+        log.exception("Claim failed", extra={"listing_id": listing_id, "receiver_id": receiver_id})
+        return None
+    finally:
+        _claim_lock.release()
+        conn.close()
+
+CLAIM_MODES = ("all_or_nothing", "best_effort")
+
+def batch_claim_listings(listing_ids, receiver_id, mode="all_or_nothing", ttl_minutes=60):
+    """
+    Reserves several listings for one receiver in a single transaction.
+
+    mode="all_or_nothing" commits only if every listing could be reserved;
+    mode="best_effort" keeps whatever succeeded. Returns one outcome dict per
+    distinct listing id, in the order given: listing_id, status ("reserved",
+    "unavailable", "not_found" or "rolled_back"), claim_id, donor_id, title,
+    and quantity (portions taken; listings with a numeric quantity are taken
+    whole, i.e. everything left). Returns None if the transaction itself failed.
+    """
+    if mode not in CLAIM_MODES:
+        raise ValueError(f"mode must be one of {CLAIM_MODES}")
+    listing_ids = list(dict.fromkeys(int(lid) for lid in listing_ids))
+    if not listing_ids:
+        return []
+    now = now_epoch()
+    expires = now + ttl_minutes * 60
+
+    import shards
+    import events
+    shard_of = {lid: shards.shard_of_id(lid) for lid in listing_ids}
+    # Every shard involved is attached to one connection, so the batch is judged and rolled back
+    # as one transaction. In WAL mode the commit itself is per file: a crash while it runs can
+    # leave the batch in some shard files and not others.
+    primary = MAIN_SHARD if MAIN_SHARD in shard_of.values() else shard_of[listing_ids[0]]
+    conn = get_conn(primary)
+    cur = conn.cursor()
+    _claim_lock.acquire()
+    try:
+        schemas = shards.attach(conn, primary, set(shard_of.values()))
+        # Take the write lock up front so the whole set is judged against one state
+        cur.execute("BEGIN IMMEDIATE;")
+        info = {}
+        for shard in set(shard_of.values()):
+            ids = [lid for lid in listing_ids if shard_of[lid] == shard]
+            cur.execute(f"""
+                SELECT id, donor_id, title, lat, lng, quantity_unit, visibility FROM {schemas[shard]}.listings
+                WHERE id IN ({",".join("?" * len(ids))})
+            """, ids)
+            info.update((row["id"], row) for row in cur.fetchall())
+
+        outcomes = []
+        for lid in listing_ids:
+            row = info.get(lid)
+            outcome = {"listing_id": lid, "status": "not_found", "claim_id": None, "quantity": None,
+                       "donor_id": row["donor_id"] if row else None, "title": row["title"] if row else None,
+                       "unit": row["quantity_unit"] if row else None}
+            outcomes.append(outcome)
+            if row is None:
+                continue
+            schema = schemas[shard_of[lid]]
+            taken, ok = _take_portions(cur, lid, schema=schema)
+            if not ok:
+                outcome["status"] = "unavailable"
+                continue
+            cur.execute(f"""
+                INSERT INTO {schema}.claims (listing_id, receiver_id, reserved_at, reserved_ts, expires_at, expires_ts,
+                                             status, quantity)
+                VALUES (?, ?, ?, ?, ?, ?, 'RESERVED', ?);
+            """, (lid, receiver_id, from_epoch(now), now, from_epoch(expires), expires, taken))
+            outcome["status"], outcome["claim_id"], outcome["quantity"] = "reserved", cur.lastrowid, taken
+
+        failed = any(o["status"] != "reserved" for o in outcomes)
+        if mode == "all_or_nothing" and failed:
+            conn.rollback()
+            for o in outcomes:
+                if o["status"] == "reserved":
+                    o["status"], o["claim_id"], o["quantity"] = "rolled_back", None, None
+            log.info("Batch claim rolled back", extra={"receiver_id": receiver_id, "listings": len(listing_ids)})
+            return outcomes
+
+        reserved = [o for o in outcomes if o["status"] == "reserved"]
+
+        def home_effects(home):
+            for o in reserved:
+                row = info[o["listing_id"]]
+                record_rollup(home, "claims_reserved", row["lat"], row["lng"])
+                record_receiver_activity(home, receiver_id, row["lat"], row["lng"])
+                shards.record_user(home, receiver_id, shard_of[o["listing_id"]])
+        _commit_with_home_effects(conn, {shard_of[o["listing_id"]] for o in reserved}, home_effects)
+        if reserved:
+            bump_generation("listings", "claims")
+        # Batch claims take everything that was left, so each reserved listing is gone
+        for o in outcomes:
+            if o["status"] == "reserved":
+                events.publish("listing.removed", o["listing_id"], status="RESERVED",
+                               quantity_remaining=0 if o["quantity"] else None,
+                               visibility=info[o["listing_id"]]["visibility"])
+        log.info("Batch claim", extra={
+            "receiver_id": receiver_id, "mode": mode, "listings": len(listing_ids),
+            "reserved": sum(o["status"] == "reserved" for o in outcomes),
+        })
+        return outcomes
+    except Exception:
         conn.rollback()
-        print("claim error:", e)
+        log.exception("Batch claim failed", extra={"receiver_id": receiver_id, "listings": len(listing_ids)})
         return None
     finally:
+        _claim_lock.release()
         conn.close()
 
 def get_listing_by_id(lid):
-    conn = get_conn()
+    import shards
+    conn = get_conn(shards.shard_of_id(lid))
     cur = conn.cursor()
-    cur.execute("SELECT * FROM listings WHERE id = ?", (lid,))
-    row = cur.fetchone()
+    cur.execute(f"SELECT {Listing.columns()} FROM listings WHERE id = ?", (lid,))
+    row = Listing.fetchone(cur)
     conn.close()
     return row
 
+def _read_user_shards(user_id, sql, params, newest_first_by, allow_snapshot=True, limit=None, model=None):
+    """
+    Runs a per-user query in each shard the user has rows in (shards.user_shards)
+    and merges the results, which every shard returns newest first. Rows come
+    back as `model` records (models.py) if one is given.
+    """
+    import shards
+    pages = []
+    for shard in shards.user_shards(user_id):
+        conn = get_read_conn(allow_snapshot, shard=shard)
+        cur = conn.execute(sql, params)
+        pages.append(model.fetchall(cur) if model else cur.fetchall())
+        conn.close()
+    if len(pages) == 1:
+        return pages[0]
+    rows = list(heapq.merge(*pages, key=lambda row: row[newest_first_by] or 0, reverse=True))
+    return rows if limit is None else rows[:limit]
+
+def get_donor_listings(donor_id):
+    """Gets a donor's listings with any claim and receiver name attached (My Listings page)."""
+    return _read_user_shards(donor_id, f"""
+        SELECT 
+            {Listing.columns('l')}, 
+            c.id as claim_id,
+            c.receiver_id,
+            c.status as claim_status,
+            c.quantity as claim_quantity,
+            u.name as receiver_name
+        FROM listings l
+        LEFT JOIN claims c ON l.id = c.listing_id
+        LEFT JOIN users u ON c.receiver_id = u.id
+        WHERE l.donor_id = ? 
+        ORDER BY l.created_ts DESC
+    """, (donor_id,), "created_ts", allow_snapshot=False, model=Listing)
+
+def get_receiver_claims(receiver_id):
+    """Gets a receiver's claims with listing details and donor name (My Claims page)."""
+    return _read_user_shards(receiver_id, f"""
+        SELECT 
+            {Claim.columns('claims')}, 
+            claims.status as claim_status,
+            listings.title, 
+            listings.address_text, 
+            listings.lat, 
+            listings.lng,
+            listings.donor_id,
+            listings.expiry_at,
+            listings.food_type,
+            listings.quantity_unit,
+            listings.created_at as listing_created_at,
+            users.name as donor_name
+        FROM claims 
+        JOIN listings ON claims.listing_id = listings.id
+        JOIN users ON listings.donor_id = users.id
+        WHERE claims.receiver_id=? ORDER BY claims.reserved_ts DESC
+    """, (receiver_id,), "reserved_ts", allow_snapshot=False, model=Claim)
+
+def get_receiver_claim_history(receiver_id, limit=200):
+    """Location, veg flag, cuisine and donor of a receiver's most recent claims (for ranking)."""
+    return _read_user_shards(receiver_id, """
+        SELECT listings.lat, listings.lng, listings.veg, listings.cuisine, listings.donor_id,
+               claims.reserved_at, claims.reserved_ts
+        FROM claims
+        JOIN listings ON claims.listing_id = listings.id
+        WHERE claims.receiver_id = ?
+        ORDER BY claims.reserved_ts DESC
+        LIMIT ?
+    """, (receiver_id, limit), "reserved_ts", limit=limit)
+
 # Notification functions
-# db.py - Replace the entire notification section with this:
+# Names of the related user and listing are copied onto the row when it is
+# written, so reading the inbox needs no joins. The schema (is_read, the copied
+# columns, the indexes) is ensured once at startup by migrate_notifications_table().
+
+NOTIFICATION_COLUMNS = """
+    id, user_id, type, title, message, related_listing_id, related_user_id,
+    related_user_name, listing_title, COALESCE(is_read, 0) AS is_read, created_at
+"""
+
+def migrate_notifications_table():
+    """Adds is_read and the copied name columns if missing, plus the inbox indexes."""
+    try:
+        conn = get_conn()
+        cur = conn.cursor()
+        cur.execute("PRAGMA table_info(notifications)")
+        columns = {col[1] for col in cur.fetchall()}
+        if 'is_read' not in columns:
+            cur.execute("ALTER TABLE notifications ADD COLUMN is_read INTEGER DEFAULT 0")
+            log.info("Added is_read column to notifications table")
+        added = False
+        for column in ("related_user_name", "listing_title"):
+            if column not in columns:
+                cur.execute(f"ALTER TABLE notifications ADD COLUMN {column} TEXT")
+                added = True
+        # Newest-first page per user, and a small covering index for the unread count
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_notifications_user_created ON notifications(user_id, created_at)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_notifications_unread ON notifications(user_id, is_read)")
+        conn.commit()
+        conn.close()
+        if added:
+            log.info("Added related_user_name/listing_title columns to notifications table")
+            backfill_notification_titles()
+        log.debug("Notifications table checked")
+    except Exception:
+        log.exception("Error migrating notifications table")
+
+def backfill_notification_titles():
+    """Fills the copied user name and listing title on rows written before they existed."""
+    import shards
+    conn = shards.connect_all()
+    cur = conn.cursor()
+    cur.execute("""
+        UPDATE notifications
+        SET related_user_name = (SELECT name FROM users WHERE id = notifications.related_user_id)
+        WHERE related_user_name IS NULL AND related_user_id IS NOT NULL
+    """)
+    users = cur.rowcount
+    cur.execute("""
+        UPDATE notifications
+        SET listing_title = (SELECT title FROM all_listings WHERE id = notifications.related_listing_id)
+        WHERE listing_title IS NULL AND related_listing_id IS NOT NULL
+    """)
+    listings = cur.rowcount
+    conn.commit()
+    conn.close()
+    bump_generation("notifications")
+    return users + listings
+
+def _in_shard(record_id, table="listings"):
+    """
+    Whether a listing/claim lives in a regional shard file. Rows in the main
+    database that point at it (notifications, reviews) are written with foreign
+    keys off: SQLite cannot check a reference into another file.
+    """
+    import shards
+    return record_id is not None and shards.shard_of_id(record_id, table) != MAIN_SHARD
+
+def _shard_listing_title(listing_id):
+    """Title of a listing kept in a regional shard, which the INSERTs' subquery cannot see; else None."""
+    if not _in_shard(listing_id):
+        return None
+    row = get_listing_by_id(listing_id)
+    return row["title"] if row else None
 
-# Notification functions - COMPLETELY REWRITTEN
 def create_notification(user_id, type, title, message, related_listing_id=None, related_user_id=None):
     try:
+        listing_title = _shard_listing_title(related_listing_id)
         conn = get_conn()
+        if _in_shard(related_listing_id):
+            conn.execute("PRAGMA foreign_keys = OFF;")
         cur = conn.cursor()
         
-        print(f"🔔 Creating notification for user {user_id}: {title}")
+        log.debug("Creating notification", extra={"user_id": user_id, "type": type})
         
-        # First, ensure the notifications table has the correct structure
-        try:
-            # Check if is_read column exists, if not add it
-            cur.execute("PRAGMA table_info(notifications)")
-            columns = [col[1] for col in cur.fetchall()]
-            if 'is_read' not in columns:
-                cur.execute("ALTER TABLE notifications ADD COLUMN is_read INTEGER DEFAULT 0")
-                print("✅ Added missing is_read column to notifications table")
-        except Exception as alter_error:
-            print(f"⚠️ Could not alter table: {alter_error}")
-        
-        # Insert the notification
+        # Insert the notification, copying the related names in the same statement
         cur.execute("""
-            INSERT INTO notifications (user_id, type, title, message, related_listing_id, related_user_id, is_read)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        """, (user_id, type, title, message, related_listing_id, related_user_id, 0))
+            INSERT INTO notifications (user_id, type, title, message, related_listing_id, related_user_id,
+                                       related_user_name, listing_title, is_read)
+            VALUES (?, ?, ?, ?, ?, ?,
+                    (SELECT name FROM users WHERE id = ?),
+                    COALESCE(?, (SELECT title FROM listings WHERE id = ?)), 0)
+        """, (user_id, type, title, message, related_listing_id, related_user_id, related_user_id,
+              listing_title, related_listing_id))
         
         conn.commit()
         notification_id = cur.lastrowid
         conn.close()
+        bump_generation("notifications")
         
-        print(f"✅ Notification created successfully: ID {notification_id}")
+        log.info("Notification created", extra={"notification_id": notification_id, "user_id": user_id, "type": type})
         return notification_id
         
-    except Exception as e:
-        print(f"❌ Error creating notification: {e}")
+    except Exception:
+        log.exception("Error creating notification", extra={"user_id": user_id})
         if 'conn' in locals():
             conn.rollback()
             conn.close()
         return None
 
-def get_user_notifications(user_id, limit=20):
+def create_notifications_batch(notifications):
+    """
+    Inserts many notifications in one transaction (one generation bump).
+    Each item is a dict with the create_notification() arguments. Returns the count.
+    """
+    if not notifications:
+        return 0
     try:
+        titles = {lid: _shard_listing_title(lid) for lid in {n.get("related_listing_id") for n in notifications}}
         conn = get_conn()
+        if any(_in_shard(lid) for lid in titles):
+            conn.execute("PRAGMA foreign_keys = OFF;")
+        cur = conn.cursor()
+        cur.executemany("""
+            INSERT INTO notifications (user_id, type, title, message, related_listing_id, related_user_id,
+                                       related_user_name, listing_title, is_read)
+            VALUES (:user_id, :type, :title, :message, :related_listing_id, :related_user_id,
+                    (SELECT name FROM users WHERE id = :related_user_id),
+                    COALESCE(:listing_title, (SELECT title FROM listings WHERE id = :related_listing_id)), 0)
+        """, [{"related_listing_id": None, "related_user_id": None, **n,
+               "listing_title": titles[n.get("related_listing_id")]} for n in notifications])
+        conn.commit()
+        conn.close()
+        bump_generation("notifications")
+        log.info("Notifications created", extra={"count": len(notifications), "type": notifications[0]["type"]})
+        return len(notifications)
+    except Exception:
+        log.exception("Error creating notification batch", extra={"count": len(notifications)})
+        if 'conn' in locals():
+            conn.rollback()
+            conn.close()
+        return 0
+
+def get_notification_inbox(user_id, limit=20):
+    """
+    One round trip for the inbox: the newest `limit` notifications plus the
+    unread count, as {"notifications": [Notification, ...], "unread_count": int}.
+    """
+    try:
+        # Live read-only handle: a user expects to see a notification right after it is sent
+        conn = get_read_conn(allow_snapshot=False)
         cur = conn.cursor()
         
-        # First ensure the table has the correct structure
-        try:
-            cur.execute("PRAGMA table_info(notifications)")
-            columns = [col[1] for col in cur.fetchall()]
-            if 'is_read' not in columns:
-                cur.execute("ALTER TABLE notifications ADD COLUMN is_read INTEGER DEFAULT 0")
-                conn.commit()
-                print("✅ Added missing is_read column in get_user_notifications")
-        except:
-            pass
-        
-        # Now query the notifications
-        cur.execute("""
-            SELECT n.*, 
-                   u.name as related_user_name, 
-                   l.title as listing_title,
-                   COALESCE(n.is_read, 0) as is_read
-            FROM notifications n
-            LEFT JOIN users u ON n.related_user_id = u.id
-            LEFT JOIN listings l ON n.related_listing_id = l.id
-            WHERE n.user_id = ?
-            ORDER BY n.created_at DESC
+        # The uncorrelated subquery runs once and is answered from idx_notifications_unread
+        cur.execute(f"""
+            SELECT {NOTIFICATION_COLUMNS},
+                   (SELECT COUNT(*) FROM notifications WHERE user_id = ? AND is_read = 0) AS unread_count
+            FROM notifications
+            WHERE user_id = ?
+            ORDER BY created_at DESC, id DESC
             LIMIT ?
-        """, (user_id, limit))
+        """, (user_id, user_id, limit))
         
         rows = cur.fetchall()
+        names = [d[0] for d in cur.description]
         conn.close()
         
-        print(f"📨 Retrieved {len(rows)} notifications for user {user_id}")
-        return rows
+        # No rows means no notifications at all, so nothing unread either
+        unread_count = rows[0]["unread_count"] if rows else 0
+        rows = Notification.from_rows(rows, names)
+        log.debug("Retrieved notification inbox", extra={"user_id": user_id, "rows": len(rows), "unread": unread_count})
+        return {"notifications": rows, "unread_count": unread_count}
         
-    except Exception as e:
-        print(f"❌ Error getting notifications: {e}")
-        return []
+    except Exception:
+        log.exception("Error getting notification inbox", extra={"user_id": user_id})
+        return {"notifications": [], "unread_count": 0}
 
-def mark_notification_as_read(notification_id):
+def get_user_notifications(user_id, limit=20):
+    return get_notification_inbox(user_id, limit)["notifications"]
+
+def mark_notification_as_read(notification_id, user_id=None):
+    """Marks one notification read; with user_id, only if it belongs to that user (False otherwise)."""
     try:
         conn = get_conn()
         cur = conn.cursor()
         
-        # Ensure is_read column exists
-        try:
-            cur.execute("PRAGMA table_info(notifications)")
-            columns = [col[1] for col in cur.fetchall()]
-            if 'is_read' not in columns:
-                cur.execute("ALTER TABLE notifications ADD COLUMN is_read INTEGER DEFAULT 0")
-                conn.commit()
-        except:
-            pass
-        
-        cur.execute("UPDATE notifications SET is_read = 1 WHERE id = ?", (notification_id,))
+        if user_id is None:
+            cur.execute("UPDATE notifications SET is_read = 1 WHERE id = ?", (notification_id,))
+        else:
+            cur.execute("UPDATE notifications SET is_read = 1 WHERE id = ? AND user_id = ?", (notification_id, user_id))
+        updated = cur.rowcount
         conn.commit()
         conn.close()
+        bump_generation("notifications")
         
-        print(f"✅ Marked notification {notification_id} as read")
-        return True
+        log.debug("Marked notification as read", extra={"notification_id": notification_id})
+        return user_id is None or updated > 0
         
-    except Exception as e:
-        print(f"❌ Error marking notification as read: {e}")
+    except Exception:
+        log.exception("Error marking notification as read", extra={"notification_id": notification_id})
         return False
 
 def get_unread_notification_count(user_id):
     try:
-        conn = get_conn()
+        conn = get_read_conn(allow_snapshot=False)
         cur = conn.cursor()
         
-        # Ensure is_read column exists
-        try:
-            cur.execute("PRAGMA table_info(notifications)")
-            columns = [col[1] for col in cur.fetchall()]
-            if 'is_read' not in columns:
-                cur.execute("ALTER TABLE notifications ADD COLUMN is_read INTEGER DEFAULT 0")
-                conn.commit()
-                return 0  # No unread notifications if column was just added
-        except:
-            pass
-        
         cur.execute("SELECT COUNT(*) FROM notifications WHERE user_id = ? AND is_read = 0", (user_id,))
         count = cur.fetchone()[0]
         conn.close()
         
-        print(f"🔢 User {user_id} has {count} unread notifications")
+        log.debug("Unread notification count", extra={"user_id": user_id, "count": count})
         return count
         
-    except Exception as e:
-        print(f"❌ Error getting unread notification count: {e}")
+    except Exception:
+        log.exception("Error getting unread notification count", extra={"user_id": user_id})
         return 0
 
 def clear_all_notifications(user_id):
@@ -273,35 +1067,25 @@ def clear_all_notifications(user_id):
         cur.execute("DELETE FROM notifications WHERE user_id = ?", (user_id,))
         conn.commit()
         conn.close()
-        print(f"✅ Cleared all notifications for user {user_id}")
+        bump_generation("notifications")
+        log.info("Cleared all notifications", extra={"user_id": user_id})
         return True
-    except Exception as e:
-        print(f"❌ Error clearing all notifications: {e}")
+    except Exception:
+        log.exception("Error clearing all notifications", extra={"user_id": user_id})
         return False
 
 def clear_read_notifications(user_id):
     try:
         conn = get_conn()
         cur = conn.cursor()
-        
-        # Ensure is_read column exists
-        try:
-            cur.execute("PRAGMA table_info(notifications)")
-            columns = [col[1] for col in cur.fetchall()]
-            if 'is_read' not in columns:
-                cur.execute("ALTER TABLE notifications ADD COLUMN is_read INTEGER DEFAULT 0")
-                conn.commit()
-                return True  # No read notifications to clear if column was just added
-        except:
-            pass
-        
         cur.execute("DELETE FROM notifications WHERE user_id = ? AND is_read = 1", (user_id,))
         conn.commit()
         conn.close()
-        print(f"✅ Cleared read notifications for user {user_id}")
+        bump_generation("notifications")
+        log.info("Cleared read notifications", extra={"user_id": user_id})
         return True
-    except Exception as e:
-        print(f"❌ Error clearing read notifications: {e}")
+    except Exception:
+        log.exception("Error clearing read notifications", extra={"user_id": user_id})
         return False
 
 # Emergency function to recreate notifications table if needed
@@ -324,6 +1108,8 @@ def recreate_notifications_table():
                 message TEXT NOT NULL,
                 related_listing_id INTEGER,
                 related_user_id INTEGER,
+                related_user_name TEXT,
+                listing_title TEXT,
                 is_read INTEGER DEFAULT 0,
                 created_at TEXT DEFAULT CURRENT_TIMESTAMP,
                 FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE,
@@ -334,37 +1120,35 @@ def recreate_notifications_table():
         
         conn.commit()
         conn.close()
-        print("✅ Notifications table recreated successfully!")
+        migrate_notifications_table()  # indexes went with the old table
+        bump_generation("notifications")
+        log.warning("Notifications table recreated")
         return True
         
-    except Exception as e:
-        print(f"❌ Error recreating notifications table: {e}")
+    except Exception:
+        log.exception("Error recreating notifications table")
         return False
 
 # Debug function to check database state
 def debug_notifications():
-    """Debug function to check notifications table state"""
+    """Debug function to check notifications table state (only runs with DEBUG logging)"""
+    if not log.isEnabledFor(logging.DEBUG):
+        return
     try:
         conn = get_conn()
         cur = conn.cursor()
         
         # Check notifications table structure
         cur.execute("PRAGMA table_info(notifications)")
-        columns = cur.fetchall()
-        print("Notifications table columns:")
-        for col in columns:
-            print(f"  {col[1]} ({col[2]})")
-        
-        # Check all notifications
-        cur.execute("SELECT * FROM notifications")
-        all_notifications = cur.fetchall()
-        print(f"Total notifications in database: {len(all_notifications)}")
-        for notif in all_notifications:
-            print(f"  ID: {notif['id']}, User: {notif['user_id']}, Title: {notif['title']}")
+        columns = [f"{col[1]} ({col[2]})" for col in cur.fetchall()]
         
+        # One summary record instead of a line per notification
+        cur.execute("SELECT COUNT(*) FROM notifications")
+        total = cur.fetchone()[0]
         conn.close()
-    except Exception as e:
-        print(f"Debug error: {e}")
+        log.debug("Notifications table state", extra={"columns": columns, "total": total})
+    except Exception:
+        log.exception("Debug error")
 
 
 # --- START: Added for Feature 2 (Ratings) ---
@@ -391,16 +1175,18 @@ def create_reviews_table_if_not_exists():
         """)
         conn.commit()
         conn.close()
-        print("✅ Reviews table checked/created successfully.")
+        log.debug("Reviews table checked")
         return True
-    except Exception as e:
-        print(f"❌ Error creating reviews table: {e}")
+    except Exception:
+        log.exception("Error creating reviews table")
         return False
 
 def create_review(claim_id, reviewer_id, reviewee_id, rating, comment):
     """Inserts a new review into the database."""
     try:
         conn = get_conn()
+        if _in_shard(claim_id, "claims"):
+            conn.execute("PRAGMA foreign_keys = OFF;")
         cur = conn.cursor()
         cur.execute("""
             INSERT INTO reviews (claim_id, reviewer_id, reviewee_id, rating, comment)
@@ -409,38 +1195,39 @@ def create_review(claim_id, reviewer_id, reviewee_id, rating, comment):
         conn.commit()
         review_id = cur.lastrowid
         conn.close()
+        bump_generation("reviews")
         return review_id
     except sqlite3.IntegrityError:
         # This will happen if they try to review twice (due to the UNIQUE constraint)
         return None
-    except Exception as e:
-        print(f"❌ Error creating review: {e}")
+    except Exception:
+        log.exception("Error creating review", extra={"claim_id": claim_id, "reviewer_id": reviewer_id})
         return None
 
 def get_reviews_for_user(user_id):
     """Gets all reviews *about* a specific user."""
     try:
-        conn = get_conn()
+        conn = get_read_conn()
         cur = conn.cursor()
         # Join with users to get the reviewer's name
-        cur.execute("""
-            SELECT r.*, u.name as reviewer_name
+        cur.execute(f"""
+            SELECT {Review.columns('r')}, u.name as reviewer_name
             FROM reviews r
             JOIN users u ON r.reviewer_id = u.id
             WHERE r.reviewee_id = ?
             ORDER BY r.created_at DESC
         """, (user_id,))
-        rows = cur.fetchall()
+        rows = Review.fetchall(cur)
         conn.close()
         return rows
-    except Exception as e:
-        print(f"❌ Error getting reviews: {e}")
+    except Exception:
+        log.exception("Error getting reviews", extra={"user_id": user_id})
         return []
 
 def check_review_exists(claim_id, reviewer_id):
     """Checks if a user has already reviewed a specific claim."""
     try:
-        conn = get_conn()
+        conn = get_read_conn(allow_snapshot=False)
         cur = conn.cursor()
         cur.execute("""
             SELECT 1 FROM reviews
@@ -449,8 +1236,8 @@ def check_review_exists(claim_id, reviewer_id):
         row = cur.fetchone()
         conn.close()
         return row is not None
-    except Exception as e:
-        print(f"❌ Error checking review: {e}")
+    except Exception:
+        log.exception("Error checking review", extra={"claim_id": claim_id, "reviewer_id": reviewer_id})
         return False
 
 # --- END: Added for Feature 2 (Ratings) ---
@@ -459,7 +1246,7 @@ def check_review_exists(claim_id, reviewer_id):
 # --- START: Added for Feature 1 (Gamification) ---
 
 def alter_claims_table_if_needed():
-    """Adds the status column to the claims table if it doesn't exist."""
+    """Adds the status and quantity columns to the claims table if they don't exist."""
     try:
         conn = get_conn()
         cur = conn.cursor()
@@ -469,11 +1256,17 @@ def alter_claims_table_if_needed():
         if 'status' not in columns:
             cur.execute("ALTER TABLE claims ADD COLUMN status TEXT DEFAULT 'RESERVED'")
             conn.commit()
-            print("✅ Added 'status' column to 'claims' table.")
+            log.info("Added status column to claims table")
+
+        # Portions taken by the claim; NULL for listings claimed whole
+        if 'quantity' not in columns:
+            cur.execute("ALTER TABLE claims ADD COLUMN quantity INTEGER")
+            conn.commit()
+            log.info("Added quantity column to claims table")
         
         conn.close()
-    except Exception as e:
-        print(f"❌ Error altering 'claims' table: {e}")
+    except Exception:
+        log.exception("Error altering claims table")
 
 def create_gamification_tables_if_not_exists():
     """Creates the user_stats, badges, and user_badges tables."""
@@ -517,6 +1310,23 @@ def create_gamification_tables_if_not_exists():
         )
         """)
         
+        # Impact Ledger (append-only; user_stats is derived from it)
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS impact_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            claim_id INTEGER,
+            event_type TEXT NOT NULL,
+            points INTEGER NOT NULL,
+            reason TEXT,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE,
+            UNIQUE(claim_id, event_type)
+        )
+        """)
+        # Covers the per-user / per-type aggregation done by the replay tool
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_impact_events_user_type ON impact_events(user_id, event_type)")
+        
         conn.commit()
         
         # Pre-populate the badges table if it's empty
@@ -535,24 +1345,21 @@ def create_gamification_tables_if_not_exists():
                 VALUES (?, ?, ?, ?, ?)
             """, badges_to_add)
             conn.commit()
-            print("🏆 Populated default badges.")
+            log.info("Populated default badges")
             
         conn.close()
-        print("✅ Gamification tables checked/created successfully.")
+        log.debug("Gamification tables checked")
         
-    except Exception as e:
-        print(f"❌ Error creating gamification tables: {e}")
+    except Exception:
+        log.exception("Error creating gamification tables")
 
-def get_user_stats(user_id):
-    """Gets a user's stats, creating a new row if one doesn't exist."""
+def get_user_stats(user_id, allow_snapshot=True):
+    """Gets a user's stats, falling back to zeroes if no row exists yet."""
     try:
-        conn = get_conn()
+        # Read-only: the stats row is created by complete_claim_and_award_points()
+        conn = get_read_conn(allow_snapshot)
         cur = conn.cursor()
         
-        # Ensure a stats row exists for this user
-        cur.execute("INSERT OR IGNORE INTO user_stats (user_id) VALUES (?)", (user_id,))
-        conn.commit()
-        
         # Retrieve the stats
         cur.execute("SELECT * FROM user_stats WHERE user_id = ?", (user_id,))
         row = cur.fetchone()
@@ -564,8 +1371,8 @@ def get_user_stats(user_id):
             "impact_points": 0
         }
         
-    except Exception as e:
-        print(f"❌ Error getting user stats: {e}")
+    except Exception:
+        log.exception("Error getting user stats", extra={"user_id": user_id})
         return {
             "user_id": user_id, 
             "donations_made": 0, 
@@ -576,7 +1383,7 @@ def get_user_stats(user_id):
 def get_user_badges(user_id):
     """Gets all badges (name, icon, desc) earned by a user."""
     try:
-        conn = get_conn()
+        conn = get_read_conn()
         cur = conn.cursor()
         cur.execute("""
             SELECT b.name, b.description, b.icon
@@ -588,8 +1395,8 @@ def get_user_badges(user_id):
         rows = cur.fetchall()
         conn.close()
         return [dict(row) for row in rows]
-    except Exception as e:
-        print(f"❌ Error getting user badges: {e}")
+    except Exception:
+        log.exception("Error getting user badges", extra={"user_id": user_id})
         return []
 
 def check_and_award_badges(user_id):
@@ -601,7 +1408,8 @@ def check_and_award_badges(user_id):
         conn = get_conn()
         cur = conn.cursor()
         
-        stats = get_user_stats(user_id)
+        # Badges must be judged on the counters just written, never on the snapshot
+        stats = get_user_stats(user_id, allow_snapshot=False)
         
         # Get all potential badges
         cur.execute("SELECT * FROM badges")
@@ -628,14 +1436,16 @@ def check_and_award_badges(user_id):
                     except sqlite3.IntegrityError:
                         # User already has this badge (race condition, safe to ignore)
                         pass
-                    except Exception as e:
-                        print(f"Error awarding badge: {e}")
+                    except Exception:
+                        log.exception("Error awarding badge", extra={"user_id": user_id, "badge_id": badge["id"]})
 
         conn.close()
+        if new_badges_awarded:
+            bump_generation("badges")
         
         # Create notifications (outside the main DB connection loop)
         for badge in new_badges_awarded:
-            print(f"🎉 Awarding badge '{badge['name']}' to user {user_id}")
+            log.info("Badge awarded", extra={"user_id": user_id, "badge": badge["name"]})
             create_notification(
                 user_id=user_id,
                 type="badge",
@@ -643,23 +1453,176 @@ def check_and_award_badges(user_id):
                 message=f"You've earned the **{badge['icon']} {badge['name']}** badge: *{badge['description']}*"
             )
             
-    except Exception as e:
-        print(f"❌ Error in check_and_award_badges: {e}")
+    except Exception:
+        log.exception("Error checking badges", extra={"user_id": user_id})
+
+# --- START: Impact ledger ---
+# Every completed pickup appends one event per participant to impact_events.
+# user_stats is an incrementally maintained view over that ledger: each event
+# applies its rule's deltas in the same transaction, and
+# rebuild_stats_from_ledger() can recompute the whole view after a rule change.
+
+IMPACT_RULES = {
+    "donation_completed": {"donations_made": 1, "impact_points": 10},
+    "claim_completed": {"claims_received": 1, "impact_points": 5},
+}
+
+STAT_COLUMNS = ("donations_made", "claims_received", "impact_points")
+
+def record_impact_event(cur, user_id, event_type, claim_id=None, reason=None, rules=None):
+    """
+    Appends an event to the ledger and applies its deltas to user_stats.
+    Runs on the caller's cursor so it commits or rolls back with the caller's transaction.
+    Returns False if the event was already recorded for this claim.
+    """
+    deltas = (rules or IMPACT_RULES)[event_type]
+    points = deltas.get("impact_points", 0)
+    cur.execute("""
+        INSERT OR IGNORE INTO impact_events (user_id, claim_id, event_type, points, reason)
+        VALUES (?, ?, ?, ?, ?)
+    """, (user_id, claim_id, event_type, points, reason))
+    if cur.rowcount == 0:
+        return False
+    values = [deltas.get(col, 0) for col in STAT_COLUMNS]
+    # Single upsert instead of INSERT OR IGNORE + UPDATE keeps the hot row to one write
+    cur.execute("""
+        INSERT INTO user_stats (user_id, donations_made, claims_received, impact_points)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT(user_id) DO UPDATE SET
+            donations_made = donations_made + excluded.donations_made,
+            claims_received = claims_received + excluded.claims_received,
+            impact_points = impact_points + excluded.impact_points
+    """, (user_id, *values))
+    return True
+
+def backfill_impact_ledger():
+    """Creates ledger events for COMPLETED claims that predate the ledger. Returns rows added."""
+    import shards
+    conn = shards.connect_all()
+    cur = conn.cursor()
+    added = 0
+    for event_type, user_column in (("donation_completed", "l.donor_id"), ("claim_completed", "c.receiver_id")):
+        cur.execute(f"""
+            INSERT OR IGNORE INTO impact_events (user_id, claim_id, event_type, points, reason, created_at)
+            SELECT {user_column}, c.id, ?, ?, 'backfill', COALESCE(c.completed_at, c.reserved_at)
+            FROM all_claims c
+            JOIN all_listings l ON l.id = c.listing_id
+            WHERE c.status = 'COMPLETED'
+        """, (event_type, IMPACT_RULES[event_type].get("impact_points", 0)))
+        added += cur.rowcount
+    conn.commit()
+    conn.close()
+    return added
+
+def rebuild_stats_from_ledger(rules=None):
+    """
+    Recomputes user_stats and user_badges from impact_events under the given rules
+    (defaults to IMPACT_RULES). The ledger is read in a single grouped pass over its
+    covering index, so the cost is one scan no matter how many events it holds.
+    Returns the number of users whose stats were rebuilt.
+    """
+    rules = rules or IMPACT_RULES
+    conn = get_conn()
+    cur = conn.cursor()
+    try:
+        cur.execute("BEGIN IMMEDIATE;")
+        cur.execute("""
+            SELECT user_id, event_type, COUNT(*) AS n
+            FROM impact_events
+            GROUP BY user_id, event_type
+        """)
+        totals = {}
+        for user_id, event_type, n in cur:
+            deltas = rules.get(event_type)
+            if not deltas:
+                continue
+            row = totals.setdefault(user_id, [0, 0, 0])
+            for i, col in enumerate(STAT_COLUMNS):
+                row[i] += deltas.get(col, 0) * n
+
+        cur.execute("DELETE FROM user_stats")
+        cur.executemany("""
+            INSERT INTO user_stats (user_id, donations_made, claims_received, impact_points)
+            VALUES (?, ?, ?, ?)
+        """, ((uid, *row) for uid, row in totals.items()))
+
+        # Badges follow the rebuilt stats: revoke what no longer qualifies, grant what now does
+        qualifies = """
+            CASE b.required_stat
+                WHEN 'donations_made' THEN s.donations_made
+                WHEN 'claims_received' THEN s.claims_received
+                WHEN 'impact_points' THEN s.impact_points
+            END >= b.required_value
+        """
+        cur.execute(f"""
+            DELETE FROM user_badges WHERE id IN (
+                SELECT ub.id FROM user_badges ub
+                JOIN badges b ON b.id = ub.badge_id
+                LEFT JOIN user_stats s ON s.user_id = ub.user_id
+                WHERE s.user_id IS NULL OR NOT ({qualifies})
+            )
+        """)
+        cur.execute(f"""
+            INSERT OR IGNORE INTO user_badges (user_id, badge_id)
+            SELECT s.user_id, b.id FROM user_stats s JOIN badges b ON {qualifies}
+        """)
+        conn.commit()
+        bump_generation("stats", "badges", "ledger_rebuild")
+        return len(totals)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+def get_impact_history(user_id, limit=50):
+    """
+    Gets the most recent ledger events for a user. points is what the event is
+    worth under the current IMPACT_RULES, like the totals rebuild_stats_from_ledger()
+    computes, not the value stored when it was recorded.
+    """
+    try:
+        conn = get_read_conn()
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT event_type, reason, claim_id, created_at
+            FROM impact_events
+            WHERE user_id = ?
+            ORDER BY id DESC
+            LIMIT ?
+        """, (user_id, limit))
+        rows = cur.fetchall()
+        conn.close()
+        return [
+            {**dict(row), "points": IMPACT_RULES.get(row["event_type"], {}).get("impact_points", 0)}
+            for row in rows
+        ]
+    except Exception:
+        log.exception("Error getting impact history", extra={"user_id": user_id})
+        return []
+
+# --- END: Impact ledger ---
 
 def complete_claim_and_award_points(claim_id, donor_id, receiver_id):
     """
-    Marks a claim as 'COMPLETED' and updates stats for both users.
+    Marks a claim as 'COMPLETED' and records ledger events for both users.
     This is the main trigger for gamification.
     """
     try:
-        conn = get_conn()
+        import shards
+        shard = shards.shard_of_id(claim_id, "claims")
+        conn = get_conn(shard)
         cur = conn.cursor()
         
         # Start transaction
         cur.execute("BEGIN;")
         
         # 1. Update the claim status
-        cur.execute("UPDATE claims SET status = 'COMPLETED' WHERE id = ? AND status = 'RESERVED'", (claim_id,))
+        now = now_epoch()
+        cur.execute("""
+            UPDATE claims SET status = 'COMPLETED', completed_at = ?, completed_ts = ?
+            WHERE id = ? AND status = 'RESERVED'
+        """, (from_epoch(now), now, claim_id))
         
         if cur.rowcount == 0:
             # Claim was not in 'RESERVED' state (maybe already completed)
@@ -667,38 +1630,43 @@ def complete_claim_and_award_points(claim_id, donor_id, receiver_id):
             conn.close()
             return False
         
-        # 2. Ensure stats rows exist
-        cur.execute("INSERT OR IGNORE INTO user_stats (user_id) VALUES (?)", (donor_id,))
-        cur.execute("INSERT OR IGNORE INTO user_stats (user_id) VALUES (?)", (receiver_id,))
-        
-        # 3. Update stats
-        # Donor: +1 donation, +10 points
+        # Pickup analytics: meals rescued (the claimed portions, else one), plus one pickup and its
+        # claim-to-pickup latency, so average latency is per pickup whatever the portion count
         cur.execute("""
-            UPDATE user_stats 
-            SET donations_made = donations_made + 1, impact_points = impact_points + 10
-            WHERE user_id = ?
-        """, (donor_id,))
-        
-        # Receiver: +1 claim, +5 points
-        cur.execute("""
-            UPDATE user_stats 
-            SET claims_received = claims_received + 1, impact_points = impact_points + 5
-            WHERE user_id = ?
-        """, (receiver_id,))
+            SELECT l.lat, l.lng, c.quantity,
+                   c.completed_ts - c.reserved_ts AS latency
+            FROM claims c JOIN listings l ON l.id = c.listing_id
+            WHERE c.id = ?
+        """, (claim_id,))
+        pickup = cur.fetchone()
+
+        def home_effects(home):
+            record_rollup(home, "meals_rescued", pickup["lat"], pickup["lng"], pickup["quantity"] or 1)
+            record_rollup(home, "pickups_completed", pickup["lat"], pickup["lng"])
+            if pickup["latency"] is not None:
+                record_rollup(home, "pickup_latency_seconds", pickup["lat"], pickup["lng"], pickup["latency"])
+            # 2. Append ledger events; each one also updates user_stats
+            record_impact_event(home, donor_id, "donation_completed", claim_id, reason="pickup confirmed")
+            record_impact_event(home, receiver_id, "claim_completed", claim_id, reason="pickup confirmed")
         
-        # Commit transaction
-        conn.commit()
+        # Commit transaction (the ledger separately when the claim is in a regional shard)
+        _commit_with_home_effects(conn, {shard}, home_effects)
         conn.close()
+        bump_generation("claims", "stats")
         
-        # 4. Check for new badges (outside the transaction)
+        # 3. Check for new badges (outside the transaction)
         check_and_award_badges(donor_id)
         check_and_award_badges(receiver_id)
         
-        print(f"✅ Claim {claim_id} completed. Stats updated for Donor {donor_id} and Receiver {receiver_id}.")
+        # 4. Move both users on the in-memory leaderboards
+        import leaderboard
+        leaderboard.refresh_users([donor_id, receiver_id])
+        
+        log.info("Claim completed", extra={"claim_id": claim_id, "donor_id": donor_id, "receiver_id": receiver_id})
         return True
         
-    except Exception as e:
-        print(f"❌ Error in complete_claim: {e}")
+    except Exception:
+        log.exception("Error completing claim", extra={"claim_id": claim_id})
         if 'conn' in locals():
             conn.rollback()
             conn.close()
@@ -720,10 +1688,463 @@ def alter_listings_table_for_visibility():
         if 'visibility' not in columns:
             cur.execute("ALTER TABLE listings ADD COLUMN visibility TEXT DEFAULT 'everyone'")
             conn.commit()
-            print("✅ Added 'visibility' column to 'listings' table.")
+            log.info("Added visibility column to listings table")
         
         conn.close()
-    except Exception as e:
-        print(f"❌ Error altering 'listings' table for visibility: {e}")
+    except Exception:
+        log.exception("Error altering listings table for visibility")
 
 # --- END: Added for Feature 3 (NGO Mode) ---
+
+
+# --- START: Portion-based claims (schema) ---
+
+def alter_listings_table_for_quantity():
+    """Adds the numeric quantity columns to the listings table if they don't exist."""
+    try:
+        conn = get_conn()
+        cur = conn.cursor()
+        cur.execute("PRAGMA table_info(listings)")
+        columns = [col[1] for col in cur.fetchall()]
+
+        added = False
+        for name, ddl in (("quantity_total", "INTEGER"), ("quantity_remaining", "INTEGER"), ("quantity_unit", "TEXT")):
+            if name not in columns:
+                cur.execute(f"ALTER TABLE listings ADD COLUMN {name} {ddl}")
+                added = True
+        conn.commit()
+        conn.close()
+        if added:
+            log.info("Added quantity columns to listings table")
+            backfill_listing_quantities()
+    except Exception:
+        log.exception("Error altering listings table for quantity")
+
+def backfill_listing_quantities():
+    """
+    Parses the free-text quantity of listings that have no numeric one yet, and
+    gives their existing claims the whole amount. Returns listings updated.
+    """
+    conn = get_conn()
+    cur = conn.cursor()
+    cur.execute("SELECT id, quantity, status FROM listings WHERE quantity_total IS NULL AND quantity IS NOT NULL")
+    updates = []
+    for row in cur.fetchall():
+        total, unit = parse_quantity(row["quantity"])
+        if total is not None:
+            # Only listings still on offer have anything left to split
+            updates.append((total, total if row["status"] == "AVAILABLE" else 0, unit, row["id"]))
+    cur.executemany("""
+        UPDATE listings SET quantity_total = ?, quantity_remaining = ?, quantity_unit = ? WHERE id = ?
+    """, updates)
+    cur.execute("""
+        UPDATE claims SET quantity = (SELECT quantity_total FROM listings WHERE listings.id = claims.listing_id)
+        WHERE quantity IS NULL
+    """)
+    conn.commit()
+    conn.close()
+    if updates:
+        bump_generation("listings", "claims")
+    return len(updates)
+
+# --- END: Portion-based claims (schema) ---
+
+
+# --- START: JSON API support (api.py) ---
+
+def create_api_tables_if_not_exists():
+    """Creates the api_tokens table and the listings index behind nearby search."""
+    try:
+        conn = get_conn()
+        cur = conn.cursor()
+        # Only a SHA-256 of each bearer token is stored
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS api_tokens (
+                token_hash TEXT PRIMARY KEY,
+                user_id INTEGER NOT NULL,
+                created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                expires_at TEXT NOT NULL,
+                FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
+            )
+        """)
+        # Newest-first pages use idx_listings_status_created_ts (migrate_time_columns_to_epoch)
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_listings_status_lat ON listings(status, lat)")
+        conn.commit()
+        conn.close()
+    except Exception:
+        log.exception("Error creating API tables")
+
+def get_nearby_listings(user_id, lat, lng, radius_km=5.0, limit=50):
+    """
+    Available listings the user may see within radius_km of (lat, lng), nearest
+    first, as Listings with distance_km set. A lat/lng bounding box narrows the
+    rows in SQL; exact distances are computed for what is left.
+    """
+    import math
+    from recommend import haversine_km, EARTH_RADIUS_KM
+    dlat = math.degrees(radius_km / EARTH_RADIUS_KM)
+    dlng = dlat / max(math.cos(math.radians(lat)), 1e-6)
+    import shards
+    rows = []
+    visibility = None
+    # One shard unless the search box crosses a region border
+    for shard in shards.shards_for_box(lat - dlat, lng - dlng, lat + dlat, lng + dlng):
+        conn = get_read_conn(shard=shard)
+        cur = conn.cursor()
+        if visibility is None:
+            cur.execute("SELECT user_type FROM users WHERE id = ?", (user_id,))
+            user_row = cur.fetchone()
+            visibility = ("everyone", "ngo_only") if user_row and user_row["user_type"] == "NGO" else ("everyone",)
+        cur.execute(f"""
+            SELECT {Listing.columns()} FROM listings
+            WHERE status = 'AVAILABLE' AND lat BETWEEN ? AND ? AND lng BETWEEN ? AND ?
+              AND visibility IN ({",".join("?" * len(visibility))})
+        """, (lat - dlat, lat + dlat, lng - dlng, lng + dlng, *visibility))
+        rows.extend(Listing.fetchall(cur))
+        conn.close()
+    if not rows:
+        return []
+    distance_km = haversine_km([r["lat"] for r in rows], [r["lng"] for r in rows], lat, lng)
+    nearby = []
+    for i in distance_km.argsort(kind="stable"):
+        if distance_km[i] > radius_km or len(nearby) == limit:
+            break
+        rows[i]["distance_km"] = round(float(distance_km[i]), 2)
+        nearby.append(rows[i])
+    return nearby
+
+def get_available_listings_by_ids(listing_ids):
+    """{id: row} for those of listing_ids that are still AVAILABLE."""
+    if not listing_ids:
+        return {}
+    import shards
+    by_shard = {}
+    for lid in listing_ids:
+        by_shard.setdefault(shards.shard_of_id(lid), []).append(lid)
+    rows = {}
+    for shard, ids in by_shard.items():
+        conn = get_read_conn(shard=shard)
+        cur = conn.cursor()
+        cur.execute(f"""
+            SELECT {Listing.columns()} FROM listings WHERE status = 'AVAILABLE' AND id IN ({",".join("?" * len(ids))})
+        """, ids)
+        rows.update((row["id"], row) for row in Listing.fetchall(cur))
+        conn.close()
+    return rows
+
+def get_claim(claim_id):
+    """A claim with its listing's donor_id and title, or None."""
+    import shards
+    conn = get_conn(shards.shard_of_id(claim_id, "claims"))
+    cur = conn.cursor()
+    cur.execute(f"""
+        SELECT {Claim.columns('claims')}, listings.donor_id, listings.title
+        FROM claims JOIN listings ON claims.listing_id = listings.id
+        WHERE claims.id = ?
+    """, (claim_id,))
+    row = Claim.fetchone(cur)
+    conn.close()
+    return row
+
+# --- END: JSON API support (api.py) ---
+
+
+# --- START: Rate limits (ratelimit.py, rate_limit_store = "sqlite") ---
+
+def create_rate_limit_table_if_not_exists():
+    """Creates the rate_limits table used when token buckets are kept in SQLite."""
+    try:
+        conn = get_conn()
+        cur = conn.cursor()
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS rate_limits (
+                key TEXT PRIMARY KEY,
+                tokens REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                allowed INTEGER NOT NULL
+            )
+        """)
+        conn.commit()
+        conn.close()
+    except Exception:
+        log.exception("Error creating rate_limits table")
+
+def take_rate_limit_tokens(buckets, now):
+    """
+    Refills the buckets ([(key, capacity, rate, cost)]) and, only if every one
+    has `cost` tokens, takes them from all of them, in one write transaction so
+    concurrent processes cannot both spend the last token. Returns None if the
+    tokens were taken, else the seconds until they would be available.
+    """
+    conn = get_conn()
+    cur = conn.cursor()
+    try:
+        cur.execute("BEGIN IMMEDIATE;")
+        refilled = []
+        for key, capacity, rate, cost in buckets:
+            cur.execute("SELECT tokens, updated_at FROM rate_limits WHERE key = ?", (key,))
+            row = cur.fetchone()
+            refilled.append(capacity if row is None else min(capacity, row["tokens"] + (now - row["updated_at"]) * rate))
+        short = [(cost - tokens) / rate for tokens, (_, _, rate, cost) in zip(refilled, buckets) if tokens < cost]
+        if short:
+            conn.rollback()
+            return max(short)
+        cur.executemany("""
+            INSERT INTO rate_limits (key, tokens, updated_at, allowed) VALUES (?, ?, ?, 1)
+            ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, updated_at = excluded.updated_at, allowed = 1
+        """, [(key, tokens - cost, now) for tokens, (key, _, _, cost) in zip(refilled, buckets)])
+        conn.commit()
+        return None
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+# --- END: Rate limits ---
+
+
+# --- START: Listing events (events.py) ---
+# The availability feed, shared by every process: events.py appends a row
+# after each commit that changes what receivers can take, and each process
+# tails the table by seq. The newest LISTING_EVENTS_KEPT rows are kept, so an
+# SSE client can resume from its Last-Event-ID across API restarts.
+
+LISTING_EVENTS_KEPT = int(get_setting("listing_events_kept", 50_000))
+
+def create_listing_events_table_if_not_exists():
+    try:
+        conn = get_conn()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS listing_events (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                type TEXT NOT NULL,
+                listing_id INTEGER NOT NULL,
+                ts REAL NOT NULL,
+                data TEXT NOT NULL
+            )
+        """)
+        conn.commit()
+        conn.close()
+    except Exception:
+        log.exception("Error creating listing_events table")
+
+def append_listing_event(type, listing_id, ts, data):
+    """Stores one event (data is its JSON-encoded extra fields) and returns its seq."""
+    conn = get_conn()
+    cur = conn.cursor()
+    cur.execute("INSERT INTO listing_events (type, listing_id, ts, data) VALUES (?, ?, ?, ?)",
+                (type, listing_id, ts, data))
+    seq = cur.lastrowid
+    if seq % 100 == 0:
+        cur.execute("DELETE FROM listing_events WHERE seq <= ?", (seq - LISTING_EVENTS_KEPT,))
+    conn.commit()
+    conn.close()
+    return seq
+
+def get_listing_events_since(seq, limit):
+    """Up to `limit` (seq, type, listing_id, ts, data) rows after seq, oldest first."""
+    conn = get_read_conn(allow_snapshot=False)
+    rows = conn.execute("""
+        SELECT seq, type, listing_id, ts, data FROM listing_events
+        WHERE seq > ? ORDER BY seq LIMIT ?
+    """, (seq, limit)).fetchall()
+    conn.close()
+    return rows
+
+def get_last_listing_event_seq():
+    conn = get_read_conn(allow_snapshot=False)
+    seq = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM listing_events").fetchone()[0]
+    conn.close()
+    return seq
+
+# --- END: Listing events ---
+
+# --- START: Expiry urgency (urgency.py) ---
+
+def create_urgency_tables_if_not_exists():
+    """
+    Creates the expiry_escalations table: one row per escalation sent, so a
+    lead time fires once across processes and restarts.
+    """
+    try:
+        conn = get_conn()
+        cur = conn.cursor()
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS expiry_escalations (
+                listing_id INTEGER NOT NULL,
+                lead_hours REAL NOT NULL,
+                sent_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (listing_id, lead_hours)
+            ) WITHOUT ROWID
+        """)
+        conn.commit()
+        conn.close()
+    except Exception:
+        log.exception("Error creating urgency tables")
+
+def get_listing_deadlines(shard, expiry_before, cooked_since):
+    """
+    Available listings of one shard that have a deadline: an expiry_ts before
+    `expiry_before`, or cooked food without one posted since `cooked_since`
+    (epoch seconds). Both are index range scans (status + expiry_ts, status + created_ts).
+    """
+    conn = get_read_conn(allow_snapshot=False, shard=shard)
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT id, expiry_ts, food_type, created_ts FROM listings
+        WHERE status = 'AVAILABLE' AND expiry_ts < ?
+        UNION ALL
+        SELECT id, expiry_ts, food_type, created_ts FROM listings
+        WHERE status = 'AVAILABLE' AND created_ts >= ? AND expiry_ts IS NULL AND food_type = 'cooked'
+    """, (expiry_before, cooked_since))
+    rows = cur.fetchall()
+    conn.close()
+    return rows
+
+def get_sent_escalations(since):
+    """{(listing_id, lead_hours)} of the escalations sent since `since`."""
+    conn = get_read_conn(allow_snapshot=False)
+    cur = conn.cursor()
+    cur.execute("SELECT listing_id, lead_hours FROM expiry_escalations WHERE sent_at >= ?", (since,))
+    sent = {(row[0], row[1]) for row in cur.fetchall()}
+    conn.close()
+    return sent
+
+def claim_escalation(listing_id, lead_hours):
+    """Records an escalation as sent. False if another process already sent it."""
+    conn = get_conn()
+    cur = conn.cursor()
+    cur.execute("INSERT OR IGNORE INTO expiry_escalations (listing_id, lead_hours) VALUES (?, ?)",
+                (listing_id, lead_hours))
+    claimed = cur.rowcount == 1
+    conn.commit()
+    conn.close()
+    return claimed
+
+# --- END: Expiry urgency ---
+
+
+# --- START: Epoch time columns ---
+# Listing and claim times are also kept as integer epoch seconds (UTC) in *_ts
+# columns next to the original text ones, which stay for display. Text times
+# came in three formats (CURRENT_TIMESTAMP, isoformat(), bare dates), so range
+# predicates and orderings use the integer columns: one representation,
+# compared as numbers and indexed as (status, ts) / (receiver_id, ts). A bare
+# expiry date is stored as the end of that day, when the food stops being good.
+
+EPOCH_COLUMNS = {
+    # table -> {epoch column: text column}
+    "listings": {"created_ts": "created_at", "prepared_ts": "prepared_at", "expiry_ts": "expiry_at"},
+    "claims": {"reserved_ts": "reserved_at", "expires_ts": "expires_at", "completed_ts": "completed_at"},
+}
+# Text-time indexes replaced by the epoch ones below
+_TEXT_TIME_INDEXES = ("idx_listings_status_created", "idx_listings_status_expiry", "idx_claims_receiver")
+_EPOCH_INDEXES = (
+    "CREATE INDEX IF NOT EXISTS main.idx_listings_status_created_ts ON listings(status, created_ts)",
+    "CREATE INDEX IF NOT EXISTS main.idx_listings_status_expiry_ts ON listings(status, expiry_ts)",
+    "CREATE INDEX IF NOT EXISTS main.idx_claims_receiver_ts ON claims(receiver_id, reserved_ts)",
+)
+
+def to_epoch(value, end_of_day=False):
+    """
+    Epoch seconds for a time given as text in any of the stored formats
+    ("2026-10-19", "2026-10-19 08:30:00", isoformat()), a date, a datetime or a
+    number. Naive times are UTC. A bare date is its start, or with end_of_day
+    its end. None for empty or unparseable values.
+    """
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    date_only = False
+    if isinstance(value, datetime.datetime):
+        dt = value
+    elif isinstance(value, datetime.date):
+        dt, date_only = datetime.datetime.combine(value, datetime.time()), True
+    else:
+        text = str(value).strip()
+        try:
+            dt = datetime.datetime.fromisoformat(text)
+        except ValueError:
+            return None
+        date_only = len(text) == 10
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=datetime.timezone.utc)
+    ts = int(dt.timestamp())
+    return ts + 86400 if end_of_day and date_only else ts
+
+def from_epoch(ts):
+    """Epoch seconds as "YYYY-MM-DD HH:MM:SS" UTC, the CURRENT_TIMESTAMP format; None stays None."""
+    if ts is None:
+        return None
+    return datetime.datetime.fromtimestamp(ts, datetime.timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+def now_epoch():
+    return int(time.time())
+
+def _epoch_sql(text_column, end_of_day=False):
+    # SQL twin of to_epoch() for backfills; strftime('%s') reads all three formats
+    sql = f"CAST(strftime('%s', {text_column}) AS INTEGER)"
+    if end_of_day:
+        sql += f" + CASE WHEN length({text_column}) = 10 THEN 86400 ELSE 0 END"
+    return sql
+
+def _existing_shards():
+    import shards
+    return [shard for shard in shards.names()
+            if shard == MAIN_SHARD or Path(get_shard_path(shard)).exists()]
+
+def migrate_time_columns_to_epoch():
+    """
+    Adds the *_ts columns to listings and claims (in the main database and
+    every existing shard file), backfills them when they were just added, then
+    swaps the text-time indexes for epoch ones (built after the backfill, so
+    they come out packed).
+    """
+    try:
+        added = False
+        for shard in _existing_shards():
+            conn = get_conn(None if shard == MAIN_SHARD else shard)
+            cur = conn.cursor()
+            for table, columns in EPOCH_COLUMNS.items():
+                have = {row["name"] for row in cur.execute(f"PRAGMA main.table_info({table})")}
+                for column in columns:
+                    if column not in have:
+                        cur.execute(f"ALTER TABLE main.{table} ADD COLUMN {column} INTEGER")
+                        added = True
+            conn.commit()
+            conn.close()
+        if added:
+            log.info("Added epoch time columns to listings and claims")
+            backfill_epoch_columns()
+        for shard in _existing_shards():
+            conn = get_conn(None if shard == MAIN_SHARD else shard)
+            for name in _TEXT_TIME_INDEXES:
+                conn.execute(f"DROP INDEX IF EXISTS main.{name}")
+            for ddl in _EPOCH_INDEXES:
+                conn.execute(ddl)
+            conn.commit()
+            conn.close()
+    except Exception:
+        log.exception("Error migrating time columns")
+
+def backfill_epoch_columns():
+    """Fills *_ts columns that are NULL from their text columns. Returns rows updated."""
+    updated = 0
+    for shard in _existing_shards():
+        conn = get_conn(None if shard == MAIN_SHARD else shard)
+        cur = conn.cursor()
+        for table, columns in EPOCH_COLUMNS.items():
+            missing = " OR ".join(f"({ts} IS NULL AND {text} IS NOT NULL)" for ts, text in columns.items())
+            sets = ", ".join(f"{ts} = COALESCE({ts}, {_epoch_sql(text, end_of_day=ts == 'expiry_ts')})"
+                             for ts, text in columns.items())
+            cur.execute(f"UPDATE main.{table} SET {sets} WHERE {missing}")
+            updated += cur.rowcount
+        conn.commit()
+        conn.close()
+    if updated:
+        bump_generation("listings", "claims")
+    return updated
+
+# --- END: Epoch time columns ---
@@ -1,9 +1,14 @@
 # email_utils.py
-import smtplib
+import time
 from email.message import EmailMessage
 import streamlit as st
+import profiling
+from log_utils import get_logger
+
+log = get_logger("email")
 
 def send_email(to_email: str, subject: str, body: str):
+    import smtplib  # only loaded when a notification email actually goes out
     try:
         host = st.secrets["smtp_host"]
         port = int(st.secrets["smtp_port"])
@@ -17,12 +22,17 @@ def send_email(to_email: str, subject: str, body: str):
         msg["To"] = to_email
         msg.set_content(body)
 
-        server = smtplib.SMTP(host, port)
-        server.starttls()
-        server.login(user, password)
-        server.send_message(msg)
-        server.quit()
+        started = time.perf_counter()
+        try:
+            server = smtplib.SMTP(host, port)
+            server.starttls()
+            server.login(user, password)
+            server.send_message(msg)
+            server.quit()
+        finally:
+            profiling.count("smtp", (time.perf_counter() - started) * 1000)
+        log.info("Email sent", extra={"subject": subject})
         return True
-    except Exception as e:
-        print("send_email error:", e)
+    except Exception:
+        log.exception("send_email error", extra={"to": to_email})
         return False
@@ -0,0 +1,131 @@
+# events.py
+# Listing availability feed, shared by every process. db.py publishes an
+# event after committing any change to what receivers can take: a listing is
+# created, a partial claim lowers its remaining quantity, or it stops being
+# available (fully claimed or expired). Each event is appended to the
+# listing_events table (db.py); one thread per process tails it every
+# POLL_SECONDS into a buffer of recent events, so the app, the API and
+# rebuild scripts all see each other's writes:
+#
+#   since(seq)          the receiver page polls the buffer of recent events
+#   subscribe(callback) the API's SSE stream gets each event pushed
+#
+# Events are dicts: seq (increasing across processes), type
+# ("listing.created", "listing.updated" or "listing.removed"), listing_id,
+# status, quantity_remaining, visibility and ts (epoch seconds);
+# listing.created also carries expiry_ts, created_ts and food_type for the
+# urgency heap (urgency.py). This process's own events are delivered as they
+# are published; other processes' within POLL_SECONDS.
+import collections
+import json
+import threading
+import time
+
+from db import (
+    get_setting, create_listing_events_table_if_not_exists, append_listing_event,
+    get_listing_events_since, get_last_listing_event_seq,
+)
+from log_utils import get_logger
+
+log = get_logger("events")
+
+HISTORY = 1_000  # recent events kept in memory for since() and SSE reconnects
+POLL_SECONDS = float(get_setting("listing_events_poll_seconds", 0.5))
+
+_lock = threading.Lock()       # guards the buffer and subscribers
+_poll_lock = threading.Lock()  # one reader of the table at a time, so events are delivered in order
+_history = collections.deque(maxlen=HISTORY)
+_seq = None  # last seq read from the table; None until _start()
+_subscribers = set()
+
+def _event(row):
+    seq, type, listing_id, ts, data = row
+    return {"seq": seq, "type": type, "listing_id": listing_id, "ts": ts, **json.loads(data)}
+
+def _start():
+    # Begins at the current end of the table; older events are read on demand by since()
+    global _seq
+    with _poll_lock:
+        if _seq is not None:
+            return
+        create_listing_events_table_if_not_exists()
+        _seq = get_last_listing_event_seq()
+    threading.Thread(target=_tail, name="listing-events", daemon=True).start()
+
+def _poll():
+    """Moves new rows into the buffer and hands them to every subscriber."""
+    global _seq
+    with _poll_lock:
+        while True:
+            new = [_event(row) for row in get_listing_events_since(_seq, HISTORY)]
+            if not new:
+                return
+            with _lock:
+                _history.extend(new)
+                _seq = new[-1]["seq"]
+                subscribers = list(_subscribers)
+            for event in new:
+                for callback in subscribers:
+                    try:
+                        callback(event)
+                    except Exception:
+                        log.exception("Event subscriber failed", extra={"seq": event["seq"]})
+            if len(new) < HISTORY:
+                return
+
+def _tail():
+    while True:
+        time.sleep(POLL_SECONDS)
+        try:
+            _poll()
+        except Exception:
+            log.exception("Reading listing events failed")
+
+def publish(type, listing_id, **fields):
+    """
+    Records an event and delivers it (with anything other processes published
+    before it) on the calling thread. Returns the event, or None if it could
+    not be stored; the write it describes is already committed either way.
+    """
+    _start()
+    ts = round(time.time(), 3)
+    try:
+        seq = append_listing_event(type, listing_id, ts, json.dumps(fields))
+        _poll()
+    except Exception:
+        log.exception("Publishing listing event failed", extra={"listing_id": listing_id, "type": type})
+        return None
+    return {"seq": seq, "type": type, "listing_id": listing_id, "ts": ts, **fields}
+
+def last_seq():
+    _start()
+    return _seq
+
+def since(seq):
+    """
+    (events newer than seq, oldest first; missed). missed is True when some of
+    them are gone (pruned from the table, or more than HISTORY of them), so the
+    caller should reload instead.
+    """
+    _start()
+    with _lock:
+        if seq >= _seq:
+            return [], False
+        if _history and _history[0]["seq"] <= seq + 1:
+            return [e for e in _history if e["seq"] > seq], False
+    # Older than the buffer, e.g. an SSE client resuming after a restart
+    rows = get_listing_events_since(seq, HISTORY + 1)
+    missed = not rows or rows[0][0] > seq + 1 or len(rows) > HISTORY
+    return [_event(row) for row in rows[:HISTORY]], missed
+
+def subscribe(callback):
+    """Calls callback(event) for every new event until the returned function is called.
+    Callbacks run on the publishing or tailing thread and must not block."""
+    _start()
+    with _lock:
+        _subscribers.add(callback)
+
+    def unsubscribe():
+        with _lock:
+            _subscribers.discard(callback)
+    return unsubscribe
@@ -0,0 +1,275 @@
+# exports.py
+# Partner exports: a receiver's claim history, a donor's listing history and
+# the reviews by or about a user, or every row in a date range, streamed as
+# CSV or Parquet.
+#
+#   python exports.py claims --user 12 --start 2026-01-01 > claims.csv
+#   python exports.py listings --start 2026-01-01 --end 2026-04-01 --format parquet -o listings.parquet
+#   GET /api/exports/{claims|listings|reviews}     (api.py; the caller's own rows)
+#
+# Rows are read EXPORT_BATCH_ROWS at a time, keyed on the last id seen, each
+# batch in its own short read from every shard involved, and written out as
+# they arrive: memory stays flat whatever the export's size, and no read
+# transaction stays open for the whole export (which would keep WAL
+# checkpoints from finishing). Exports must not crowd out interactive
+# queries, so at most export_max_concurrent run at once per process and each
+# is paced to export_rows_per_second; the API also rate-limits how often a
+# user may start one (ratelimit.py).
+#
+# Parquet needs pyarrow (pip install pyarrow); CSV needs nothing extra.
+import argparse
+import contextlib
+import csv
+import io
+import sys
+import threading
+import time
+
+import shards
+from db import get_read_conn, get_setting, to_epoch, from_epoch, MAIN_SHARD
+from log_utils import get_logger
+
+log = get_logger("exports")
+
+EXPORT_BATCH_ROWS = 1000
+PARQUET_ROW_GROUP_ROWS = 10_000  # batches are buffered up to one row group
+EXPORT_MAX_CONCURRENT = int(get_setting("export_max_concurrent", 2))
+EXPORT_ROWS_PER_SECOND = float(get_setting("export_rows_per_second", 5000))
+FORMATS = {"csv": "text/csv", "parquet": "application/vnd.apache.parquet"}
+
+# table -> query, keyset id, time filter, owner column(s) and the exported
+# (column, type) pairs, in order. Claims and listings live in the shards; the
+# users they join come from the main database ("home" in a shard connection).
+EXPORTS = {
+    "claims": {
+        "sql": """
+            SELECT c.id, c.listing_id, l.title, l.donor_id, d.name, c.receiver_id, r.name,
+                   c.status, c.quantity, l.quantity_unit, c.reserved_at, c.expires_at, c.completed_at
+            FROM claims c
+            JOIN listings l ON l.id = c.listing_id
+            LEFT JOIN users d ON d.id = l.donor_id
+            LEFT JOIN users r ON r.id = c.receiver_id
+        """,
+        "id": "c.id",
+        "time": "c.reserved_ts",
+        "owner": ("c.receiver_id",),
+        "sharded": True,
+        "columns": [
+            ("claim_id", "int"), ("listing_id", "int"), ("listing_title", "text"), ("donor_id", "int"),
+            ("donor_name", "text"), ("receiver_id", "int"), ("receiver_name", "text"), ("status", "text"),
+            ("quantity", "int"), ("quantity_unit", "text"), ("reserved_at", "text"), ("expires_at", "text"),
+            ("completed_at", "text"),
+        ],
+    },
+    "listings": {
+        "sql": """
+            SELECT l.id, l.donor_id, d.name, l.title, l.food_type, l.veg, l.cuisine, l.quantity_total,
+                   l.quantity_remaining, l.quantity_unit, l.visibility, l.status, l.lat, l.lng,
+                   l.created_at, l.expiry_at
+            FROM listings l
+            LEFT JOIN users d ON d.id = l.donor_id
+        """,
+        "id": "l.id",
+        "time": "l.created_ts",
+        "owner": ("l.donor_id",),
+        "sharded": True,
+        "columns": [
+            ("listing_id", "int"), ("donor_id", "int"), ("donor_name", "text"), ("title", "text"),
+            ("food_type", "text"), ("veg", "int"), ("cuisine", "text"), ("quantity_total", "int"),
+            ("quantity_remaining", "int"), ("quantity_unit", "text"), ("visibility", "text"), ("status", "text"),
+            ("lat", "real"), ("lng", "real"), ("created_at", "text"), ("expiry_at", "text"),
+        ],
+    },
+    "reviews": {
+        "sql": """
+            SELECT v.id, v.claim_id, v.reviewer_id, a.name, v.reviewee_id, b.name, v.rating, v.comment, v.created_at
+            FROM reviews v
+            LEFT JOIN users a ON a.id = v.reviewer_id
+            LEFT JOIN users b ON b.id = v.reviewee_id
+        """,
+        "id": "v.id",
+        "time": "v.created_at",
+        "time_is_text": True,  # reviews have no epoch column
+        "owner": ("v.reviewer_id", "v.reviewee_id"),
+        "sharded": False,
+        "columns": [
+            ("review_id", "int"), ("claim_id", "int"), ("reviewer_id", "int"), ("reviewer_name", "text"),
+            ("reviewee_id", "int"), ("reviewee_name", "text"), ("rating", "int"), ("comment", "text"),
+            ("created_at", "text"),
+        ],
+    },
+}
+
+class ExportBusy(Exception):
+    """All export_max_concurrent export slots are taken; try again shortly."""
+
+_slots = threading.BoundedSemaphore(EXPORT_MAX_CONCURRENT)
+
+@contextlib.contextmanager
+def _export_slot():
+    if not _slots.acquire(blocking=False):
+        raise ExportBusy()
+    try:
+        yield
+    finally:
+        _slots.release()
+
+def _bounds(start, end):
+    bounds = []
+    for name, value in (("start", start), ("end", end)):
+        ts = to_epoch(value)
+        if value and ts is None:
+            raise ValueError(f"{name} must be a date, YYYY-MM-DD")
+        bounds.append(ts)
+    return bounds
+
+def export_batches(table, user_id=None, start=None, end=None):
+    """
+    Yields the export's rows in batches of up to EXPORT_BATCH_ROWS tuples,
+    columns in EXPORTS[table]["columns"] order, id order within each shard.
+    user_id limits it to that user's rows; start/end are 'YYYY-MM-DD', end
+    exclusive.
+    """
+    if table not in EXPORTS:
+        raise ValueError(f"table must be one of {sorted(EXPORTS)}")
+    spec = EXPORTS[table]
+    start_ts, end_ts = _bounds(start, end)
+    clauses, params = [f"{spec['id']} > ?"], []
+    if user_id is not None:
+        clauses.append("(" + " OR ".join(f"{column} = ?" for column in spec["owner"]) + ")")
+        params.extend([user_id] * len(spec["owner"]))
+    for op, ts in ((">=", start_ts), ("<", end_ts)):
+        if ts is not None:
+            clauses.append(f"{spec['time']} {op} ?")
+            params.append(from_epoch(ts) if spec.get("time_is_text") else ts)
+    sql = f"{spec['sql']} WHERE {' AND '.join(clauses)} ORDER BY {spec['id']} LIMIT {EXPORT_BATCH_ROWS}"
+
+    if not spec["sharded"]:
+        shard_names = [MAIN_SHARD]
+    elif user_id is not None:
+        shard_names = shards.user_shards(user_id)
+    else:
+        shard_names = shards.names()
+    for shard in shard_names:
+        last_id = 0
+        while True:
+            conn = get_read_conn(shard=shard)
+            try:
+                batch = conn.execute(sql, (last_id, *params)).fetchall()
+            finally:
+                conn.close()
+            if not batch:
+                break
+            yield [tuple(row) for row in batch]
+            if len(batch) < EXPORT_BATCH_ROWS:
+                break
+            last_id = batch[-1][0]  # the id is every export's first column
+
+def _paced(batches):
+    # Sleeps between batches so the export averages EXPORT_ROWS_PER_SECOND
+    started, rows = time.monotonic(), 0
+    for batch in batches:
+        yield batch
+        rows += len(batch)
+        wait = rows / EXPORT_ROWS_PER_SECOND - (time.monotonic() - started)
+        if wait > 0:
+            time.sleep(wait)
+
+def _csv_chunks(columns, batches):
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow([name for name, _ in columns])
+    for batch in batches:
+        writer.writerows(batch)
+        yield out.getvalue().encode()
+        out.seek(0)
+        out.truncate()
+    yield out.getvalue().encode()
+
+class _Sink(io.RawIOBase):
+    # What ParquetWriter writes, held until the next drain()
+    def __init__(self):
+        super().__init__()
+        self._chunks, self._written = [], 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._written += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._written
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+def _parquet_chunks(columns, batches):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    types = {"int": pa.int64(), "real": pa.float64(), "text": pa.string()}
+    schema = pa.schema([(name, types[kind]) for name, kind in columns])
+    sink = _Sink()
+    writer = pq.ParquetWriter(sink, schema)
+
+    def row_group(rows):
+        values = list(zip(*rows))
+        writer.write_table(pa.Table.from_arrays(
+            [pa.array(values[i], type=field.type) for i, field in enumerate(schema)], schema=schema))
+        return sink.drain()
+
+    pending = []
+    for batch in batches:
+        pending.extend(batch)
+        if len(pending) >= PARQUET_ROW_GROUP_ROWS:
+            yield row_group(pending)
+            pending = []
+    if pending:
+        yield row_group(pending)
+    writer.close()
+    yield sink.drain()
+
+def stream_export(table, fmt="csv", user_id=None, start=None, end=None):
+    """
+    Yields the export as chunks of bytes in `fmt` (FORMATS). Raises ValueError
+    for bad arguments and ExportBusy when every export slot is in use; both
+    surface on the first next(), before any data.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"format must be one of {sorted(FORMATS)}")
+    batches = export_batches(table, user_id, start, end)
+    chunks = _csv_chunks if fmt == "csv" else _parquet_chunks
+    rows = 0
+
+    def counting(batches):
+        nonlocal rows
+        for batch in batches:
+            rows += len(batch)
+            yield batch
+
+    with _export_slot():
+        started = time.perf_counter()
+        for chunk in chunks(EXPORTS[table]["columns"], _paced(counting(batches))):
+            if chunk:
+                yield chunk
+        log.info("Export finished", extra={
+            "table": table, "format": fmt, "user_id": user_id, "rows": rows,
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+        })
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export claims, listings or reviews as CSV or Parquet")
+    parser.add_argument("table", choices=sorted(EXPORTS))
+    parser.add_argument("--user", type=int, help="only this user's rows (receiver, donor, reviewer/reviewee)")
+    parser.add_argument("--start", help="first day, YYYY-MM-DD")
+    parser.add_argument("--end", help="day after the last day, YYYY-MM-DD")
+    parser.add_argument("--format", choices=sorted(FORMATS), default="csv")
+    parser.add_argument("-o", "--output", help="file to write (default: stdout)")
+    args = parser.parse_args()
+    with open(args.output, "wb") if args.output else contextlib.nullcontext(sys.stdout.buffer) as out:
+        for chunk in stream_export(args.table, args.format, args.user, args.start, args.end):
+            out.write(chunk)
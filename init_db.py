@@ -3,88 +3,107 @@ import sqlite3
 from pathlib import Path
 
 DB_PATH = Path("data/community.db")
-DB_PATH.parent.mkdir(parents=True, exist_ok=True)
 
-conn = sqlite3.connect(DB_PATH)
-c = conn.cursor()
+def init_db(db_path=DB_PATH):
+    """Creates the base tables. The app adds the remaining tables/columns on startup."""
+    db_path = Path(db_path)
+    db_path.parent.mkdir(parents=True, exist_ok=True)
 
-# Pragmas
-c.execute("PRAGMA foreign_keys = ON;")
-c.execute("PRAGMA journal_mode = WAL;")
+    conn = sqlite3.connect(db_path)
+    c = conn.cursor()
 
-# users
-c.execute("""
-CREATE TABLE IF NOT EXISTS users (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    name TEXT NOT NULL,
-    email TEXT NOT NULL UNIQUE,
-    password_hash TEXT NOT NULL,
-    phone TEXT,
-    user_type TEXT,
-    ngo_verified INTEGER DEFAULT 0,
-    created_at TEXT DEFAULT CURRENT_TIMESTAMP
-);
-""")
+    # Pragmas
+    c.execute("PRAGMA foreign_keys = ON;")
+    c.execute("PRAGMA journal_mode = WAL;")
 
-# listings
-c.execute("""
-CREATE TABLE IF NOT EXISTS listings (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    donor_id INTEGER NOT NULL,
-    title TEXT,
-    notes TEXT,
-    food_type TEXT, -- cooked / packaged
-    veg INTEGER DEFAULT 1, -- 1 veg, 0 non-veg
-    cuisine TEXT,
-    prepared_at TEXT,
-    packaged_at TEXT,
-    expiry_at TEXT,
-    quantity TEXT,
-    photo_path TEXT,
-    visibility TEXT DEFAULT 'anyone',
-    lat REAL,
-    lng REAL,
-    address_text TEXT,
-    status TEXT DEFAULT 'AVAILABLE',
-    created_at TEXT DEFAULT CURRENT_TIMESTAMP,
-    updated_at TEXT DEFAULT CURRENT_TIMESTAMP,
-    FOREIGN KEY(donor_id) REFERENCES users(id) ON DELETE CASCADE
-);
-""")
+    # users
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        email TEXT NOT NULL UNIQUE,
+        password_hash TEXT NOT NULL,
+        phone TEXT,
+        user_type TEXT,
+        ngo_verified INTEGER DEFAULT 0,
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP
+    );
+    """)
 
-# claims
-c.execute("""
-CREATE TABLE IF NOT EXISTS claims (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    listing_id INTEGER NOT NULL,
-    receiver_id INTEGER NOT NULL,
-    status TEXT DEFAULT 'RESERVED',
-    reserved_at TEXT DEFAULT CURRENT_TIMESTAMP,
-    expires_at TEXT,
-    completed_at TEXT,
-    FOREIGN KEY(listing_id) REFERENCES listings(id) ON DELETE CASCADE,
-    FOREIGN KEY(receiver_id) REFERENCES users(id) ON DELETE CASCADE
-);
-""")
+    # listings
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS listings (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        donor_id INTEGER NOT NULL,
+        title TEXT,
+        notes TEXT,
+        food_type TEXT, -- cooked / packaged
+        veg INTEGER DEFAULT 1, -- 1 veg, 0 non-veg
+        cuisine TEXT,
+        prepared_at TEXT,
+        packaged_at TEXT,
+        expiry_at TEXT,
+        quantity TEXT,
+        quantity_total INTEGER, -- numeric quantity, claimable in parts
+        quantity_remaining INTEGER,
+        quantity_unit TEXT,
+        photo_path TEXT,
+        visibility TEXT DEFAULT 'anyone',
+        lat REAL,
+        lng REAL,
+        address_text TEXT,
+        status TEXT DEFAULT 'AVAILABLE',
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+        updated_at TEXT DEFAULT CURRENT_TIMESTAMP,
+        created_ts INTEGER, -- epoch seconds (UTC) of created_at / prepared_at / end of expiry_at
+        prepared_ts INTEGER,
+        expiry_ts INTEGER,
+        FOREIGN KEY(donor_id) REFERENCES users(id) ON DELETE CASCADE
+    );
+    """)
 
-# notifications
-c.execute("""
-CREATE TABLE IF NOT EXISTS notifications (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    user_id INTEGER NOT NULL,
-    type TEXT NOT NULL, -- 'claim', 'message', 'system'
-    title TEXT NOT NULL,
-    message TEXT NOT NULL,
-    related_listing_id INTEGER,
-    related_user_id INTEGER,
-    is_read INTEGER DEFAULT 0,
-    created_at TEXT DEFAULT CURRENT_TIMESTAMP,
-    FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE,
-    FOREIGN KEY(related_listing_id) REFERENCES listings(id) ON DELETE CASCADE,
-    FOREIGN KEY(related_user_id) REFERENCES users(id) ON DELETE CASCADE
-);
-""")
+    # claims
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS claims (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        listing_id INTEGER NOT NULL,
+        receiver_id INTEGER NOT NULL,
+        status TEXT DEFAULT 'RESERVED',
+        reserved_at TEXT DEFAULT CURRENT_TIMESTAMP,
+        expires_at TEXT,
+        completed_at TEXT,
+        quantity INTEGER, -- portions taken; NULL when the listing was claimed whole
+        reserved_ts INTEGER, -- epoch seconds (UTC) of the *_at columns
+        expires_ts INTEGER,
+        completed_ts INTEGER,
+        FOREIGN KEY(listing_id) REFERENCES listings(id) ON DELETE CASCADE,
+        FOREIGN KEY(receiver_id) REFERENCES users(id) ON DELETE CASCADE
+    );
+    """)
 
-conn.commit()
-conn.close()
-print("DB initialized at", DB_PATH)
+    # notifications
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS notifications (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        type TEXT NOT NULL, -- 'claim', 'message', 'system'
+        title TEXT NOT NULL,
+        message TEXT NOT NULL,
+        related_listing_id INTEGER,
+        related_user_id INTEGER,
+        related_user_name TEXT, -- copied from users/listings at insert time
+        listing_title TEXT,
+        is_read INTEGER DEFAULT 0,
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE,
+        FOREIGN KEY(related_listing_id) REFERENCES listings(id) ON DELETE CASCADE,
+        FOREIGN KEY(related_user_id) REFERENCES users(id) ON DELETE CASCADE
+    );
+    """)
+
+    conn.commit()
+    conn.close()
+
+if __name__ == "__main__":
+    init_db()
+    print("DB initialized at", DB_PATH)
@@ -0,0 +1,263 @@
+# instrumentation.py
+# Query-level metrics for every connection handed out by db.py (and so auth.py).
+# Connections are created with InstrumentedConnection, whose cursors time each
+# statement, count the rows fetched and feed an in-process registry that can be
+# exported as Prometheus text or JSON. Statements slower than the threshold are
+# kept in a slow-query log together with their EXPLAIN QUERY PLAN.
+import json
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+from functools import lru_cache
+import profiling
+from log_utils import get_logger
+
+log = get_logger("db.slow")
+
+# Histogram bucket upper bounds, in milliseconds
+BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+SLOW_LOG_SIZE = 100
+
+settings = {"slow_query_ms": 200.0}
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER_LIST = re.compile(r"\?(?:\s*,\s*\?)+")
+_SPACE = re.compile(r"\s+")
+_NO_PLAN = ("PRAGMA", "BEGIN", "COMMIT", "ROLLBACK", "CREATE", "ALTER", "DROP", "EXPLAIN")
+
+@lru_cache(maxsize=1024)
+def fingerprint(sql):
+    """Normalizes a statement so calls that differ only in literals share one metric."""
+    sql = _STRING.sub("?", sql)
+    sql = _NUMBER.sub("?", sql)
+    sql = _PLACEHOLDER_LIST.sub("?+", sql)
+    return _SPACE.sub(" ", sql).strip().rstrip(";")
+
+def _bucket(ms):
+    for i, bound in enumerate(BUCKETS_MS):
+        if ms <= bound:
+            return i
+    return len(BUCKETS_MS)
+
+class _Series:
+    """Count, total, max and bucket counts for one timed thing."""
+
+    __slots__ = ("count", "total_ms", "max_ms", "rows", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.rows = 0
+        self.buckets = [0] * (len(BUCKETS_MS) + 1)
+
+    def observe(self, ms):
+        self.count += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+        self.buckets[_bucket(ms)] += 1
+
+    def extend(self, before_ms, added_ms):
+        """Moves an observation that took before_ms to before_ms + added_ms."""
+        after_ms = before_ms + added_ms
+        self.total_ms += added_ms
+        self.max_ms = max(self.max_ms, after_ms)
+        old, new = _bucket(before_ms), _bucket(after_ms)
+        if old != new:
+            self.buckets[old] -= 1
+            self.buckets[new] += 1
+
+    def as_dict(self):
+        return {
+            "count": self.count,
+            "total_ms": round(self.total_ms, 3),
+            "mean_ms": round(self.total_ms / self.count, 3) if self.count else 0.0,
+            "max_ms": round(self.max_ms, 3),
+            "rows": self.rows,
+        }
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.queries = {}
+        self.acquire = _Series()
+        self.slow_log = deque(maxlen=SLOW_LOG_SIZE)
+
+    def observe_query(self, fp, ms):
+        with self._lock:
+            series = self.queries.get(fp)
+            if series is None:
+                series = self.queries[fp] = _Series()
+            series.observe(ms)
+
+    def observe_fetch(self, fp, elapsed_ms, ms, rows):
+        """Adds fetch time and rows to a statement already counted by observe_query."""
+        with self._lock:
+            series = self.queries.get(fp)
+            if series is not None:
+                series.extend(elapsed_ms, ms)
+                series.rows += rows
+
+    def observe_acquire(self, ms):
+        with self._lock:
+            self.acquire.observe(ms)
+
+    def record_slow(self, fp, ms, rows, plan):
+        with self._lock:
+            self.slow_log.append({
+                "at": time.strftime("%Y-%m-%d %H:%M:%S"),
+                "statement": fp,
+                "duration_ms": round(ms, 3),
+                "rows": rows,
+                "plan": plan,
+            })
+        log.warning("Slow query", extra={"statement": fp, "duration_ms": round(ms, 3), "rows": rows, "plan": plan})
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "queries": {fp: s.as_dict() for fp, s in self.queries.items()},
+                "connection_acquire": self.acquire.as_dict(),
+                "slow_queries": list(self.slow_log),
+            }
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), indent=2)
+
+    def to_prometheus(self):
+        """Prometheus text exposition format (durations in seconds)."""
+        lines = [
+            "# HELP foodcircle_db_query_duration_seconds Time spent executing and fetching a statement.",
+            "# TYPE foodcircle_db_query_duration_seconds histogram",
+        ]
+        with self._lock:
+            for fp, series in self.queries.items():
+                lines.extend(_histogram_lines("foodcircle_db_query_duration_seconds", series, f'statement="{_escape(fp)}"'))
+            lines += [
+                "# HELP foodcircle_db_query_rows_total Rows fetched per statement.",
+                "# TYPE foodcircle_db_query_rows_total counter",
+            ]
+            for fp, series in self.queries.items():
+                lines.append(f'foodcircle_db_query_rows_total{{statement="{_escape(fp)}"}} {series.rows}')
+            lines += [
+                "# HELP foodcircle_db_connection_acquire_seconds Time to open and configure a connection.",
+                "# TYPE foodcircle_db_connection_acquire_seconds histogram",
+            ]
+            lines.extend(_histogram_lines("foodcircle_db_connection_acquire_seconds", self.acquire, ""))
+            lines += [
+                "# HELP foodcircle_db_slow_queries Slow queries currently held in the log.",
+                "# TYPE foodcircle_db_slow_queries gauge",
+                f"foodcircle_db_slow_queries {len(self.slow_log)}",
+            ]
+        return "\n".join(lines) + "\n"
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _histogram_lines(name, series, labels):
+    sep = "," if labels else ""
+    lines = []
+    cumulative = 0
+    for bound, n in zip(BUCKETS_MS, series.buckets):
+        cumulative += n
+        lines.append(f'{name}_bucket{{{labels}{sep}le="{bound / 1000:g}"}} {cumulative}')
+    lines.append(f'{name}_bucket{{{labels}{sep}le="+Inf"}} {series.count}')
+    label_block = f"{{{labels}}}" if labels else ""
+    lines.append(f"{name}_sum{label_block} {series.total_ms / 1000:.6f}")
+    lines.append(f"{name}_count{label_block} {series.count}")
+    return lines
+
+REGISTRY = MetricsRegistry()
+
+def _explain(conn, sql, params):
+    if sql.lstrip().upper().startswith(_NO_PLAN):
+        return []
+    try:
+        # Plain cursor so the EXPLAIN itself is not measured
+        plan = sqlite3.Cursor(conn).execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+        return [row[-1] for row in plan]
+    except sqlite3.Error:
+        return []
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Cursor that reports statement time and fetched rows to REGISTRY."""
+
+    _fp = None
+    _sql = None
+    _params = ()
+    _elapsed_ms = 0.0
+    _rows = 0
+    _logged = False
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._begin(sql, parameters, (time.perf_counter() - started) * 1000)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self._begin(sql, (), (time.perf_counter() - started) * 1000)
+
+    def fetchone(self):
+        started = time.perf_counter()
+        row = super().fetchone()
+        self._fetched((time.perf_counter() - started) * 1000, 0 if row is None else 1)
+        return row
+
+    def fetchmany(self, size=None):
+        started = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._fetched((time.perf_counter() - started) * 1000, len(rows))
+        return rows
+
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched((time.perf_counter() - started) * 1000, len(rows))
+        return rows
+
+    def _begin(self, sql, params, ms):
+        self._fp = fingerprint(sql)
+        self._sql, self._params = sql, params
+        self._elapsed_ms, self._rows, self._logged = ms, 0, False
+        REGISTRY.observe_query(self._fp, ms)
+        profiling.count("db", ms)
+        self._check_slow()
+
+    def _fetched(self, ms, rows):
+        if self._fp is None:
+            return
+        REGISTRY.observe_fetch(self._fp, self._elapsed_ms, ms, rows)
+        profiling.count("db", ms, calls=0)
+        self._elapsed_ms += ms
+        self._rows += rows
+        self._check_slow()
+
+    def _check_slow(self):
+        if not self._logged and self._elapsed_ms >= settings["slow_query_ms"]:
+            self._logged = True
+            REGISTRY.record_slow(self._fp, self._elapsed_ms, self._rows, _explain(self.connection, self._sql, self._params))
+
+class InstrumentedConnection(sqlite3.Connection):
+    """Connection whose cursors (including conn.execute shortcuts) are instrumented."""
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    # The C implementations of these shortcuts never call cursor(), so route them through it
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
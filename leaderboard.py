@@ -0,0 +1,183 @@
+# leaderboard.py
+# In-memory leaderboards over user_stats. Boards are loaded once per process
+# with a single query and then moved incrementally, so page views never run
+# ORDER BY on user_stats. complete_claim_and_award_points() moves its two users
+# at once; pickups in other processes bump the shared "stats" generation
+# (db.py), and the next reader moves the users with impact_events past the
+# last one seen. Profile edits and ledger rebuilds reload the boards.
+import bisect
+import threading
+from db import get_read_conn, get_generation
+
+METRICS = ("impact_points", "donations_made")
+ALL_USERS = "all"
+
+class Leaderboard:
+    """
+    Scores kept as a sorted list of (-score, user_id) plus a user -> score map.
+    rank() is a binary search, top(n) is a slice, and update() does one
+    binary search plus one list shift.
+    """
+
+    def __init__(self):
+        self._keys = []
+        self._scores = {}
+
+    def __len__(self):
+        return len(self._keys)
+
+    def update(self, user_id, score):
+        old = self._scores.get(user_id)
+        if old == score:
+            return
+        if old is not None:
+            del self._keys[bisect.bisect_left(self._keys, (-old, user_id))]
+        bisect.insort(self._keys, (-score, user_id))
+        self._scores[user_id] = score
+
+    def remove(self, user_id):
+        old = self._scores.pop(user_id, None)
+        if old is not None:
+            del self._keys[bisect.bisect_left(self._keys, (-old, user_id))]
+
+    def score(self, user_id):
+        return self._scores.get(user_id)
+
+    def rank(self, user_id):
+        """1-based rank; users with equal scores share a rank. None if not ranked."""
+        score = self._scores.get(user_id)
+        if score is None:
+            return None
+        return bisect.bisect_left(self._keys, (-score, float("-inf"))) + 1
+
+    def top(self, n):
+        """The n best (user_id, score) pairs, ties broken by user id."""
+        return [(user_id, -neg) for neg, user_id in self._keys[:n]]
+
+_lock = threading.Lock()
+_boards = None        # {(scope, metric): Leaderboard}
+_user_types = {}      # user_id -> scope the user is ranked under
+_loaded_generation = None  # ("users", "ledger_rebuild") generations the boards were built at
+_stats_generation = None
+_ledger_seen = 0           # highest impact_events.id applied to the boards
+
+def _board(boards, scope, metric):
+    key = (scope, metric)
+    if key not in boards:
+        boards[key] = Leaderboard()
+    return boards[key]
+
+def _place(boards, user_id, user_type, stats):
+    """Moves one user onto the boards for their current user type."""
+    old_type = _user_types.get(user_id)
+    if old_type is not None and old_type != user_type:
+        for metric in METRICS:
+            _board(boards, old_type, metric).remove(user_id)
+    for metric in METRICS:
+        _board(boards, ALL_USERS, metric).update(user_id, stats[metric])
+        if user_type:
+            _board(boards, user_type, metric).update(user_id, stats[metric])
+    _user_types[user_id] = user_type
+
+def _fetch(where="", params=()):
+    conn = get_read_conn(allow_snapshot=False)
+    cur = conn.cursor()
+    cur.execute(f"""
+        SELECT s.user_id, u.user_type, s.impact_points, s.donations_made
+        FROM user_stats s
+        JOIN users u ON u.id = s.user_id
+        {where}
+    """, params)
+    rows = cur.fetchall()
+    conn.close()
+    return rows
+
+def _last_ledger_id():
+    conn = get_read_conn(allow_snapshot=False)
+    last = conn.execute("SELECT COALESCE(MAX(id), 0) FROM impact_events").fetchone()[0]
+    conn.close()
+    return last
+
+def _ledger_users_since(event_id):
+    # (users with impact events after event_id, highest id among them)
+    conn = get_read_conn(allow_snapshot=False)
+    rows = conn.execute("SELECT id, user_id FROM impact_events WHERE id > ?", (event_id,)).fetchall()
+    conn.close()
+    return {row["user_id"] for row in rows}, max((row["id"] for row in rows), default=event_id)
+
+def _ensure_loaded():
+    """
+    Builds the boards on first use, and again after profile edits or a ledger
+    rebuild; after pickups in any process, moves just the users involved.
+    """
+    global _boards, _loaded_generation, _stats_generation, _ledger_seen
+    users, rebuilds, stats = get_generation("users", "ledger_rebuild", "stats")
+    if _boards is not None and _loaded_generation == (users, rebuilds) and _stats_generation == stats:
+        return _boards
+    with _lock:
+        if _boards is None or _loaded_generation != (users, rebuilds):
+            # Read the ledger position first: events after it are applied again, harmlessly
+            ledger_seen = _last_ledger_id()
+            boards = {}
+            _user_types.clear()
+            for row in _fetch():
+                _place(boards, row["user_id"], row["user_type"], row)
+            _boards, _ledger_seen = boards, ledger_seen
+            _loaded_generation, _stats_generation = (users, rebuilds), stats
+            return _boards
+        if _stats_generation == stats:
+            return _boards
+        user_ids, ledger_seen = _ledger_users_since(_ledger_seen)
+        _stats_generation = stats
+    refresh_users(user_ids)
+    with _lock:
+        _ledger_seen = max(_ledger_seen, ledger_seen)
+    return _boards
+
+def refresh_users(user_ids):
+    """Re-reads the given users' stats and moves them on the boards."""
+    if _boards is None:
+        return  # Nothing loaded yet; the first reader does a full load
+    user_ids = list(user_ids)
+    if not user_ids:
+        return
+    placeholders = ",".join("?" for _ in user_ids)
+    rows = _fetch(f"WHERE s.user_id IN ({placeholders})", user_ids)
+    with _lock:
+        for row in rows:
+            _place(_boards, row["user_id"], row["user_type"], row)
+
+def get_leaderboard(metric="impact_points", user_type=None, n=10):
+    """Top-n entries as dicts with rank, user_id, name and score."""
+    boards = _ensure_loaded()
+    board = boards.get((user_type or ALL_USERS, metric))
+    if not board:
+        return []
+    with _lock:
+        entries = board.top(n)
+        ranks = [board.rank(user_id) for user_id, _ in entries]
+    if not entries:
+        return []
+    names = _user_names([user_id for user_id, _ in entries])
+    return [
+        {"rank": rank, "user_id": user_id, "name": names.get(user_id) or "Anonymous", "score": score}
+        for (user_id, score), rank in zip(entries, ranks)
+    ]
+
+def get_user_rank(user_id, metric="impact_points", user_type=None):
+    """Returns (rank, board size), or (None, board size) if the user has no stats yet."""
+    boards = _ensure_loaded()
+    board = boards.get((user_type or ALL_USERS, metric))
+    if not board:
+        return None, 0
+    with _lock:
+        return board.rank(user_id), len(board)
+
+def _user_names(user_ids):
+    placeholders = ",".join("?" for _ in user_ids)
+    conn = get_read_conn()
+    cur = conn.cursor()
+    cur.execute(f"SELECT id, name FROM users WHERE id IN ({placeholders})", user_ids)
+    names = {row["id"]: row["name"] for row in cur.fetchall()}
+    conn.close()
+    return names
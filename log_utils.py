@@ -0,0 +1,118 @@
+# log_utils.py
+# Structured logging for the app. Loggers live under "foodcircle.*"; records go
+# through a QueueHandler so the request path only pays for a put_nowait(), and a
+# QueueListener thread formats them as JSON lines and writes them out.
+#
+# Settings (environment):
+#   FOOD_CIRCLE_LOG_LEVEL         DEBUG / INFO / WARNING / ERROR (default INFO)
+#   FOOD_CIRCLE_LOG_FILE          append JSON lines here instead of stderr
+#   FOOD_CIRCLE_LOG_DEBUG_SAMPLE  share of DEBUG records kept, 0..1 (default 0.01)
+import atexit
+import copy
+import datetime
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+
+ROOT_LOGGER = "foodcircle"
+QUEUE_SIZE = 10_000
+
+# Attributes every LogRecord has; anything else came in through extra= and is emitted as a field
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "taskName"}
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record: ts, level, logger, msg, then any extra= fields."""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+class SamplingFilter(logging.Filter):
+    """Keeps every record at INFO and above, and a random `rate` share of DEBUG records."""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG or self.rate >= 1:
+            return True
+        if random.random() < self.rate:
+            record.sample_rate = self.rate
+            return True
+        return False
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that never blocks: when the queue is full the record is counted and dropped."""
+
+    dropped = 0
+
+    def prepare(self, record):
+        # Resolve the message now (args may change later) but leave JSON formatting to the listener
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+            record.exc_text = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+_setup_lock = threading.Lock()
+_listener = None
+_queue_handler = None
+
+def _float_env(name, default):
+    try:
+        return min(max(float(os.environ.get(name, default)), 0.0), 1.0)
+    except ValueError:
+        return default
+
+def setup_logging():
+    """Installs the queue handler and starts the writer thread (once per process)."""
+    global _listener, _queue_handler
+    with _setup_lock:
+        if _listener is not None:
+            return
+        level = logging.getLevelName(os.environ.get("FOOD_CIRCLE_LOG_LEVEL", "INFO").upper())
+        path = os.environ.get("FOOD_CIRCLE_LOG_FILE")
+        target = logging.FileHandler(path, encoding="utf-8") if path else logging.StreamHandler(sys.stderr)
+        target.setFormatter(JsonFormatter())
+
+        _queue_handler = DroppingQueueHandler(queue.Queue(QUEUE_SIZE))
+        _queue_handler.addFilter(SamplingFilter(_float_env("FOOD_CIRCLE_LOG_DEBUG_SAMPLE", 0.01)))
+        root = logging.getLogger(ROOT_LOGGER)
+        root.setLevel(level if isinstance(level, int) else logging.INFO)
+        root.addHandler(_queue_handler)
+        root.propagate = False
+
+        _listener = logging.handlers.QueueListener(_queue_handler.queue, target, respect_handler_level=True)
+        _listener.start()
+        atexit.register(_listener.stop)  # flushes whatever is still queued
+
+def get_logger(name):
+    """Logger for a module, e.g. get_logger("db") -> "foodcircle.db"."""
+    setup_logging()
+    return logging.getLogger(f"{ROOT_LOGGER}.{name}")
+
+def dropped_count():
+    return _queue_handler.dropped if _queue_handler is not None else 0
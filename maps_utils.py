@@ -1,7 +1,12 @@
 # maps_utils.py
+import math
+import time
 import streamlit as st
-import requests
 from urllib.parse import urlencode
+import profiling
+
+# Grid size for geocells, in degrees (~5.5 km of latitude)
+GEOCELL_SIZE = 0.05
 
 def get_api_key():
     try:
@@ -14,7 +19,12 @@ def reverse_geocode(lat, lng):
     if not key:
         return None
     url = f"https://maps.googleapis.com/maps/api/geocode/json?latlng={lat},{lng}&key={key}"
-    r = requests.get(url, timeout=10)
+    import requests  # only needed once a location is detected; keeps it off cold start
+    started = time.perf_counter()
+    try:
+        r = requests.get(url, timeout=10)
+    finally:
+        profiling.count("http", (time.perf_counter() - started) * 1000)
     if r.ok:
         data = r.json()
         if data.get("results"):
@@ -36,3 +46,46 @@ def static_map_url(lat, lng, width=400, height=180, zoom=15):
 
 def directions_url(origin_lat, origin_lng, dest_lat, dest_lng):
     return f"https://www.google.com/maps/dir/?api=1&origin={origin_lat},{origin_lng}&destination={dest_lat},{dest_lng}&travelmode=driving"
+
+# Google Maps direction links accept at most this many intermediate stops
+MAX_WAYPOINTS = 9
+
+def route_directions_urls(points):
+    """
+    Google Maps links for driving through `points` [(lat, lng), ...] in order,
+    split into legs of up to MAX_WAYPOINTS stops (each leg starts where the last ended).
+    """
+    urls = []
+    step = MAX_WAYPOINTS + 1
+    for first in range(0, len(points) - 1, step):
+        leg = points[first:first + step + 1]
+        params = {
+            "api": 1,
+            "origin": f"{leg[0][0]:.6f},{leg[0][1]:.6f}",
+            "destination": f"{leg[-1][0]:.6f},{leg[-1][1]:.6f}",
+            "travelmode": "driving",
+        }
+        if len(leg) > 2:
+            params["waypoints"] = "|".join(f"{lat:.6f},{lng:.6f}" for lat, lng in leg[1:-1])
+        urls.append("https://www.google.com/maps/dir/?" + urlencode(params))
+    return urls
+
+def geocell(lat, lng, size=GEOCELL_SIZE):
+    """Snaps a coordinate to the south-west corner of its grid cell, e.g. "12.90,77.60"."""
+    if lat is None or lng is None:
+        return "unknown"
+    # Round before flooring so 77.6 / 0.05 lands in cell 1552, not 1551.999...
+    lat_cell = math.floor(round(float(lat) / size, 9))
+    lng_cell = math.floor(round(float(lng) / size, 9))
+    return f"{lat_cell * size:.2f},{lng_cell * size:.2f}"
+
+def cell_ring(lat, lng, ring, size=GEOCELL_SIZE):
+    """Geocells exactly `ring` cells away from the point's cell (ring 0 is the cell itself)."""
+    lat_cell = math.floor(round(float(lat) / size, 9))
+    lng_cell = math.floor(round(float(lng) / size, 9))
+    cells = []
+    for di in range(-ring, ring + 1):
+        for dj in range(-ring, ring + 1):
+            if max(abs(di), abs(dj)) == ring:
+                cells.append(f"{(lat_cell + di) * size:.2f},{(lng_cell + dj) * size:.2f}")
+    return cells
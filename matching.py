@@ -0,0 +1,180 @@
+# matching.py
+# Donor-side matching: when a listing is published, find recently active
+# receivers near it and send them a notification. Receivers are looked up in
+# receiver_activity by geocell, ring by ring outwards from the listing's cell,
+# until enough candidates are found, the search radius is exhausted or the
+# time budget runs out. `ngo_only` listings are matched to NGOs only, and NGOs
+# are preferred for bulk food in general.
+#
+# create_listing() calls enqueue_listing(); a single background worker does the
+# matching and writes all notifications for a listing in one batch.
+import datetime
+import queue
+import threading
+import time
+
+import numpy as np
+
+from db import get_read_conn, get_listing_by_id, get_setting, create_notifications_batch
+import shards
+from log_utils import get_logger
+from maps_utils import cell_ring, geocell
+from recommend import haversine_km
+
+log = get_logger("matching")
+
+ACTIVE_DAYS = 30               # receivers who claimed within this window are considered active
+MAX_RING = 4                   # rings of 0.05° cells searched, ~20 km at most
+ENOUGH_CANDIDATES = 200        # stop widening the search once this many are found
+MAX_CANDIDATES = 5_000         # hard cap per ring query
+NOTIFY_TOP_N = 20
+MAX_MATCH_NOTIFICATIONS_PER_DAY = 5
+DISTANCE_SCALE_KM = 5.0
+RECENCY_SCALE_DAYS = 7.0
+NGO_BOOST = 1.5                # NGOs first for "everyone" listings too; they can take bulk food
+MATCH_BUDGET_MS = float(get_setting("match_budget_ms", 250))
+
+def _ring_candidates(cur, cells, active_since, ngo_only):
+    placeholders = ",".join("?" * len(cells))
+    sql = f"""
+        SELECT user_id, user_type, lat, lng, last_active_at FROM receiver_activity
+        WHERE geocell IN ({placeholders}) AND last_active_at >= ?
+    """
+    if ngo_only:
+        sql += " AND user_type = 'NGO'"
+    cur.execute(sql + " LIMIT ?", (*cells, active_since, MAX_CANDIDATES))
+    return cur.fetchall()
+
+def match_receivers(listing, budget_ms=None, now=None):
+    """
+    Ranked [(user_id, score, distance_km)] of receivers to tell about `listing`,
+    best first. Stops widening the search when budget_ms is used up.
+    """
+    budget_ms = MATCH_BUDGET_MS if budget_ms is None else budget_ms
+    started = time.perf_counter()
+    if listing["lat"] is None or listing["lng"] is None:
+        return []
+    now = now or datetime.datetime.utcnow()
+    active_since = (now - datetime.timedelta(days=ACTIVE_DAYS)).strftime("%Y-%m-%d %H:%M:%S")
+    ngo_only = listing["visibility"] == "ngo_only"
+
+    conn = get_read_conn(allow_snapshot=False)
+    cur = conn.cursor()
+    candidates = []
+    rings = 0
+    for ring in range(MAX_RING + 1):
+        candidates.extend(_ring_candidates(cur, cell_ring(listing["lat"], listing["lng"], ring), active_since, ngo_only))
+        rings = ring + 1
+        if len(candidates) >= ENOUGH_CANDIDATES or (time.perf_counter() - started) * 1000 >= budget_ms:
+            break
+    conn.close()
+
+    candidates = [c for c in candidates if c["user_id"] != listing["donor_id"]]
+    if not candidates:
+        log.debug("No receivers to match", extra={"listing_id": listing["id"], "rings": rings})
+        return []
+
+    # Score the candidate set in one vectorized pass
+    distance_km = haversine_km(np.array([c["lat"] for c in candidates]), np.array([c["lng"] for c in candidates]),
+                               listing["lat"], listing["lng"])
+    last_active = np.array([c["last_active_at"] for c in candidates], dtype="datetime64[s]")
+    idle_days = (np.datetime64(now.replace(microsecond=0), "s") - last_active) / np.timedelta64(1, "D")
+    is_ngo = np.array([c["user_type"] == "NGO" for c in candidates])
+    scores = np.exp(-distance_km / DISTANCE_SCALE_KM) * np.exp(-np.maximum(idle_days, 0) / RECENCY_SCALE_DAYS)
+    scores = np.where(is_ngo, scores * NGO_BOOST, scores)
+
+    top = np.argsort(-scores, kind="stable")[:NOTIFY_TOP_N * 2]  # spare ones for users over their daily cap
+    elapsed = (time.perf_counter() - started) * 1000
+    log.debug("Matched listing", extra={
+        "listing_id": listing["id"], "candidates": len(candidates), "rings": rings, "elapsed_ms": round(elapsed, 2),
+    })
+    return [(candidates[i]["user_id"], float(scores[i]), float(distance_km[i])) for i in top]
+
+def _over_daily_cap(user_ids, now):
+    since = (now - datetime.timedelta(days=1)).strftime("%Y-%m-%d %H:%M:%S")
+    conn = get_read_conn(allow_snapshot=False)
+    cur = conn.cursor()
+    placeholders = ",".join("?" * len(user_ids))
+    cur.execute(f"""
+        SELECT user_id FROM notifications
+        WHERE type = 'match' AND created_at >= ? AND user_id IN ({placeholders})
+        GROUP BY user_id HAVING COUNT(*) >= ?
+    """, (since, *user_ids, MAX_MATCH_NOTIFICATIONS_PER_DAY))
+    capped = {row[0] for row in cur.fetchall()}
+    conn.close()
+    return capped
+
+def notify_matches(listing_id, budget_ms=None):
+    """Matches one listing and sends the notifications in one batch. Returns how many were sent."""
+    listing = get_listing_by_id(listing_id)
+    if listing is None or listing["status"] != "AVAILABLE":
+        return 0
+    now = datetime.datetime.utcnow()
+    matches = match_receivers(listing, budget_ms, now)
+    if not matches:
+        return 0
+    capped = _over_daily_cap([user_id for user_id, _, _ in matches], now)
+    title = listing["title"] or "Food available"
+    batch = [
+        {
+            "user_id": user_id,
+            "type": "match",
+            "title": "New food near you",
+            "message": f"**{title}** is available {distance:.1f} km from your last pickup.",
+            "related_listing_id": listing_id,
+            "related_user_id": listing["donor_id"],
+        }
+        for user_id, _, distance in matches if user_id not in capped
+    ][:NOTIFY_TOP_N]
+    return create_notifications_batch(batch)
+
+# --- Background worker ---
+
+_queue = queue.Queue()
+_worker = None
+_worker_lock = threading.Lock()
+
+def _work():
+    while True:
+        listing_id = _queue.get()
+        try:
+            notify_matches(listing_id)
+        except Exception:
+            log.exception("Matching failed", extra={"listing_id": listing_id})
+        finally:
+            _queue.task_done()
+
+def enqueue_listing(listing_id):
+    """Queues a freshly created listing for matching (non-blocking)."""
+    global _worker
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_work, name="listing-matcher", daemon=True)
+            _worker.start()
+    _queue.put(listing_id)
+
+def drain():
+    """Blocks until every queued listing has been matched (scripts and benchmarks)."""
+    _queue.join()
+
+def backfill_receiver_activity():
+    """Rebuilds receiver_activity from each receiver's latest claim. Offline use only."""
+    conn = shards.connect_all()
+    conn.create_function("geocell", 2, geocell, deterministic=True)
+    cur = conn.cursor()
+    cur.execute("DELETE FROM receiver_activity")
+    # SQLite returns the other columns from the row that holds MAX(reserved_ts)
+    cur.execute("""
+        INSERT INTO receiver_activity (user_id, user_type, lat, lng, geocell, last_active_at, claims)
+        SELECT c.receiver_id, u.user_type, l.lat, l.lng, geocell(l.lat, l.lng),
+               datetime(MAX(c.reserved_ts), 'unixepoch'), COUNT(*)
+        FROM all_claims c
+        JOIN all_listings l ON l.id = c.listing_id
+        JOIN users u ON u.id = c.receiver_id
+        WHERE l.lat IS NOT NULL AND l.lng IS NOT NULL
+        GROUP BY c.receiver_id
+    """)
+    count = cur.rowcount
+    conn.commit()
+    conn.close()
+    return count
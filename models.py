@@ -0,0 +1,154 @@
+# models.py
+# Compact typed rows for the read paths that return many of them: the listing
+# feeds, My Listings / My Claims, the notification inbox and reviews. A record
+# keeps its values in __slots__ (no per-row dict) and reads like the
+# sqlite3.Row / dict it replaces, so pages keep using row["title"] and
+# row.get("notes"):
+#
+#   Listing.columns("l")       the projection for a query ("l.id, l.donor_id, ...")
+#   Listing.fetchall(cur)      the cursor's rows as Listings (the row factory)
+#   listing.copy(score=0.8)    a copy with computed fields set
+#   dict(listing)              the columns that were selected, e.g. for JSON
+#
+# Only the columns a page or the API shows are selected (FIELDS); slots a query
+# did not fill are missing, as the key would be from the dict. Records pickle,
+# so st.cache_data can store them.
+
+_layouts = {}
+
+def _restore(cls, names, values):
+    return cls.from_rows([values], names)[0]
+
+class Record:
+    __slots__ = ()
+    FIELDS = ()  # selected columns, in SELECT order
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._names = frozenset(cls.__slots__)
+
+    @classmethod
+    def columns(cls, table=None):
+        """FIELDS as a SELECT list, qualified with `table` if given."""
+        return ", ".join(f"{table}.{name}" if table else name for name in cls.FIELDS)
+
+    @classmethod
+    def from_rows(cls, rows, names):
+        """Records from result rows (tuples or sqlite3.Row) whose columns are `names`."""
+        new = cls.__new__
+        records = []
+        if all(name in cls._names for name in names):
+            for row in rows:
+                record = new(cls)
+                for name, value in zip(names, row):
+                    setattr(record, name, value)
+                records.append(record)
+            return records
+        # Extra columns (the inbox's unread_count) are left out
+        fields = [(i, name) for i, name in enumerate(names) if name in cls._names]
+        for row in rows:
+            record = new(cls)
+            for i, name in fields:
+                setattr(record, name, row[i])
+            records.append(record)
+        return records
+
+    @classmethod
+    def fetchall(cls, cur):
+        """The rest of the cursor's rows as records."""
+        cur.row_factory = None  # plain tuples; no sqlite3.Row is built per row
+        return cls.from_rows(cur.fetchall(), [d[0] for d in cur.description])
+
+    @classmethod
+    def fetchone(cls, cur):
+        """The cursor's next row as a record, or None."""
+        row = cur.fetchone()
+        return None if row is None else cls.from_rows([row], [d[0] for d in cur.description])[0]
+
+    def __getitem__(self, key):
+        if key not in self._names:
+            raise KeyError(key)
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __setitem__(self, key, value):
+        if key not in self._names:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        return key in self._names and hasattr(self, key)
+
+    def keys(self):
+        return [name for name in self.__slots__ if hasattr(self, name)]
+
+    def copy(self, **changes):
+        record = self.__class__.__new__(self.__class__)
+        for name in self.keys():
+            setattr(record, name, getattr(self, name))
+        for name, value in changes.items():
+            record[name] = value
+        return record
+
+    def __reduce__(self):
+        # Pickled as the column names plus a tuple of values; the names tuple is
+        # shared, so a cached list of records stores each layout once
+        names = tuple(self.keys())
+        return _restore, (self.__class__, _layouts.setdefault(names, names), tuple(getattr(self, n) for n in names))
+
+    def __repr__(self):
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.keys()[:3])
+        return f"{self.__class__.__name__}({fields}, ...)"
+
+# What listing cards, matching, urgency and the API read; prepared/packaged
+# times and updated_at stay in the table
+LISTING_FIELDS = (
+    "id", "donor_id", "title", "notes", "food_type", "veg", "cuisine", "quantity",
+    "quantity_total", "quantity_remaining", "quantity_unit", "photo_path", "visibility",
+    "lat", "lng", "address_text", "status", "created_at", "created_ts", "expiry_at", "expiry_ts",
+)
+
+class Listing(Record):
+    FIELDS = LISTING_FIELDS
+    __slots__ = LISTING_FIELDS + (
+        # My Listings: the claim joined to the listing, if any
+        "claim_id", "receiver_id", "claim_status", "claim_quantity", "receiver_name",
+        # Computed by recommend.py, get_nearby_listings and urgency.py
+        "score", "distance_km", "hours_left",
+    )
+
+CLAIM_FIELDS = (
+    "id", "listing_id", "receiver_id", "status", "quantity", "reserved_at", "reserved_ts",
+    "expires_at", "completed_at",
+)
+
+class Claim(Record):
+    FIELDS = CLAIM_FIELDS
+    __slots__ = CLAIM_FIELDS + (
+        # Listing details for My Claims and the pickup route (routing.claim_deadline)
+        "claim_status", "title", "address_text", "lat", "lng", "donor_id", "expiry_at",
+        "food_type", "quantity_unit", "listing_created_at", "donor_name",
+    )
+
+NOTIFICATION_FIELDS = (
+    "id", "user_id", "type", "title", "message", "related_listing_id", "related_user_id",
+    "related_user_name", "listing_title", "is_read", "created_at",
+)
+
+class Notification(Record):
+    FIELDS = NOTIFICATION_FIELDS
+    __slots__ = NOTIFICATION_FIELDS
+
+REVIEW_FIELDS = ("id", "claim_id", "reviewer_id", "reviewee_id", "rating", "comment", "created_at")
+
+class Review(Record):
+    FIELDS = REVIEW_FIELDS
+    __slots__ = REVIEW_FIELDS + ("reviewer_name",)
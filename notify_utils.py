@@ -0,0 +1,48 @@
+# notify_utils.py
+# Donor-side messages for new claims, shared by the Streamlit pages and the
+# JSON API (api.py).
+from auth import get_user_by_id
+from db import create_notifications_batch
+from email_utils import send_email
+
+def claimed_label(outcome):
+    title = f"'{outcome['title'] or 'Food'}'"
+    return f"{outcome['quantity']} {outcome['unit']} of {title}" if outcome.get("quantity") else title
+
+def notify_donors_of_claims(outcomes, receiver):
+    """
+    One notification and one email per donor, listing everything reserved from
+    them. outcomes are batch_claim_listings() outcome dicts; receiver is the
+    claiming user's row as a dict. Returns the number of donors notified.
+    """
+    by_donor = {}
+    for outcome in outcomes:
+        if outcome["status"] == "reserved":
+            by_donor.setdefault(outcome["donor_id"], []).append(outcome)
+    receiver_name = receiver.get("name", "Someone")
+    phone_link_html = f'<a href="tel:{receiver["phone"]}">{receiver["phone"]}</a>' if receiver.get("phone") else "Not provided"
+    batch = []
+    for donor_id, reserved in by_donor.items():
+        titles = ", ".join(claimed_label(o) for o in reserved)
+        batch.append({
+            "user_id": donor_id,
+            "type": "claim",
+            "title": "Your food has been claimed!" if len(reserved) == 1 else f"{len(reserved)} of your listings were claimed!",
+            "message": f"{receiver_name} wants to take your food: {titles}. You can contact them at: {phone_link_html}",
+            "related_listing_id": reserved[0]["listing_id"],
+            "related_user_id": receiver["id"],
+        })
+    create_notifications_batch(batch)
+
+    for donor_id, reserved in by_donor.items():
+        donor = get_user_by_id(donor_id)
+        if donor and donor["email"]:
+            message = (
+                f"{len(reserved)} of your food listings were claimed!\n\n"
+                + "".join(f"- {claimed_label(o)}\n" for o in reserved)
+                + f"\nReceiver Name: {receiver.get('name', 'Unknown')}\n"
+                f"Receiver Email: {receiver.get('email', 'Unknown')}\n"
+                f"Receiver Phone: {receiver.get('phone', 'Unknown')}\n"
+            )
+            send_email(donor["email"], "Your food has been claimed", message)
+    return len(by_donor)
@@ -0,0 +1,149 @@
+# profiling.py
+# Rerun profiler for the Streamlit app. When enabled, each script run gets a
+# root span. Page functions, startup work and external calls open child spans,
+# and every DB statement / HTTP request is counted on the innermost open span.
+# Finished runs are kept in memory for the admin diagnostics panel and can be
+# dumped in the folded-stack format used by flamegraph.pl and speedscope.
+import contextlib
+import contextvars
+import functools
+import os
+import threading
+import time
+from collections import deque
+
+RECENT_SIZE = 50
+
+# Switched on with FOOD_CIRCLE_PROFILE_RERUNS=1 or from the admin diagnostics panel
+enabled = os.environ.get("FOOD_CIRCLE_PROFILE_RERUNS", "").lower() in ("1", "true", "yes", "on")
+_recent = deque(maxlen=RECENT_SIZE)
+_recent_lock = threading.Lock()
+_current = contextvars.ContextVar("profiling_span", default=None)
+
+class Span:
+    __slots__ = ("name", "parent", "children", "started", "duration_ms", "calls", "call_ms")
+
+    def __init__(self, name, parent=None):
+        self.name = name
+        self.parent = parent
+        self.children = []
+        self.started = time.perf_counter()
+        self.duration_ms = None
+        self.calls = {}      # kind -> count, e.g. {"db": 12, "http": 1}
+        self.call_ms = {}    # kind -> total milliseconds
+
+    def close(self):
+        if self.duration_ms is None:
+            self.duration_ms = (time.perf_counter() - self.started) * 1000
+
+    def self_ms(self):
+        return max(self.duration_ms - sum(child.duration_ms or 0 for child in self.children), 0.0)
+
+    def total_calls(self, kind):
+        return self.calls.get(kind, 0) + sum(child.total_calls(kind) for child in self.children)
+
+    def as_dict(self):
+        return {
+            "name": self.name,
+            "duration_ms": round(self.duration_ms or 0, 3),
+            "calls": dict(self.calls),
+            "call_ms": {kind: round(ms, 3) for kind, ms in self.call_ms.items()},
+            "children": [child.as_dict() for child in self.children],
+        }
+
+def start_rerun(name):
+    """Opens the root span for this script run (no-op unless profiling is enabled)."""
+    if not enabled:
+        return
+    previous = _current.get()
+    if previous is not None:
+        # The last run in this thread ended via st.stop()/st.rerun() before finish_rerun()
+        _finish(_root(previous), interrupted=True)
+    _current.set(Span(f"rerun:{name}"))
+
+def finish_rerun():
+    span = _current.get()
+    if span is not None:
+        _finish(_root(span))
+
+def _root(span):
+    while span.parent is not None:
+        span = span.parent
+    return span
+
+def _finish(root, interrupted=False):
+    if interrupted:
+        # Don't count the idle time until the next run; end where the last child ended
+        ends = [child.started + (child.duration_ms or 0) / 1000 for child in root.children]
+        root.duration_ms = ((max(ends) if ends else root.started) - root.started) * 1000
+        root.name += " (interrupted)"
+    root.close()
+    _current.set(None)
+    with _recent_lock:
+        _recent.append(root)
+
+@contextlib.contextmanager
+def span(name):
+    """Times a block as a child of the current span. Free when no run is being profiled."""
+    parent = _current.get()
+    if parent is None:
+        yield
+        return
+    child = Span(name, parent)
+    parent.children.append(child)
+    token = _current.set(child)
+    try:
+        yield
+    finally:
+        child.close()
+        _current.reset(token)
+
+def profiled(name=None):
+    """Decorator form of span(), used on the page functions."""
+    def decorate(fn):
+        label = name or fn.__name__
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(label):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def count(kind, ms=0.0, calls=1):
+    """Counts an external call (e.g. "db", "http") and its time on the innermost open span."""
+    current = _current.get()
+    if current is not None:
+        current.calls[kind] = current.calls.get(kind, 0) + calls
+        current.call_ms[kind] = current.call_ms.get(kind, 0.0) + ms
+
+def recent_profiles():
+    with _recent_lock:
+        return list(_recent)
+
+def render_tree(root):
+    """Indented text view of a span tree."""
+    lines = []
+    def walk(span, depth):
+        calls = ", ".join(f"{kind}×{n} ({span.call_ms[kind]:.1f} ms)" for kind, n in span.calls.items())
+        lines.append(f"{'  ' * depth}{span.name}  {span.duration_ms:.1f} ms" + (f"  [{calls}]" if calls else ""))
+        for child in span.children:
+            walk(child, depth + 1)
+    walk(root, 0)
+    return "\n".join(lines)
+
+def to_folded(roots):
+    """Folded stacks ("a;b;c <microseconds>"), one line per span, from self time."""
+    totals = {}
+    def walk(span, stack):
+        path = f"{stack};{span.name}" if stack else span.name
+        for kind, ms in span.call_ms.items():
+            # External call time shows up as a leaf under the span that made the calls
+            if ms:
+                totals[f"{path};{kind}"] = totals.get(f"{path};{kind}", 0) + ms
+        own = span.self_ms() - sum(span.call_ms.values())
+        totals[path] = totals.get(path, 0) + max(own, 0.0)
+        for child in span.children:
+            walk(child, path)
+    for root in roots:
+        walk(root, "")
+    return "\n".join(f"{path} {int(ms * 1000)}" for path, ms in totals.items() if ms > 0) + "\n"
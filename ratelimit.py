@@ -0,0 +1,105 @@
+# ratelimit.py
+# Token-bucket throttles for the abuse-prone paths: login (each attempt costs
+# a bcrypt verification), registration, claiming, listing creation and
+# exports (each one reads a user's whole history, see exports.py). Every
+# (action, key) pair has its own bucket, e.g. ("login", "email:a@b.c") and
+# ("login", "ip:1.2.3.4"); a request goes through only if all of its buckets
+# have a token. Checks are O(1): buckets refill lazily from the time elapsed
+# since they were last touched.
+#
+# Buckets live in process memory by default, least recently used first: past
+# MAX_BUCKETS the oldest is dropped, so checks stay O(1) even when someone
+# sprays distinct emails or addresses. With rate_limit_store = "sqlite" they
+# are kept in the rate_limits table instead, so limits hold across restarts
+# and across processes (the Streamlit app and api.py), at the cost of one
+# small transaction per check. Both stores charge a request only if every one
+# of its buckets has room, and a cost above a bucket's capacity (a batch
+# claim of more listings than the claim burst) is charged as a full bucket.
+import collections
+import math
+import threading
+import time
+
+from db import get_setting, take_rate_limit_tokens
+from log_utils import get_logger
+
+log = get_logger("ratelimit")
+
+# action -> {key kind: (capacity, period_seconds)}: up to `capacity` requests
+# in a burst, refilled evenly over `period_seconds`
+RULES = {
+    "login": {"email": (5, 300), "ip": (20, 300)},
+    "register": {"ip": (5, 3600)},
+    "claim": {"user": (10, 60), "ip": (30, 60)},
+    "create_listing": {"user": (20, 3600), "ip": (60, 3600)},
+    "export": {"user": (10, 3600), "ip": (30, 3600)},
+}
+RATE_LIMIT_STORE = str(get_setting("rate_limit_store", "memory")).lower()
+ENABLED = str(get_setting("rate_limits", True)).lower() not in ("0", "false", "no", "off")
+MAX_BUCKETS = 100_000  # memory store: least recently used buckets are dropped beyond this
+
+_lock = threading.Lock()
+# "action:kind:value" -> (tokens, updated_at, capacity, refill per second), least recently used first
+_buckets = collections.OrderedDict()
+
+def _bucket_keys(action, keys, cost):
+    rules = RULES[action]
+    for kind, value in keys.items():
+        if value is None or value == "":
+            continue  # e.g. no client address behind some proxies
+        if kind not in rules:
+            raise ValueError(f"no {kind!r} rule for {action!r}")
+        capacity, period = rules[kind]
+        # A bucket can never hold more than its capacity, so a larger cost would never pass
+        yield f"{action}:{kind}:{str(value).lower()}", capacity, capacity / period, min(cost, capacity)
+
+def _check_memory(buckets, now):
+    with _lock:
+        refilled = []
+        for key, capacity, rate, cost in buckets:
+            tokens, updated, _, _ = _buckets.get(key, (capacity, now, capacity, rate))
+            refilled.append(min(capacity, tokens + (now - updated) * rate))
+        short = [(cost - tokens) / rate for tokens, (_, _, rate, cost) in zip(refilled, buckets) if tokens < cost]
+        if short:
+            return max(short)
+        # All buckets have room: take from every one of them
+        for tokens, (key, capacity, rate, cost) in zip(refilled, buckets):
+            _buckets[key] = (tokens - cost, now, capacity, rate)
+            _buckets.move_to_end(key)
+        while len(_buckets) > MAX_BUCKETS:
+            _buckets.popitem(last=False)
+        return None
+
+def _check_sqlite(buckets, now):
+    return take_rate_limit_tokens(buckets, now)
+
+def check(action, cost=1, **keys):
+    """
+    Takes `cost` tokens from the action's bucket for each key given
+    (user=..., email=..., ip=...). Returns None if the request may go ahead,
+    otherwise the number of seconds until it would be allowed.
+    """
+    if not ENABLED:
+        return None
+    buckets = list(_bucket_keys(action, keys, cost))
+    if not buckets:
+        return None
+    now = time.time()
+    check_store = _check_sqlite if RATE_LIMIT_STORE == "sqlite" else _check_memory
+    retry_after = check_store(buckets, now)
+    if retry_after:
+        log.warning("Rate limited", extra={"action": action, "keys": sorted(keys), "retry_after": round(retry_after, 1)})
+    return retry_after
+
+def describe(retry_after):
+    """User-facing wait, e.g. "12 seconds" or "4 minutes"."""
+    seconds = max(1, math.ceil(retry_after))
+    if seconds < 120:
+        return f"{seconds} seconds"
+    return f"{math.ceil(seconds / 60)} minutes"
+
+def reset(action=None):
+    """Forgets in-memory buckets (all, or one action's). Tests and admin use."""
+    with _lock:
+        for key in [k for k in _buckets if action is None or k.startswith(f"{action}:")]:
+            del _buckets[key]
@@ -0,0 +1,15 @@
+# rebuild_stats.py
+# Rebuilds user_stats and user_badges from the impact ledger.
+# Run after changing IMPACT_RULES in db.py:  python rebuild_stats.py
+import time
+from db import create_gamification_tables_if_not_exists, backfill_impact_ledger, rebuild_stats_from_ledger
+
+create_gamification_tables_if_not_exists()
+
+started = time.perf_counter()
+added = backfill_impact_ledger()
+if added:
+    print(f"Backfilled {added} ledger events from completed claims")
+
+users = rebuild_stats_from_ledger()
+print(f"Rebuilt stats and badges for {users} users in {time.perf_counter() - started:.2f}s")
@@ -0,0 +1,118 @@
+# recommend.py
+# Per-receiver ranking of available listings. Every candidate gets a score in
+# [0, 1] from four signals, computed as NumPy arrays over the whole candidate
+# set at once:
+#   distance  - closeness to the receiver (detected location, else the centroid
+#               of their past pickups)
+#   urgency   - how soon the food expires, so perishable items get claimed first
+#   veg       - agreement with the share of veg food in the receiver's claims
+#   history   - cuisines and donors the receiver has claimed from before
+# A signal with no data for a receiver (no location, no claims) is neutral (0.5).
+import datetime
+import math
+import numpy as np
+from maps_utils import geocell
+
+WEIGHTS = {"distance": 0.40, "urgency": 0.30, "veg": 0.15, "history": 0.15}
+DISTANCE_SCALE_KM = 5.0      # score falls to 1/e at this distance
+URGENCY_SCALE_HOURS = 24.0   # score falls to 1/e with this much time left
+COOKED_SHELF_HOURS = 12.0    # cooked food without an expiry date is assumed good this long after posting
+EARTH_RADIUS_KM = 6371.0
+NEUTRAL = 0.5
+HOME_CELL_DEG = 0.5           # coarse cell (~55 km) used to find a receiver's home area
+
+def haversine_km(lat, lng, lat0, lng0):
+    """Great-circle distance from (lat0, lng0) to each point of the lat/lng arrays."""
+    lat, lng = np.radians(lat), np.radians(lng)
+    lat0, lng0 = math.radians(lat0), math.radians(lng0)
+    a = np.sin((lat - lat0) / 2) ** 2 + math.cos(lat0) * np.cos(lat) * np.sin((lng - lng0) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+def _floats(values):
+    return np.array([np.nan if v is None else float(v) for v in values], dtype=float)
+
+def build_profile(history):
+    """Summarizes claim history rows (lat, lng, veg, cuisine, donor_id) into the inputs the scorer needs."""
+    history = [dict(row) for row in history]
+    if not history:
+        return {"claims": 0, "centroid": None, "veg_share": None, "cuisines": {}, "donors": {}}
+    # Home area: the centroid of the pickups in the receiver's most common coarse cell,
+    # so a few claims in another city don't drag the centre somewhere in between
+    cells = {}
+    for r in history:
+        if r["lat"] is not None and r["lng"] is not None:
+            cells.setdefault(geocell(r["lat"], r["lng"], HOME_CELL_DEG), []).append((r["lat"], r["lng"]))
+    home = max(cells.values(), key=len) if cells else None
+    cuisines, donors = {}, {}
+    for r in history:
+        if r["cuisine"]:
+            cuisines[r["cuisine"]] = cuisines.get(r["cuisine"], 0) + 1
+        donors[r["donor_id"]] = donors.get(r["donor_id"], 0) + 1
+    n = len(history)
+    return {
+        "claims": n,
+        "centroid": tuple(float(x) for x in np.mean(home, axis=0)) if home else None,
+        "veg_share": sum(1 for r in history if r["veg"]) / n,
+        "cuisines": {c: k / n for c, k in cuisines.items()},
+        "donors": {d: k / n for d, k in donors.items()},
+    }
+
+def score_listings(listings, profile, origin=None, now=None):
+    """
+    Returns (scores, distance_km, hours_left) arrays aligned with `listings`.
+    origin is the receiver's (lat, lng); falls back to the profile centroid.
+    """
+    n = len(listings)
+    if n == 0:
+        return np.zeros(0), np.zeros(0), np.zeros(0)
+    now = (now or datetime.datetime.utcnow()).replace(tzinfo=datetime.timezone.utc).timestamp()
+    origin = origin or profile["centroid"]
+
+    # Distance
+    distance_km = np.full(n, np.nan)
+    if origin is not None:
+        distance_km = haversine_km(_floats(l.get("lat") for l in listings), _floats(l.get("lng") for l in listings), *origin)
+    distance = np.where(np.isnan(distance_km), NEUTRAL, np.exp(-distance_km / DISTANCE_SCALE_KM))
+
+    # Urgency: expiry_ts already holds the end of a bare expiry date (db.to_epoch)
+    expiry = _floats(l.get("expiry_ts") for l in listings)
+    cooked_until = _floats(l.get("created_ts") for l in listings) + COOKED_SHELF_HOURS * 3600
+    is_cooked = np.array([l.get("food_type") == "cooked" for l in listings])
+    deadline = np.where(np.isnan(expiry) & is_cooked, cooked_until, expiry)
+    hours_left = (deadline - now) / 3600
+    # Past its deadline (or no deadline at all) earns no urgency boost
+    urgency = np.where(hours_left > 0, np.exp(-np.where(hours_left > 0, hours_left, 0.0) / URGENCY_SCALE_HOURS), 0.0)
+
+    # Veg preference
+    if profile["veg_share"] is None:
+        veg = np.full(n, NEUTRAL)
+    else:
+        is_veg = np.array([bool(l.get("veg")) for l in listings], dtype=float)
+        veg = is_veg * profile["veg_share"] + (1 - is_veg) * (1 - profile["veg_share"])
+
+    # Past claims: share of claims with the same cuisine / from the same donor
+    if profile["claims"]:
+        cuisine = np.array([profile["cuisines"].get(l.get("cuisine"), 0.0) for l in listings])
+        donor = np.array([profile["donors"].get(l.get("donor_id"), 0.0) for l in listings])
+        history = np.minimum(1.0, 0.7 * cuisine / max(profile["cuisines"].values(), default=1) + 0.3 * np.sqrt(donor))
+    else:
+        history = np.full(n, NEUTRAL)
+
+    scores = (WEIGHTS["distance"] * distance + WEIGHTS["urgency"] * urgency
+              + WEIGHTS["veg"] * veg + WEIGHTS["history"] * history)
+    return scores, distance_km, hours_left
+
+def rank_listings(listings, history, origin=None, now=None):
+    """Listings (models.Listing) sorted best-first, each a copy with score, distance_km and hours_left set."""
+    listings = [l.copy() for l in listings]
+    scores, distance_km, hours_left = score_listings(listings, build_profile(history), origin, now)
+    # Stable sort on -score keeps the newest-first order among ties
+    order = np.argsort(-scores, kind="stable")
+    ranked = []
+    for i in order:
+        item = listings[i]
+        item["score"] = round(float(scores[i]), 4)
+        item["distance_km"] = None if np.isnan(distance_km[i]) else round(float(distance_km[i]), 2)
+        item["hours_left"] = None if np.isnan(hours_left[i]) else round(float(hours_left[i]), 1)
+        ranked.append(item)
+    return ranked
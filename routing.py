@@ -0,0 +1,164 @@
+# routing.py
+# Multi-stop pickup planning for NGOs collecting several reserved claims in
+# one trip. Runs locally, no directions API: haversine distances, an assumed
+# average city speed, and a fixed handling time per stop.
+#
+# 1. Construction: nearest neighbour from the depot, except that a stop close
+#    to its deadline (but still reachable in time) is taken first.
+# 2. Improvement: 2-opt over the route. A segment reversal is kept only if it
+#    shortens the route without adding lateness.
+import datetime
+import time
+
+import numpy as np
+
+from recommend import EARTH_RADIUS_KM, COOKED_SHELF_HOURS
+
+AVG_SPEED_KMH = 20.0           # city driving incl. traffic
+SERVICE_MINUTES = 5.0          # loading time at each pickup
+URGENT_SLACK_MINUTES = 30.0    # stops with less slack than this jump the nearest-neighbour queue
+MAX_IMPROVE_MS = 2_000         # time cap for the 2-opt phase
+EPSILON = 1e-9
+
+def distance_matrix(lat, lng):
+    """Pairwise haversine distances (km) between all points."""
+    lat, lng = np.radians(np.asarray(lat, dtype=float)), np.radians(np.asarray(lng, dtype=float))
+    dlat = lat[:, None] - lat[None, :]
+    dlng = lng[:, None] - lng[None, :]
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat)[:, None] * np.cos(lat)[None, :] * np.sin(dlng / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+def _to_datetime(value):
+    if not value:
+        return None
+    if isinstance(value, datetime.datetime):
+        return value
+    text = str(value).replace("T", " ")
+    try:
+        return datetime.datetime.strptime(text[:19], "%Y-%m-%d %H:%M:%S")
+    except ValueError:
+        # Date-only expiry: good until the end of that day
+        return datetime.datetime.strptime(text[:10], "%Y-%m-%d") + datetime.timedelta(days=1)
+
+def claim_deadline(claim):
+    """Earliest of the reservation hold (claims.expires_at) and the food's own expiry."""
+    candidates = [_to_datetime(claim.get("expires_at")), _to_datetime(claim.get("expiry_at"))]
+    if claim.get("food_type") == "cooked" and not claim.get("expiry_at") and claim.get("listing_created_at"):
+        candidates.append(_to_datetime(claim["listing_created_at"]) + datetime.timedelta(hours=COOKED_SHELF_HOURS))
+    candidates = [c for c in candidates if c is not None]
+    return min(candidates) if candidates else None
+
+class _Problem:
+    """Node 0 is the depot; nodes 1..n are the stops. Times are minutes from departure."""
+
+    def __init__(self, depot, stops, start, return_to_depot, speed_kmh, service_minutes):
+        self.n = len(stops)
+        self.return_to_depot = return_to_depot
+        lat = [depot[0]] + [s["lat"] for s in stops]
+        lng = [depot[1]] + [s["lng"] for s in stops]
+        self.dist = distance_matrix(lat, lng)
+        self.minutes_per_km = 60.0 / speed_kmh
+        self.service = service_minutes
+        self.deadline = np.full(self.n + 1, np.inf)
+        for i, stop in enumerate(stops, 1):
+            if stop.get("deadline") is not None:
+                self.deadline[i] = (stop["deadline"] - start).total_seconds() / 60.0
+
+    def tour(self, order):
+        """Full node sequence for a stop order (depot first, and last when returning)."""
+        return np.concatenate(([0], order, [0])) if self.return_to_depot else np.concatenate(([0], order))
+
+    def arrivals(self, order):
+        tour = self.tour(order)
+        legs = self.dist[tour[:-1], tour[1:]] * self.minutes_per_km
+        # Service time is spent at every stop before driving on
+        return np.cumsum(legs + np.r_[0.0, np.full(len(legs) - 1, self.service)])
+
+    def lateness(self, order):
+        arrive = self.arrivals(order)[: len(order)]
+        return float(np.maximum(arrive - self.deadline[order], 0.0).sum())
+
+    def length(self, order):
+        tour = self.tour(order)
+        return float(self.dist[tour[:-1], tour[1:]].sum())
+
+def _construct(p):
+    """Nearest neighbour from the depot; urgent stops (little slack left) go first."""
+    remaining = set(range(1, p.n + 1))
+    order = []
+    current, clock = 0, 0.0
+    while remaining:
+        candidates = np.fromiter(remaining, dtype=int)
+        arrive = clock + p.dist[current, candidates] * p.minutes_per_km
+        slack = p.deadline[candidates] - arrive
+        # Only stops that can still be saved jump the queue; chasing lost ones makes everything later
+        urgent = (slack >= 0) & (slack < URGENT_SLACK_MINUTES)
+        if urgent.any():
+            pick = candidates[urgent][np.argmin(p.deadline[candidates[urgent]])]
+        else:
+            pick = candidates[np.argmin(p.dist[current, candidates])]
+        clock += p.dist[current, pick] * p.minutes_per_km + p.service
+        order.append(pick)
+        remaining.remove(pick)
+        current = pick
+    return np.array(order, dtype=int)
+
+def _two_opt(p, order, max_ms):
+    """First-improvement 2-opt; each pass scans every i and evaluates all j at once with NumPy."""
+    started = time.perf_counter()
+    tour = p.tour(order)
+    lateness = p.lateness(order)
+    last = len(order)               # tour positions 1..last are stops
+    improved = True
+    while improved and (time.perf_counter() - started) * 1000 < max_ms:
+        improved = False
+        for i in range(1, last):
+            # Reverse tour[i..j]: edges (a,b) and (c,d) become (a,c) and (b,d)
+            j = np.arange(i + 1, last + 1)
+            a, b = tour[i - 1], tour[i]
+            c = tour[j]
+            has_next = j + 1 < len(tour)
+            d = np.where(has_next, tour[np.minimum(j + 1, len(tour) - 1)], 0)
+            after = np.where(has_next, p.dist[b, d], 0.0)
+            before = np.where(has_next, p.dist[c, d], 0.0)
+            delta = p.dist[a, c] + after - p.dist[a, b] - before
+            for k in np.flatnonzero(delta < -EPSILON)[np.argsort(delta[delta < -EPSILON])]:
+                candidate = tour.copy()
+                candidate[i:j[k] + 1] = candidate[i:j[k] + 1][::-1]
+                new_lateness = p.lateness(candidate[1:last + 1])
+                if new_lateness <= lateness + EPSILON:
+                    tour, lateness, improved = candidate, new_lateness, True
+                    break
+            if (time.perf_counter() - started) * 1000 >= max_ms:
+                break
+    return tour[1:last + 1]
+
+def plan_route(depot, stops, start=None, return_to_depot=True, speed_kmh=AVG_SPEED_KMH,
+               service_minutes=SERVICE_MINUTES, improve=True, max_improve_ms=MAX_IMPROVE_MS):
+    """
+    Orders stops (dicts with lat, lng and optionally a datetime `deadline`) for a
+    trip starting at depot=(lat, lng). Returns the stops in visiting order, each
+    with eta and late added, plus route totals.
+    """
+    start = start or datetime.datetime.utcnow()
+    if not stops:
+        return {"stops": [], "total_km": 0.0, "total_minutes": 0.0, "late_stops": 0, "lateness_minutes": 0.0}
+    p = _Problem(depot, stops, start, return_to_depot, speed_kmh, service_minutes)
+    order = _construct(p)
+    if improve and p.n > 2:
+        order = _two_opt(p, order, max_improve_ms)
+
+    arrive = p.arrivals(order)
+    planned = []
+    for position, node in enumerate(order):
+        stop = dict(stops[node - 1])
+        stop["eta"] = start + datetime.timedelta(minutes=float(arrive[position]))
+        stop["late"] = bool(arrive[position] > p.deadline[node] + EPSILON)
+        planned.append(stop)
+    return {
+        "stops": planned,
+        "total_km": round(p.length(order), 2),
+        "total_minutes": round(float(arrive[-1]) + (0.0 if return_to_depot else service_minutes), 1),
+        "late_stops": sum(s["late"] for s in planned),
+        "lateness_minutes": round(p.lateness(order), 1),
+    }
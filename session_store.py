@@ -0,0 +1,125 @@
+# session_store.py
+# Server-side sessions for the Streamlit app. st.session_state only carries a
+# random session ID; the signed-in user lives here, one small SessionUser per
+# session:
+#
+#   login(session_id, row)   after the password check
+#   get(session_id)          the signed-in SessionUser, or None
+#   logout(session_id)
+#
+# A SessionUser keeps just the fields nearly every page reads (id, email,
+# name, user_type). Other columns such as phone are read from the users table
+# the first time a page asks for them, and the password hash is never kept.
+# Core fields are re-read after profile edits (the "users" write generation)
+# and at least every REFRESH_SECONDS. Sessions idle for session_ttl_minutes
+# are evicted.
+import collections
+import threading
+import time
+
+from auth import get_user_by_id
+from db import get_setting, get_generation
+from log_utils import get_logger
+
+log = get_logger("session_store")
+
+SESSION_TTL_SECONDS = float(get_setting("session_ttl_minutes", 120)) * 60
+REFRESH_SECONDS = 300
+CORE_FIELDS = ("id", "email", "name", "user_type")
+PRIVATE_FIELDS = ("password_hash",)
+
+class SessionUser:
+    """
+    The signed-in user. Reads like the users row it came from (user["id"],
+    user.get("phone")), but only CORE_FIELDS are stored up front; the rest are
+    loaded on first access. password_hash is never available.
+    """
+    __slots__ = CORE_FIELDS + ("_profile", "_loaded_at", "_generation")
+
+    def __init__(self, row):
+        for field in CORE_FIELDS:
+            setattr(self, field, row[field])
+        self._profile = None
+        self._loaded_at = time.monotonic()
+        self._generation = get_generation("users")
+
+    def profile(self):
+        """The other users columns, read once per session (or refresh)."""
+        if self._profile is None:
+            row = get_user_by_id(self.id)
+            self._profile = {k: row[k] for k in row.keys()
+                             if k not in CORE_FIELDS and k not in PRIVATE_FIELDS} if row else {}
+        return self._profile
+
+    def __getitem__(self, key):
+        if key in CORE_FIELDS:
+            return getattr(self, key)
+        return self.profile()[key]
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return CORE_FIELDS + tuple(self.profile())
+
+    def is_stale(self):
+        return (self._generation != get_generation("users")
+                or time.monotonic() - self._loaded_at > REFRESH_SECONDS)
+
+    def __repr__(self):
+        return f"SessionUser(id={self.id!r}, email={self.email!r}, user_type={self.user_type!r})"
+
+_lock = threading.Lock()
+# session_id -> [SessionUser, last_seen]; oldest access first, so eviction
+# only looks at the front
+_sessions = collections.OrderedDict()
+
+def _evict(now):
+    while _sessions:
+        session_id, (_, last_seen) = next(iter(_sessions.items()))
+        if now - last_seen <= SESSION_TTL_SECONDS:
+            break
+        del _sessions[session_id]
+        log.debug("Session expired", extra={"session_id": session_id[:8]})
+
+def login(session_id, row):
+    """Starts (or replaces) the session's user from a users row. Returns the SessionUser."""
+    user = SessionUser(row)
+    now = time.monotonic()
+    with _lock:
+        _evict(now)
+        _sessions[session_id] = [user, now]
+        _sessions.move_to_end(session_id)
+    return user
+
+def get(session_id):
+    """The session's SessionUser, refreshed from the database if stale; None if signed out or expired."""
+    now = time.monotonic()
+    with _lock:
+        _evict(now)
+        entry = _sessions.get(session_id)
+        if entry is None:
+            return None
+        entry[1] = now
+        _sessions.move_to_end(session_id)
+        user = entry[0]
+    if not user.is_stale():
+        return user
+    row = get_user_by_id(user.id)
+    if row is None:
+        # Account removed while signed in
+        logout(session_id)
+        return None
+    return login(session_id, row)
+
+def logout(session_id):
+    with _lock:
+        _sessions.pop(session_id, None)
+
+def active_sessions():
+    with _lock:
+        _evict(time.monotonic())
+        return len(_sessions)
@@ -0,0 +1,426 @@
+# shards.py
+# Regional shards for multi-city deployments. Listings and their claims are
+# stored per region in their own SQLite file (community_<name>.db next to the
+# main database), so a city's receiver queries only scan that city's tables
+# and one busy city's WAL checkpoints don't hold up the others. Everything
+# else (users, notifications, reviews, stats, rollups) stays in the main
+# database, which db.get_conn(shard) attaches to every shard connection as
+# `home`; the db.py functions route through here and keep their signatures.
+#
+# Regions come from the `shards` setting, e.g. in secrets.toml
+#
+#   [shards.bengaluru]
+#   id = 1                                   # never reuse or renumber
+#   bounds = [12.70, 77.30, 13.25, 77.90]    # south, west, north, east
+#
+# or FOOD_CIRCLE_SHARDS='{"bengaluru": {"id": 1, "bounds": [...]}}'. Without
+# it there is only the main database and every route below leads there.
+#
+#   shard_for(lat, lng)      a location's geocell decides its shard; cells
+#                            outside every region stay in the main database
+#   shards_for_box(...)      shards a search box touches: one, unless the box
+#                            crosses a region border
+#   shard_of_id(id, table)   each shard allocates listing and claim ids from
+#                            its own range (id // SHARD_SPAN is the shard id);
+#                            rows moved by rebalance() are found in shard_moves
+#   user_shards(user_id)     shards a user has listed or claimed in
+#
+#   python shards.py status
+#   python shards.py rebalance [--dry-run]    after adding or resizing regions
+#   python shards.py repair                   restore main-database rows a shard write missed
+import argparse
+import collections
+import json
+import math
+import os
+import re
+import sqlite3
+import threading
+
+from db import (
+    MAIN_SHARD, get_conn, get_read_conn, get_db_path, get_shard_path, get_setting,
+    get_generation, bump_generation,
+)
+from log_utils import get_logger
+from maps_utils import GEOCELL_SIZE
+
+log = get_logger("shards")
+
+SHARD_SPAN = 1_000_000_000  # shard N allocates ids from N * SHARD_SPAN; the main database stays below
+SHARDED_TABLES = ("listings", "claims")
+_NAME_RE = re.compile(r"^[a-z][a-z0-9_]*$")
+
+def _cell(lat, lng):
+    # Integer geocell indices, rounded like maps_utils.geocell()
+    return (math.floor(round(float(lat) / GEOCELL_SIZE, 9)),
+            math.floor(round(float(lng) / GEOCELL_SIZE, 9)))
+
+def _load_regions():
+    raw = get_setting("shards", None)
+    if not raw:
+        return {}
+    if isinstance(raw, str):
+        raw = json.loads(raw)
+    regions = {}
+    for name, spec in dict(raw).items():
+        spec = dict(spec)
+        shard_id = int(spec["id"])
+        south, west, north, east = (float(v) for v in spec["bounds"])
+        if not _NAME_RE.match(name) or name == MAIN_SHARD:
+            raise ValueError(f"shard name {name!r} must be lowercase letters, digits and _, and not {MAIN_SHARD!r}")
+        if shard_id < 1 or any(shard_id == r[0] for r in regions.values()):
+            raise ValueError(f"shard {name!r}: id must be a unique integer of at least 1")
+        if not (south < north and west < east):
+            raise ValueError(f"shard {name!r}: bounds are [south, west, north, east]")
+        # Snapped to whole geocells: a cell belongs to the region its south-west corner is in
+        regions[name] = (shard_id, *_cell(south, west), *_cell(north, east))
+    return dict(sorted(regions.items(), key=lambda item: item[1][0]))
+
+# name -> (id, south, west, north, east cell indices), in id order
+REGIONS = _load_regions()
+_NAMES_BY_ID = {region[0]: name for name, region in REGIONS.items()}
+
+def names():
+    """Every shard, the main database first."""
+    return [MAIN_SHARD, *REGIONS]
+
+def shard_for(lat, lng):
+    """The shard that stores a listing at (lat, lng)."""
+    if not REGIONS or lat is None or lng is None:
+        return MAIN_SHARD
+    i, j = _cell(lat, lng)
+    for name, (_, south, west, north, east) in REGIONS.items():
+        if south <= i < north and west <= j < east:
+            return name
+    return MAIN_SHARD
+
+def shards_for_box(south, west, north, east):
+    """Shards that can hold listings inside a lat/lng box."""
+    if not REGIONS:
+        return [MAIN_SHARD]
+    s, w = _cell(south, west)
+    n, e = _cell(north, east)
+    touched, inside = [], False
+    for name, (_, rs, rw, rn, re_) in REGIONS.items():
+        if rs <= n and s < rn and rw <= e and w < re_:
+            touched.append(name)
+            inside = inside or (rs <= s and n < rn and rw <= w and e < re_)
+    # A box that sticks out of the regions also needs the main database
+    return touched if inside else [MAIN_SHARD, *touched]
+
+# --- Where rows live ---
+
+_moves = None
+_moves_generation = None
+_moves_lock = threading.Lock()
+
+def _load_moves():
+    conn = get_read_conn(allow_snapshot=False)
+    try:
+        rows = conn.execute("SELECT tbl, id, shard FROM shard_moves").fetchall()
+    except sqlite3.OperationalError:
+        rows = []  # not created yet
+    finally:
+        conn.close()
+    return {(row["tbl"], row["id"]): row["shard"] for row in rows}
+
+def _get_moves():
+    global _moves, _moves_generation
+    generation = get_generation("shards")
+    if _moves is None or _moves_generation != generation:
+        with _moves_lock:
+            if _moves is None or _moves_generation != generation:
+                _moves, _moves_generation = _load_moves(), generation
+    return _moves
+
+def _home_shard(record_id):
+    return _NAMES_BY_ID.get(record_id // SHARD_SPAN, MAIN_SHARD)
+
+def shard_of_id(record_id, table="listings"):
+    """The shard holding a listing (table="listings") or a claim ("claims")."""
+    if not REGIONS:
+        return MAIN_SHARD
+    record_id = int(record_id)
+    return _get_moves().get((table, record_id)) or _home_shard(record_id)
+
+def user_shards(user_id):
+    """The main database plus every region the user has listed or claimed in."""
+    if not REGIONS:
+        return [MAIN_SHARD]
+    conn = get_read_conn(allow_snapshot=False)
+    used = {row["shard"] for row in conn.execute("SELECT shard FROM shard_users WHERE user_id = ?", (user_id,))}
+    conn.close()
+    return [MAIN_SHARD, *(name for name in REGIONS if name in used)]
+
+def record_user(cur, user_id, shard):
+    """Notes, in the caller's transaction, that user_id has rows in shard (for user_shards())."""
+    if shard != MAIN_SHARD and user_id is not None:
+        cur.execute("INSERT OR IGNORE INTO shard_users (user_id, shard) VALUES (?, ?)", (user_id, shard))
+
+# --- Connections over several shards ---
+
+def attach(conn, primary, shards):
+    """
+    Attaches `shards` to a get_conn(primary) connection. Returns {shard: schema}
+    for qualifying table names: "main" for primary, "home" for the main
+    database, "shard_<name>" for the others.
+    """
+    schemas = {primary: "main"}
+    if primary != MAIN_SHARD:
+        schemas[MAIN_SHARD] = "home"
+    for name in shards:
+        if name not in schemas:
+            conn.execute(f"ATTACH DATABASE ? AS shard_{name}", (get_shard_path(name),))
+            schemas[name] = f"shard_{name}"
+    if len(schemas) > 1:
+        # Shard tables reference users(id), which is only in home; SQLite cannot check that across files
+        conn.execute("PRAGMA foreign_keys = OFF;")
+    return schemas
+
+def connect_all():
+    """
+    A main-database connection with every shard attached and TEMP views
+    all_listings / all_claims over all of them. For offline jobs that need the
+    whole history (backfills, exports); live paths route to single shards.
+    """
+    conn = get_conn()
+    # Shard files appear with ensure_shards(); a backfill during the first migration may run before
+    schemas = attach(conn, MAIN_SHARD, [name for name in REGIONS if os.path.exists(get_shard_path(name))])
+    for table in SHARDED_TABLES:
+        columns = ", ".join(row["name"] for row in conn.execute(f"PRAGMA main.table_info({table})"))
+        conn.execute(f"CREATE TEMP VIEW all_{table} AS " + " UNION ALL ".join(
+            f"SELECT {columns} FROM {schema}.{table}" for schema in schemas.values()))
+    return conn
+
+# --- Schema ---
+
+def create_shard_tables_if_not_exists():
+    """Creates the routing tables in the main database."""
+    conn = get_conn()
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS shard_moves (
+            tbl TEXT NOT NULL,
+            id INTEGER NOT NULL,
+            shard TEXT NOT NULL,
+            PRIMARY KEY (tbl, id)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS shard_users (
+            user_id INTEGER NOT NULL,
+            shard TEXT NOT NULL,
+            PRIMARY KEY (user_id, shard)
+        ) WITHOUT ROWID
+    """)
+    conn.commit()
+    conn.close()
+
+def ensure_shards():
+    """
+    Creates missing shard files and brings existing ones up to the main
+    database's listings/claims schema (tables, added columns, indexes). Run it
+    after the startup migrations, which only touch the main database.
+    """
+    create_shard_tables_if_not_exists()
+    if not REGIONS:
+        return
+    home = get_conn()
+    schema = home.execute(f"""
+        SELECT type, name, sql FROM sqlite_master
+        WHERE tbl_name IN ({",".join("?" * len(SHARDED_TABLES))}) AND sql IS NOT NULL
+        ORDER BY type = 'index'
+    """, SHARDED_TABLES).fetchall()
+    columns = {table: home.execute(f"PRAGMA table_info({table})").fetchall() for table in SHARDED_TABLES}
+    home.close()
+
+    for name, (shard_id, *_) in REGIONS.items():
+        conn = get_conn(name)
+        cur = conn.cursor()
+        existing = {row["name"] for row in cur.execute("SELECT name FROM main.sqlite_master")}
+        for row in schema:
+            if row["name"] not in existing:
+                cur.execute(row["sql"])
+                log.info("Created %s %s in shard %s", row["type"], row["name"], name)
+        for table, table_columns in columns.items():
+            have = {row["name"] for row in cur.execute(f"PRAGMA main.table_info({table})")}
+            for col in table_columns:
+                if col["name"] not in have:
+                    default = f" DEFAULT {col['dflt_value']}" if col["dflt_value"] is not None else ""
+                    cur.execute(f"ALTER TABLE main.{table} ADD COLUMN {col['name']} {col['type']}{default}")
+                    log.info("Added %s.%s to shard %s", table, col["name"], name)
+        # Start this shard's AUTOINCREMENT ids at its own range
+        for table in SHARDED_TABLES:
+            row = cur.execute("SELECT seq FROM main.sqlite_sequence WHERE name = ?", (table,)).fetchone()
+            if row is None:
+                cur.execute("INSERT INTO main.sqlite_sequence (name, seq) VALUES (?, ?)", (table, shard_id * SHARD_SPAN))
+            elif row["seq"] < shard_id * SHARD_SPAN:
+                cur.execute("UPDATE main.sqlite_sequence SET seq = ? WHERE name = ?", (shard_id * SHARD_SPAN, table))
+        conn.commit()
+        conn.close()
+
+# --- Tooling ---
+
+def _path(shard):
+    return get_db_path() if shard == MAIN_SHARD else get_shard_path(shard)
+
+def status():
+    """Per shard: file size, listings (all / available), claims, and listings stored in the wrong shard."""
+    report = []
+    for name in names():
+        conn = get_read_conn(allow_snapshot=False, shard=name)
+        listings, available = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(status = 'AVAILABLE'), 0) FROM listings").fetchone()
+        claims = conn.execute("SELECT COUNT(*) FROM claims").fetchone()[0]
+        misplaced = sum(1 for row in conn.execute("SELECT lat, lng FROM listings")
+                        if shard_for(row["lat"], row["lng"]) != name)
+        conn.close()
+        path = _path(name)
+        report.append({
+            "shard": name, "path": path, "size_mb": round(os.path.getsize(path) / 1e6, 1),
+            "listings": listings, "available": available, "claims": claims, "misplaced": misplaced,
+        })
+    return report
+
+def _routed_to(target, listing_ids):
+    # The listings whose ids already route to target (shard_moves, else their id range)
+    conn = get_read_conn(allow_snapshot=False)
+    marks = ",".join("?" * len(listing_ids))
+    moves = dict(conn.execute(
+        f"SELECT id, shard FROM shard_moves WHERE tbl = 'listings' AND id IN ({marks})", listing_ids).fetchall())
+    conn.close()
+    return {i for i in listing_ids if moves.get(i, _home_shard(i)) == target}
+
+def _move(source, target, listing_ids):
+    """
+    Moves listings and their claims from source to target. WAL does not commit
+    attached files atomically, so each step commits one file, in an order that
+    never leaves a row in neither place: the rows are copied into target, then
+    shard_moves/shard_users in the main database switch reads and writes over,
+    then the source rows are deleted. The source stays write-locked throughout,
+    so the copy is final. After a crash, moving the same listings again (the
+    next rebalance() finds them still misplaced) redoes an unfinished copy, or
+    just deletes the leftovers of listings already switched over.
+    """
+    marks = ",".join("?" * len(listing_ids))
+    src = get_conn(source)
+    if source != MAIN_SHARD:
+        src.execute("DETACH DATABASE home")  # BEGIN IMMEDIATE would lock it too
+    cur = src.cursor()
+    try:
+        cur.execute("BEGIN IMMEDIATE;")
+        pending = [i for i in listing_ids if i not in _routed_to(target, listing_ids)]
+        if pending:
+            pending_marks = ",".join("?" * len(pending))
+            claims = cur.execute(
+                f"SELECT id, receiver_id FROM claims WHERE listing_id IN ({pending_marks})", pending).fetchall()
+            donors = [row[0] for row in cur.execute(
+                f"SELECT DISTINCT donor_id FROM listings WHERE id IN ({pending_marks})", pending)]
+
+            # 1. Copy; an earlier, unfinished attempt's rows are overwritten (an upsert, so no cascading deletes)
+            dst = get_conn(target)
+            try:
+                schema = attach(dst, target, [source])[source]
+                dst.execute("BEGIN;")  # deferred: only target is written, and source is locked above
+                for table, key in (("listings", "id"), ("claims", "listing_id")):
+                    columns = [row["name"] for row in dst.execute(f"PRAGMA main.table_info({table})")]
+                    dst.execute(f"""
+                        INSERT INTO main.{table} ({", ".join(columns)})
+                        SELECT {", ".join(columns)} FROM {schema}.{table} WHERE {key} IN ({pending_marks})
+                        ON CONFLICT(id) DO UPDATE SET {", ".join(f"{c} = excluded.{c}" for c in columns if c != "id")}
+                    """, pending)
+                dst.commit()
+            except Exception:
+                dst.rollback()
+                raise
+            finally:
+                dst.close()
+
+            # 2. Switch routing; with source the main database this joins the delete below
+            home = src if source == MAIN_SHARD else get_conn()
+            try:
+                if home is not src:
+                    home.execute("BEGIN IMMEDIATE;")
+                # Ids keep pointing at their original shard unless a move says otherwise
+                for table, ids in (("listings", pending), ("claims", [row[0] for row in claims])):
+                    home.executemany("""
+                        INSERT INTO shard_moves (tbl, id, shard) VALUES (?, ?, ?)
+                        ON CONFLICT(tbl, id) DO UPDATE SET shard = excluded.shard
+                    """, [(table, i, target) for i in ids if _home_shard(i) != target])
+                    home.executemany("DELETE FROM shard_moves WHERE tbl = ? AND id = ?",
+                                     [(table, i) for i in ids if _home_shard(i) == target])
+                if target != MAIN_SHARD:
+                    users = {*donors, *(row[1] for row in claims)} - {None}
+                    home.executemany("INSERT OR IGNORE INTO shard_users (user_id, shard) VALUES (?, ?)",
+                                     [(user_id, target) for user_id in users])
+                if home is not src:
+                    home.commit()
+            except Exception:
+                if home is not src:
+                    home.rollback()
+                raise
+            finally:
+                if home is not src:
+                    home.close()
+
+        # 3. The target has every row now; drop the source's
+        cur.execute(f"DELETE FROM claims WHERE listing_id IN ({marks})", listing_ids)
+        cur.execute(f"DELETE FROM listings WHERE id IN ({marks})", listing_ids)
+        src.commit()
+    except Exception:
+        src.rollback()
+        raise
+    finally:
+        src.close()
+    bump_generation("shards")
+
+def rebalance(dry_run=False, chunk=500):
+    """
+    Moves listings, with their claims, whose location now routes to another
+    shard, e.g. after a region was added or resized. Ids do not change; the
+    new location is recorded in shard_moves. An interrupted run is finished by
+    running it again (see _move()). Returns {(from, to): listings}.
+    """
+    moved = collections.Counter()
+    for source in names():
+        conn = get_read_conn(allow_snapshot=False, shard=source)
+        targets = collections.defaultdict(list)
+        for row in conn.execute("SELECT id, lat, lng FROM listings"):
+            target = shard_for(row["lat"], row["lng"])
+            if target != source:
+                targets[target].append(row["id"])
+        conn.close()
+        for target, ids in targets.items():
+            moved[(source, target)] += len(ids)
+            if dry_run:
+                continue
+            for start in range(0, len(ids), chunk):
+                _move(source, target, ids[start:start + chunk])
+            log.info("Moved listings between shards", extra={"from": source, "to": target, "listings": len(ids)})
+    if moved and not dry_run:
+        bump_generation("shards", "listings", "claims")
+    return moved
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect and rebalance regional shards")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("status", help="rows and size per shard")
+    rebalance_parser = sub.add_parser("rebalance", help="move listings to the shard their location routes to")
+    rebalance_parser.add_argument("--dry-run", action="store_true", help="only count what would move")
+    sub.add_parser("repair", help="restore shard_users and ledger rows shard writes committed without")
+    args = parser.parse_args()
+
+    ensure_shards()
+    if args.command == "status":
+        print(f"{'shard':<16}{'size MB':>9}{'listings':>10}{'available':>11}{'claims':>9}{'misplaced':>11}")
+        for row in status():
+            print(f"{row['shard']:<16}{row['size_mb']:>9}{row['listings']:>10}{row['available']:>11}"
+                  f"{row['claims']:>9}{row['misplaced']:>11}")
+    elif args.command == "repair":
+        from db import repair_home_effects
+        print(f"Restored {repair_home_effects()} ledger events")
+    else:
+        moved = rebalance(dry_run=args.dry_run)
+        for (source, target), count in sorted(moved.items()):
+            print(f"{source} -> {target}: {count} listings{' (dry run)' if args.dry_run else ''}")
+        if not moved:
+            print("Every listing is in its shard.")
@@ -0,0 +1,17 @@
+import sqlite3
+
+from instrumentation import InstrumentedConnection, InstrumentedCursor, REGISTRY, fingerprint
+
+def test_connection_execute_is_instrumented():
+    conn = sqlite3.connect(":memory:", factory=InstrumentedConnection)
+    conn.execute("CREATE TABLE t (id INTEGER PRIMARY KEY, name TEXT)")
+    conn.executemany("INSERT INTO t (name) VALUES (?)", [("a",), ("b",), ("c",)])
+    sql = "SELECT id, name FROM t WHERE id > 0 ORDER BY id"
+    cur = conn.execute(sql)
+    assert isinstance(cur, InstrumentedCursor)
+    assert len(cur.fetchall()) == 3
+    conn.close()
+
+    queries = REGISTRY.snapshot()["queries"]
+    assert queries[fingerprint(sql)]["rows"] == 3
+    assert fingerprint("INSERT INTO t (name) VALUES (?)") in queries
@@ -0,0 +1,228 @@
+# urgency.py
+# Near-expiry food, kept in a min-heap by deadline so nothing has to rescan
+# listings to find what is about to go bad. A listing's deadline is its
+# expiry_ts (the end of a bare expiry date); cooked food without one is assumed
+# good for COOKED_SHELF_HOURS after posting, as in recommend.py.
+#
+#   expiring_soon(user_type)   the receiver page's "Expiring soon" section and
+#                              GET /api/listings/expiring, soonest first
+#   escalations                at each lead time of expiry_escalation_hours
+#                              ("6,2" by default) before the deadline, nearby
+#                              receivers (matching.py) are told about a
+#                              listing that is still available
+#
+# The heap is seeded from idx_listings_status_expiry_ts for the next HORIZON_HOURS
+# and then kept current from events.py, which carries every process's writes:
+# new listings go in, claimed and expired ones drop out. A resync every
+# RESYNC_SECONDS catches anything the feed missed. A background
+# thread sleeps until the next escalation is due; expiry_escalations records
+# what was sent, so each lead time fires once across processes and restarts.
+import heapq
+import threading
+import time
+
+import events
+import shards
+from db import (
+    get_setting, get_listing_by_id, get_available_listings_by_ids, get_listing_deadlines,
+    get_sent_escalations, claim_escalation, create_notifications_batch, from_epoch,
+)
+from log_utils import get_logger
+from recommend import COOKED_SHELF_HOURS
+
+log = get_logger("urgency")
+
+EXPIRING_SOON_HOURS = float(get_setting("expiring_soon_hours", 24))
+_leads = get_setting("expiry_escalation_hours", "6,2")
+# Longest lead first; an empty setting turns escalations off
+ESCALATION_LEAD_HOURS = sorted(
+    {float(h) for h in (_leads.split(",") if isinstance(_leads, str) else _leads) if str(h).strip()}, reverse=True)
+HORIZON_HOURS = max([EXPIRING_SOON_HOURS, *ESCALATION_LEAD_HOURS]) + 24  # deadlines seeded from the database
+RESYNC_SECONDS = 300
+ESCALATE_TOP_N = 10
+
+def deadline(expiry_ts, food_type=None, created_ts=None):
+    """Epoch seconds by which the food should be collected, or None if it has no deadline."""
+    if expiry_ts is not None:
+        return expiry_ts  # already the end of a bare expiry date (db.to_epoch)
+    if food_type == "cooked" and created_ts is not None:
+        return created_ts + COOKED_SHELF_HOURS * 3600
+    return None
+
+_cond = threading.Condition()
+_deadlines = {}   # listing_id -> deadline
+_heap = []        # (deadline, listing_id); entries for dropped or re-timed listings are skipped
+_alerts = []      # (fires_at, listing_id, lead_hours)
+_sent = set()     # (listing_id, lead_hours) already escalated
+_synced_at = 0.0
+_started = False
+
+def _track(listing_id, listing_deadline, now, catch_up):
+    # Caller holds _cond
+    if listing_deadline is None or listing_deadline <= now:
+        return
+    _deadlines[listing_id] = listing_deadline
+    heapq.heappush(_heap, (listing_deadline, listing_id))
+    overdue = None
+    for lead in ESCALATION_LEAD_HOURS:
+        fires_at = listing_deadline - lead * 3600
+        if fires_at > now:
+            heapq.heappush(_alerts, (fires_at, listing_id, lead))
+        else:
+            overdue = lead  # leads run longest first, so this ends on the most urgent one
+    # After a resync, send the most urgent lead time that has already passed
+    # (unless it was sent); a brand-new listing just had its match notifications
+    if catch_up and overdue is not None and (listing_id, overdue) not in _sent:
+        heapq.heappush(_alerts, (now, listing_id, overdue))
+
+def _apply(event):
+    # Caller holds _cond
+    if event["type"] == "listing.created":
+        _track(event["listing_id"], deadline(event.get("expiry_ts"), event.get("food_type"), event.get("created_ts")),
+               time.time(), catch_up=False)
+    elif event["type"] == "listing.removed":
+        _deadlines.pop(event["listing_id"], None)
+
+def _on_event(event):
+    with _cond:
+        _apply(event)
+        _cond.notify()
+
+def _prune(now):
+    # Caller holds _cond. Drops past deadlines and stale entries from the top of
+    # the heap, and compacts it once stale entries outnumber live ones.
+    while _heap:
+        listing_deadline, listing_id = _heap[0]
+        if _deadlines.get(listing_id) == listing_deadline and listing_deadline > now:
+            break
+        heapq.heappop(_heap)
+        if _deadlines.get(listing_id) == listing_deadline:
+            del _deadlines[listing_id]
+    if len(_heap) > 2 * len(_deadlines) + 64:
+        _heap[:] = [(d, lid) for lid, d in _deadlines.items()]
+        heapq.heapify(_heap)
+        _sent.difference_update([key for key in _sent if key[0] not in _deadlines])
+
+def _earliest(until, count):
+    # The first `count` live (deadline, listing_id) entries up to `until`, soonest
+    # first, without popping: a best-first walk down the heap, O(count log count)
+    found, frontier = [], [(_heap[0], 0)] if _heap else []
+    while frontier and len(found) < count:
+        (listing_deadline, listing_id), i = heapq.heappop(frontier)
+        if listing_deadline > until:
+            break
+        if _deadlines.get(listing_id) == listing_deadline:
+            found.append((listing_deadline, listing_id))
+        for child in (2 * i + 1, 2 * i + 2):
+            if child < len(_heap):
+                heapq.heappush(frontier, (_heap[child], child))
+    return found
+
+def resync():
+    """Reloads the heap from the database (deadlines in the next HORIZON_HOURS)."""
+    global _synced_at
+    now = time.time()
+    seq = events.last_seq()
+    rows = []
+    for shard in shards.names():
+        rows.extend(get_listing_deadlines(shard, now + HORIZON_HOURS * 3600, now - COOKED_SHELF_HOURS * 3600))
+    sent = get_sent_escalations(from_epoch(now - 2 * HORIZON_HOURS * 3600))
+    with _cond:
+        _deadlines.clear()
+        _heap.clear()
+        _alerts.clear()
+        _sent.clear()
+        _sent.update(sent)
+        for row in rows:
+            _track(row["id"], deadline(row["expiry_ts"], row["food_type"], row["created_ts"]), now, catch_up=True)
+        # Events that arrived while the rows were read
+        replay, _ = events.since(seq)
+        for event in replay:
+            _apply(event)
+        _synced_at = now
+        _cond.notify()
+    log.debug("Urgency heap loaded", extra={"listings": len(rows), "alerts": len(_alerts)})
+
+def start():
+    """Seeds the heap and starts the escalation thread (once per process)."""
+    global _started
+    with _cond:
+        if _started:
+            return
+        _started = True
+    events.subscribe(_on_event)
+    try:
+        resync()
+    except Exception:
+        # The thread retries; until then the feed is just empty
+        log.exception("Urgency heap not loaded")
+    threading.Thread(target=_watch, name="expiry-escalations", daemon=True).start()
+
+def expiring_soon(user_type, hours=None, limit=10):
+    """
+    Available listings the user may see whose deadline is within `hours`
+    (expiring_soon_hours by default), soonest first, as Listings with hours_left.
+    """
+    start()
+    now = time.time()
+    hours = EXPIRING_SOON_HOURS if hours is None else hours
+    with _cond:
+        _prune(now)
+        # Spare candidates for ngo_only listings and ones claimed since the last event
+        soonest = _earliest(now + hours * 3600, limit * 3)
+    rows = get_available_listings_by_ids([listing_id for _, listing_id in soonest])
+    listings = []
+    for listing_deadline, listing_id in soonest:
+        row = rows.get(listing_id)
+        if row is None or (row["visibility"] == "ngo_only" and user_type != "NGO"):
+            continue
+        listings.append(row.copy(hours_left=(listing_deadline - now) / 3600))
+    return listings[:limit]
+
+def notify_expiring(listing_id, lead_hours):
+    """Sends the escalation for one lead time to nearby receivers. Returns how many were notified."""
+    import matching
+    listing = get_listing_by_id(listing_id)
+    if listing is None or listing["status"] != "AVAILABLE" or not claim_escalation(listing_id, lead_hours):
+        return 0
+    listing_deadline = deadline(listing["expiry_ts"], listing["food_type"], listing["created_ts"])
+    hours_left = max(1, round((listing_deadline - time.time()) / 3600)) if listing_deadline else lead_hours
+    title = listing["title"] or "Food available"
+    batch = [
+        {
+            "user_id": user_id,
+            "type": "expiring",
+            "title": "Food expiring soon",
+            "message": f"**{title}** ({distance:.1f} km away) has to be collected within about {hours_left:.0f} h.",
+            "related_listing_id": listing_id,
+            "related_user_id": listing["donor_id"],
+        }
+        for user_id, _, distance in matching.match_receivers(listing)[:ESCALATE_TOP_N]
+    ]
+    log.info("Expiry escalation", extra={"listing_id": listing_id, "lead_hours": lead_hours, "receivers": len(batch)})
+    return create_notifications_batch(batch)
+
+def _watch():
+    while True:
+        try:
+            if time.time() - _synced_at >= RESYNC_SECONDS:
+                resync()
+            now = time.time()
+            with _cond:
+                _prune(now)
+                # One escalation per listing per wake-up: its most urgent due lead time
+                due = {}
+                while _alerts and _alerts[0][0] <= now:
+                    _, listing_id, lead = heapq.heappop(_alerts)
+                    if listing_id in _deadlines and (listing_id, lead) not in _sent:
+                        _sent.add((listing_id, lead))
+                        due[listing_id] = min(lead, due.get(listing_id, lead))
+                if not due:
+                    next_at = min(_alerts[0][0] if _alerts else float("inf"), _synced_at + RESYNC_SECONDS)
+                    _cond.wait(timeout=max(0.0, next_at - now))
+                    continue
+            for listing_id, lead in due.items():
+                notify_expiring(listing_id, lead)
+        except Exception:
+            log.exception("Expiry escalations failed")
+            time.sleep(5)